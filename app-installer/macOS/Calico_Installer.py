@@ -2,6 +2,15 @@ import platform
 import shutil
 from pathlib import Path
 import sys
+import os
+import time
+import hashlib
+import struct
+import tempfile
+import threading
+import queue
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, TimeoutError as FutureTimeout
 import subprocess
 import tkinter as tk
 from tkinter import ttk
@@ -18,6 +27,47 @@ BASE_DIR = (
     else Path.home() / "Documents"
 )
 FQBN = "esp32:esp32:XIAO_ESP32S3"
+MANIFEST_NAME = ".calico_manifest.json"  # what the installer put in a destination tree
+IGNORED_NAMES = {".DS_Store", "Thumbs.db", "__pycache__", MANIFEST_NAME}
+COPY_WORKERS = 8
+HASH_CHUNK = 1024 * 1024
+BUILD_CACHE_DIR = BASE_DIR / "Arduino" / ".calico_build"  # stable build path + cached binaries
+BUILD_CACHE_KEEP = 3  # cached builds kept
+SKETCH_SUFFIXES = {".ino", ".h", ".hpp", ".c", ".cpp", ".S"}
+FLASHED_FILE = BUILD_CACHE_DIR / "flashed.json"  # board serial number -> build key on it
+FLASHED_LOCK = threading.Lock()
+FLASH_WORKERS = 16  # boards flashed at once, each by its own arduino-cli/esptool process
+IP_TIMEOUT = 90  # seconds a board gets to join WiFi and report its IP
+IP_ASK_INTERVAL = 2
+# Upper bounds for each install stage, in seconds. A stage that runs over
+# fails the install (and any tool it started is killed) instead of hanging.
+SYNC_TIMEOUT = 600
+DETECT_TIMEOUT = 60  # time to plug a board in; runs alongside the sync and compile
+COMPILE_TIMEOUT = 1200  # a first ESP32 build on a slow laptop takes minutes
+UPLOAD_TIMEOUT = 300
+ESPTOOL_TIMEOUT = 120
+TOOL_QUERY_TIMEOUT = 60
+POLL_MS = 100  # how often the UI drains progress events
+STAGE_LABELS = {
+    "libraries": "Libraries",
+    "project": "Project files",
+    "ports": "Boards",
+    "firmware": "Firmware",
+    "flash": "Flashing",
+}
+ESPTOOL = "esptool"
+NVS_OFFSET = 0x9000  # "nvs" partition in the ESP32-S3 default partition tables
+NVS_SIZE = 0x5000
+NVS_NAMESPACE = "calico"  # read by the firmware through Preferences
+NVS_PAGE_SIZE = 4096
+NVS_ENTRY_SIZE = 32
+NVS_PAGE_ENTRIES = 126
+NVS_PAGE_ACTIVE = 0xFFFFFFFE
+NVS_PAGE_FULL = 0xFFFFFFFC
+NVS_VERSION = 0xFE  # NVS format version 2
+NVS_TYPE_U8 = 0x01
+NVS_TYPE_STR = 0x21
+NVS_MAX_STR = 4000
 CONFIG_FILE = (
     BASE_DIR / "Arduino" / "config.json"
 )
@@ -75,31 +125,176 @@ def bootstrap_check():
 
     return arduino_path
 
+class Cancelled(Exception):
+    pass
+
+cancel_event = threading.Event()  # set to abandon the running install
+
+def check_cancelled():
+    if cancel_event.is_set():
+        raise Cancelled()
+
+def run_tool(args, timeout, what):
+    """
+    Run arduino-cli or esptool like subprocess.run(check=True), but kill
+    it if it runs past `timeout` seconds or the install is cancelled.
+    """
+    proc = subprocess.Popen(args)
+    deadline = time.monotonic() + timeout
+
+    try:
+        while True:
+            try:
+                code = proc.wait(timeout=0.2)
+                break
+            except subprocess.TimeoutExpired:
+                check_cancelled()
+
+                if time.monotonic() > deadline:
+                    raise Exception(f"{what} timed out after {timeout}s")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    if code != 0:
+        raise subprocess.CalledProcessError(code, args)
+
+def is_ignored(name):
+    return (
+        name in IGNORED_NAMES
+        or name.startswith("._")
+    )
+
+def file_digest(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def bundled_files(src):
+    files = []
+
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames[:] = [d for d in dirnames if not is_ignored(d)]
+
+        for name in filenames:
+            if not is_ignored(name):
+                path = Path(dirpath) / name
+                files.append(path.relative_to(src).as_posix())
+
+    return sorted(files)
+
+def load_manifest(dest):
+    try:
+        with open(dest / MANIFEST_NAME) as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(dest, files):
+    tmp = dest / (MANIFEST_NAME + ".tmp")
+
+    with open(tmp, "w") as f:
+        json.dump({"version": 1, "files": files}, f, indent=1, sort_keys=True)
+
+    os.replace(tmp, dest / MANIFEST_NAME)
+
+def sync_file(src, dest, rel, recorded):
+    """
+    Make dest/rel a verified copy of src/rel. Returns (action, entry).
+    """
+    source = src / rel
+    target = dest / rel
+    expected = file_digest(source)
+    size = source.stat().st_size
+
+    try:
+        st = target.stat()
+    except OSError:
+        st = None
+
+    if st is not None and st.st_size == size:
+        # Unchanged since we installed it: trust the recorded hash.
+        if (
+            recorded
+            and recorded.get("sha256") == expected
+            and recorded.get("mtime_ns") == st.st_mtime_ns
+        ):
+            return "unchanged", recorded
+
+        if file_digest(target) == expected:
+            return "unchanged", {"sha256": expected, "size": size, "mtime_ns": st.st_mtime_ns}
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    for attempt in range(2):
+        tmp = target.with_name(target.name + ".calico-tmp")
+        shutil.copyfile(source, tmp)
+
+        if file_digest(tmp) == expected:
+            os.replace(tmp, target)
+            st = target.stat()
+            action = "repaired" if recorded else "copied"
+            return action, {"sha256": expected, "size": size, "mtime_ns": st.st_mtime_ns}
+
+        tmp.unlink()
+
+    raise Exception(f"Copy of {rel} failed verification")
+
+def sync_tree(src, dest):
+    """
+    Install the bundled tree `src` into `dest`: copy only missing or
+    changed files (in parallel), verify each copy against the bundle's
+    SHA-256 and record what was installed in dest/.calico_manifest.json.
+    Re-running repairs a partial or damaged install. Files in `dest`
+    that are not ours are left alone.
+    """
+    started = time.monotonic()
+    dest.mkdir(parents=True, exist_ok=True)
+
+    recorded = load_manifest(dest)
+    files = bundled_files(src)
+    installed = {}
+    counts = {"unchanged": 0, "copied": 0, "repaired": 0, "removed": 0}
+
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+        def sync(rel):
+            check_cancelled()
+            return rel, sync_file(src, dest, rel, recorded.get(rel))
+
+        results = pool.map(sync, files)
+
+        for rel, (action, entry) in results:
+            installed[rel] = entry
+            counts[action] += 1
+
+    # Files an older version installed that are no longer bundled.
+    for rel in set(recorded) - set(installed):
+        try:
+            (dest / rel).unlink()
+            counts["removed"] += 1
+        except OSError:
+            pass
+
+    save_manifest(dest, installed)
+
+    print(
+        f"Synced {src.name} -> {dest}: {counts['copied']} copied, "
+        f"{counts['repaired']} repaired, {counts['unchanged']} unchanged, "
+        f"{counts['removed']} removed in {time.monotonic() - started:.1f}s"
+    )
+    return counts
+
 def install_libraries():
     src = get_resource("libraries")
 
     arduino_lib = BASE_DIR / "Arduino" / "libraries"
-    arduino_lib.mkdir(parents=True, exist_ok=True)
-
-    def ignore_files(dir, files):
-        ignored = []
-
-        for f in files:
-            if (
-                f == ".DS_Store"
-                or f.startswith("._")
-                or f == "Thumbs.db"
-            ):
-                ignored.append(f)
-
-        return ignored
-
-    shutil.copytree(
-        src,
-        arduino_lib,
-        dirs_exist_ok=True,
-        ignore=ignore_files
-    )
+
+    sync_tree(src, arduino_lib)
 
     print("Libraries installed to:", arduino_lib)
 
@@ -107,34 +302,168 @@ def install_project():
     src = get_resource("osu-v4")
 
     dest = BASE_DIR / "Arduino" / "osu-v4"
-    dest.mkdir(parents=True, exist_ok=True)
 
-    shutil.copytree(src, dest, dirs_exist_ok=True)
+    sync_tree(src, dest)
 
     print("Project installed:", dest)
     return dest
     
-def patch_ino_wifi(project_path, ssid, password):
-    ino_path = project_path / "osu-v4.ino"
+def nvs_crc(data):
+    return zlib.crc32(bytes(data), 0xFFFFFFFF) & 0xFFFFFFFF
+
+def nvs_entry(ns_index, entry_type, span, key, payload):
+    """
+    One 32-byte NVS entry: namespace index, type, span, chunk index
+    (unused), CRC, NUL-padded key and 8 bytes of value.
+    """
+    key_bytes = key.encode()
+
+    if len(key_bytes) > 15:
+        raise ValueError(f"NVS key too long: {key}")
+
+    entry = bytearray(b"\xff" * NVS_ENTRY_SIZE)
+    entry[0] = ns_index
+    entry[1] = entry_type
+    entry[2] = span
+    entry[8:24] = key_bytes.ljust(16, b"\0")
+    entry[24:24 + len(payload)] = payload
+    struct.pack_into("<I", entry, 4, nvs_crc(entry[0:4] + entry[8:32]))
+
+    return entry
+
+def nvs_string_entries(ns_index, key, value):
+    """
+    A string entry followed by the entries holding its NUL-terminated bytes.
+    """
+    data = value.encode() + b"\0"
+
+    if len(data) > NVS_MAX_STR:
+        raise ValueError(f"NVS string too long for {key}")
+
+    count = (len(data) + NVS_ENTRY_SIZE - 1) // NVS_ENTRY_SIZE
+    payload = struct.pack("<HHI", len(data), 0xFFFF, nvs_crc(data))
+    padded = data.ljust(count * NVS_ENTRY_SIZE, b"\xff")
+
+    return [nvs_entry(ns_index, NVS_TYPE_STR, count + 1, key, payload)] + [
+        padded[i:i + NVS_ENTRY_SIZE]
+        for i in range(0, len(padded), NVS_ENTRY_SIZE)
+    ]
+
+def nvs_page(seq, entries, state):
+    page = bytearray(b"\xff" * NVS_PAGE_SIZE)
+    struct.pack_into("<II", page, 0, state, seq)
+    page[8] = NVS_VERSION
+    struct.pack_into("<I", page, 28, nvs_crc(page[4:28]))
+
+    for i, entry in enumerate(entries):
+        page[32 + i // 4] &= ~(1 << (2 * i % 8)) & 0xFF  # entry state: written
+        offset = 64 + i * NVS_ENTRY_SIZE
+        page[offset:offset + NVS_ENTRY_SIZE] = entry
+
+    return page
+
+def nvs_image(namespace, values, size=NVS_SIZE):
+    """
+    An unencrypted NVS partition image holding the string `values` in
+    `namespace`, laid out byte for byte as ESP-IDF's nvs_partition_gen.py
+    writes it: used pages first, the last one active, the rest erased
+    (NVS needs one free page).
+    """
+    groups = [[nvs_entry(0, NVS_TYPE_U8, 1, namespace, bytes([1]))]]
+    groups += [nvs_string_entries(1, key, value) for key, value in values.items()]
+
+    pages = [[]]
+
+    for group in groups:
+        # Like nvs_partition_gen.py, multi-entry items leave the last slot free.
+        limit = NVS_PAGE_ENTRIES if len(group) == 1 else NVS_PAGE_ENTRIES - 1
+
+        if len(pages[-1]) + len(group) > limit:
+            pages.append([])
+
+        pages[-1].extend(group)
+
+    if len(pages) >= size // NVS_PAGE_SIZE:
+        raise ValueError("NVS data does not fit the partition")
+
+    image = bytearray()
+
+    for seq, entries in enumerate(pages):
+        state = NVS_PAGE_ACTIVE if seq == len(pages) - 1 else NVS_PAGE_FULL
+        image += nvs_page(seq, entries, state)
+
+    return bytes(image.ljust(size, b"\xff"))
+
+def find_esptool():
+    """
+    esptool as installed with the ESP32 core by arduino-cli, else one on PATH.
+    """
+    arduino_cli = str(get_resource("arduino-cli"))
+    result = subprocess.run(
+        [arduino_cli, "config", "dump", "--format", "json"],
+        capture_output=True,
+        text=True,
+        timeout=TOOL_QUERY_TIMEOUT
+    )
 
-    content = ino_path.read_text(encoding="utf-8")
+    try:
+        config = json.loads(result.stdout)
+    except ValueError:
+        config = {}
 
-    content = re.sub(
-        r'const char\* ssid = ".*?";',
-        f'const char* ssid = "{ssid}";',
-        content
-    )
+    config = config.get("config", config)
+    data_dir = config.get("directories", {}).get("data")
 
-    content = re.sub(
-        r'const char\* password = ".*?";',
-        f'const char* password = "{password}";',
-        content
-    )
+    if data_dir:
+        tools = sorted(
+            Path(data_dir).glob(f"packages/esp32/tools/esptool_py/*/{ESPTOOL}"),
+            reverse=True
+        )
 
-    ino_path.write_text(content, encoding="utf-8")
+        if tools:
+            return str(tools[0])
+
+    found = shutil.which("esptool") or shutil.which("esptool.py")
+
+    if found:
+        return found
+
+    raise Exception("esptool not found. Install the ESP32 core and try again.")
+
+def write_wifi_credentials(port, ssid, password):
+    """
+    Flash the WiFi settings as an NVS image over the board's nvs partition.
+    The firmware and the sketch are left alone, so a new network needs no
+    compile or upload.
+    """
+    if len(ssid.encode()) > 32 or len(password.encode()) > 64:
+        raise Exception("WiFi SSID is limited to 32 bytes and the password to 64.")
+
+    image = nvs_image(NVS_NAMESPACE, {"ssid": ssid, "password": password})
+    fd, image_path = tempfile.mkstemp(suffix=".bin")
+    started = time.monotonic()
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(image)
+
+        run_tool([
+            find_esptool(),
+            "--chip",
+            "esp32s3",
+            "--port",
+            port,
+            "--baud",
+            "921600",
+            "write_flash",
+            hex(NVS_OFFSET),
+            image_path
+        ], ESPTOOL_TIMEOUT, f"Writing WiFi settings to {port}")
+    finally:
+        os.unlink(image_path)
+
+    print(f"WiFi credentials written in {time.monotonic() - started:.1f}s")
 
-    print("Updated WiFi credentials in .ino")
-    
 def launch_arduino(project_path, arduino_path):
     ino_path = project_path / "osu-v4.ino"
 
@@ -154,44 +483,212 @@ def launch_arduino(project_path, arduino_path):
 
     print("Arduino IDE launched")
     
+def arduino_cli_json(arduino_cli, args):
+    result = subprocess.run(
+        [arduino_cli] + args + ["--format", "json"],
+        capture_output=True,
+        text=True,
+        timeout=TOOL_QUERY_TIMEOUT
+    )
+
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return {}
+
+def toolchain_fingerprint(arduino_cli):
+    """
+    arduino-cli's version and the installed version of the ESP32 core. Other
+    cores and index fields like latest_version are left out, so an index
+    update or an unrelated core install does not force a rebuild.
+    """
+    version = arduino_cli_json(arduino_cli, ["version"])
+    cores = arduino_cli_json(arduino_cli, ["core", "list"])
+
+    if isinstance(version, dict):
+        version = version.get("VersionString", "")
+
+    if isinstance(cores, dict):
+        cores = cores.get("platforms") or []  # arduino-cli 1.x
+
+    core_id = FQBN.rsplit(":", 1)[0]
+    installed = ""
+
+    for core in cores:
+        if isinstance(core, dict) and core.get("id") == core_id:
+            installed = core.get("installed_version") or core.get("installed") or ""
+
+    return f"{version}\n{core_id}@{installed}"
+
+def library_fingerprint(library_path):
+    """
+    Hash of the library set: the installer's manifest hashes for the files
+    it installed (see sync_tree), size and mtime for anything else.
+    """
+    recorded = load_manifest(library_path)
+    digest = hashlib.sha256()
+
+    for rel in bundled_files(library_path):
+        entry = recorded.get(rel)
+
+        if entry:
+            digest.update(f"{rel}\0{entry['sha256']}\n".encode())
+        else:
+            st = (library_path / rel).stat()
+            digest.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+
+    return digest.hexdigest()
+
+def sketch_fingerprint(project_path):
+    """
+    Hash of the files arduino-cli compiles: sources in the sketch folder
+    and its src/ tree (not data/ or pics/).
+    """
+    digest = hashlib.sha256()
+
+    for rel in bundled_files(project_path):
+        top = rel.split("/")[0]
+
+        if Path(rel).suffix in SKETCH_SUFFIXES and ("/" not in rel or top == "src"):
+            digest.update(f"{rel}\0{file_digest(project_path / rel)}\n".encode())
+
+    return digest.hexdigest()
+
+def build_key(arduino_cli, project_path, library_path):
+    digest = hashlib.sha256()
+
+    for part in (
+        FQBN,
+        toolchain_fingerprint(arduino_cli),
+        library_fingerprint(library_path),
+        sketch_fingerprint(project_path),
+    ):
+        digest.update(part.encode())
+        digest.update(b"\0")
+
+    return digest.hexdigest()[:16]
+
+def prune_build_cache(keep):
+    outputs = BUILD_CACHE_DIR / "out"
+    builds = sorted(
+        (d for d in outputs.iterdir() if d.is_dir()),
+        key=lambda d: d.stat().st_mtime,
+        reverse=True
+    )
+
+    for old in builds[keep:]:
+        shutil.rmtree(old, ignore_errors=True)
+
 def compile_firmware(project_path):
+    """
+    Compile the sketch unless an identical build (same sources, libraries,
+    FQBN and toolchain) is already cached. Returns the directory holding
+    the binaries, for upload_firmware.
+    """
     arduino_cli = str(get_resource("arduino-cli"))
     library_path = BASE_DIR / "Arduino" / "libraries"
 
-    print("Compiling firmware...")
+    key = build_key(arduino_cli, project_path, library_path)
+    output_dir = BUILD_CACHE_DIR / "out" / key
+    meta_file = output_dir / "build.json"
+
+    if meta_file.exists() and any(output_dir.glob("*.bin")):
+        meta = json.loads(meta_file.read_text())
+        os.utime(output_dir)  # most recently used, for pruning
+        print(
+            f"Build cache hit ({key}): skipping compile, "
+            f"saved ~{meta.get('compile_seconds', 0):.0f}s"
+        )
+        return output_dir
+
+    print(f"Build cache miss ({key}). Compiling firmware...")
+    started = time.monotonic()
 
-    subprocess.run([
+    # A stable build path keeps arduino-cli's object files between runs,
+    # so even a cache miss only recompiles what changed.
+    run_tool([
         arduino_cli,
         "compile",
         "--fqbn",
         FQBN,
         "--libraries",
         str(library_path),
+        "--build-path",
+        str(BUILD_CACHE_DIR / "build"),
+        "--output-dir",
+        str(output_dir),
         str(project_path)
-    ], check=True)
+    ], COMPILE_TIMEOUT, "Compiling firmware")
+
+    seconds = time.monotonic() - started
+    meta_file.write_text(json.dumps(
+        {"key": key, "fqbn": FQBN, "compile_seconds": round(seconds, 1), "built_at": time.time()},
+        indent=4
+    ))
+    prune_build_cache(BUILD_CACHE_KEEP)
 
-    print("Compile successful")
+    print(f"Compile successful in {seconds:.0f}s")
+    return output_dir
     
-def upload_firmware(project_path, port):
+def upload_firmware(project_path, port, input_dir):
     arduino_cli = str(get_resource("arduino-cli"))
     print("Uploading firmware...")
 
-    subprocess.run([
+    run_tool([
         arduino_cli,
         "upload",
         "-p",
         port,
         "--fqbn",
         FQBN,
+        "--input-dir",
+        str(input_dir),
         str(project_path)
-    ], check=True)
+    ], UPLOAD_TIMEOUT, f"Uploading firmware to {port}")
 
     print("Upload successful")
+
+def board_serial(port):
+    for info in list_ports.comports():
+        if info.device == port:
+            return info.serial_number
+
+    return None
+
+def load_flashed():
+    try:
+        with open(FLASHED_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def ensure_firmware(project_path, port, build_dir):
+    """
+    Upload the build unless the installer already put this exact build on
+    this board (known by its USB serial number). Returns True if uploaded.
+    """
+    serial_number = board_serial(port)
+
+    if serial_number and load_flashed().get(serial_number) == build_dir.name:
+        print(f"Board {serial_number} already runs build {build_dir.name}; skipping upload")
+        return False
+
+    upload_firmware(project_path, port, build_dir)
+
+    if serial_number:
+        with FLASHED_LOCK:
+            flashed = load_flashed()
+            flashed[serial_number] = build_dir.name
+            FLASHED_FILE.parent.mkdir(parents=True, exist_ok=True)
+            FLASHED_FILE.write_text(json.dumps(flashed, indent=4))
+
+    return True
     
-def detect_esp32_port():
+def detect_esp32_ports():
     ports = list_ports.comports()
+    found = []
 
-    for port in ports:
+    for port in sorted(ports, key=lambda p: p.device):
         desc = port.description.lower()
 
         if (
@@ -202,46 +699,325 @@ def detect_esp32_port():
             or "usbmodem" in port.device
         ):
             print("ESP32 found on:", port.device)
-            return port.device
+            found.append(port.device)
 
-    raise Exception("ESP32 board not found")
+    if not found:
+        raise Exception("ESP32 board not found")
 
-def wait_for_esp32_ip(port):
-    print("Waiting for ESP32 IP...")
+    return found
 
-    ser = serial.Serial(port, 115200, timeout=1)
+def detect_esp32_port():
+    return detect_esp32_ports()[0]
 
-    while True:
-        line = ser.readline().decode(errors="ignore").strip()
+def wait_for_ports(all_boards, timeout=DETECT_TIMEOUT):
+    """
+    Detect the board(s), polling until one is plugged in or `timeout`
+    seconds pass.
+    """
+    deadline = time.monotonic() + timeout
 
-        if line:
-            print(line)
+    while True:
+        check_cancelled()
+
+        try:
+            ports = detect_esp32_ports()
+            return ports if all_boards else ports[:1]
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(1)
+
+def wait_for_esp32_ip(port, timeout=IP_TIMEOUT):
+    """
+    Read the board's ESP32_IP= line, asking again with GET_IP in case it
+    was printed before the port was open. Gives up after `timeout` seconds.
+    Returns (ip, mac); mac is None if the ESP32_MAC= line was missed.
+    """
+    print(f"{port}: waiting for ESP32 IP...")
+
+    deadline = time.monotonic() + timeout
+    asked = 0
+    ser = None
+    mac = None
 
-        match = re.search(
-            r"ESP32_IP=([0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)",
-            line
+    try:
+        while time.monotonic() < deadline:
+            check_cancelled()
+
+            if ser is None:
+                try:
+                    ser = serial.Serial(port, 115200, timeout=1)
+                except serial.SerialException:
+                    time.sleep(0.5)  # still re-enumerating after the reset
+                    continue
+
+            try:
+                if time.monotonic() - asked > IP_ASK_INTERVAL:
+                    ser.write(b"GET_IP\n")
+                    asked = time.monotonic()
+
+                line = ser.readline().decode(errors="ignore").strip()
+            except serial.SerialException:
+                ser.close()
+                ser = None
+                continue
+
+            if line:
+                print(f"{port}: {line}")
+
+            match = re.search(r"ESP32_MAC=((?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2})", line)
+
+            if match:
+                mac = match.group(1).upper()
+
+            match = re.search(
+                r"ESP32_IP=([0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)",
+                line
+            )
+
+            if match:
+                ip = match.group(1)
+
+                print(f"{port}: ESP32 IP:", ip)
+
+                return ip, mac
+    finally:
+        if ser is not None:
+            ser.close()
+
+    raise Exception(f"No IP from {port} after {timeout}s (check the WiFi name and password)")
+
+def flash_board(project_path, port, build, ssid, password):
+    """
+    One board: WiFi settings first (they do not depend on the firmware, so
+    this overlaps the compile), then the firmware from the `build` future
+    if the board needs it, then its IP.
+    """
+    write_wifi_credentials(port, ssid, password)
+    build_dir = build.result()
+    check_cancelled()
+    uploaded = ensure_firmware(project_path, port, build_dir)
+    ip, mac = wait_for_esp32_ip(port)
+
+    return {"port": port, "serial": board_serial(port), "mac": mac, "ip": ip, "uploaded": uploaded}
+
+def flash_boards(project_path, ports, build, ssid, password, progress=None):
+    """
+    Flash every board in `ports` at once from the same build (a future
+    that may still be compiling) and collect their IPs. Each board's upload
+    and esptool run is a separate process, so they proceed in parallel.
+    `progress(done, failed, total)` is called while waiting. Returns
+    (boards, errors) with errors keyed by port.
+    """
+    boards = []
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=min(FLASH_WORKERS, len(ports))) as pool:
+        futures = {
+            pool.submit(flash_board, project_path, port, build, ssid, password): port
+            for port in ports
+        }
+        pending = set(futures)
+        reported = None
+
+        while pending:
+            finished, pending = wait(pending, timeout=0.1)
+
+            for future in finished:
+                try:
+                    boards.append(future.result())
+                except Exception as e:
+                    errors[futures[future]] = str(e)
+                    print(f"{futures[future]}: failed: {e}")
+
+            counts = (len(boards), len(errors))
+
+            if progress is not None and counts != reported:
+                progress(len(boards), len(errors), len(ports))
+                reported = counts
+
+    boards.sort(key=lambda b: b["port"])
+    return boards, errors
+
+def load_config():
+    try:
+        with open(CONFIG_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def same_board(entry, board):
+    """
+    Whether a saved robot entry is this board: by USB serial number, else
+    (boards whose USB bridge has none) by the MAC the firmware reports,
+    else by port.
+    """
+    if board["serial"] or entry.get("serial"):
+        return entry.get("serial") == board["serial"]
+
+    if board["mac"] or entry.get("mac"):
+        return entry.get("mac") == board["mac"]
+
+    return entry.get("port") == board["port"]
+
+def save_config(boards):
+    """
+    Record the boards flashed in this run for the launcher and server: one
+    board as "esp_ip", several as a "robots" map (and no "esp_ip", which
+    would register the first board a second time). Boards from earlier runs
+    are not carried over, but a board seen before keeps its id.
+    """
+    previous = load_config().get("robots", {})
+    robots = {}
+
+    for board in boards:
+        robot_id = next(
+            (rid for rid, entry in previous.items() if rid not in robots and same_board(entry, board)),
+            None
         )
 
-        if match:
-            ip = match.group(1)
+        if robot_id is None:
+            n = 1
 
-            print("ESP32 IP:", ip)
+            while f"r{n}" in robots or f"r{n}" in previous:
+                n += 1
+
+            robot_id = f"r{n}"
+
+        robots[robot_id] = {
+            "ip": board["ip"],
+            "serial": board["serial"],
+            "mac": board["mac"],
+            "port": board["port"]
+        }
+
+    if len(robots) > 1:
+        config = {"robots": robots}
+    else:
+        config = {"esp_ip": boards[0]["ip"]}
 
-            return ip
-    
-def save_config(esp_ip):
     CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
 
     with open(CONFIG_FILE, "w") as f:
-        json.dump(
-            {
-                "esp_ip": esp_ip
-            },
-            f,
-            indent=4
-        )
-    
+        json.dump(config, f, indent=4)
+
+def stage_result(future, timeout, what):
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        raise Exception(f"{what} timed out after {timeout}s")
+
+def run_install(ssid, password, all_boards, post):
+    """
+    The whole install, run off the UI thread. Independent stages overlap:
+    libraries, project files and board detection run together, and each
+    board gets its WiFi settings while the firmware compiles. Every stage
+    is bounded by a timeout and stops at the next check once cancel_event
+    is set. `post(stage, text)` reports progress. Returns a summary line.
+    """
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=4) as stages:
+        def stage(name, running, fn, *args, done=lambda result: "done"):
+            post(name, running)
+            future = stages.submit(fn, *args)
+            future.add_done_callback(
+                lambda f: post(name, done(f.result()) if f.exception() is None else "failed")
+            )
+            return future
+
+        try:
+            # Always synced: only missing or changed files are copied, so
+            # this is quick on a re-run and repairs a partial install.
+            libraries = stage("libraries", "installing...", install_libraries)
+            project = stage("project", "installing...", install_project)
+            ports = stage(
+                "ports", "looking for ESP32...", wait_for_ports, all_boards,
+                done=lambda found: f"{len(found)} found"
+            )
+
+            project_path = stage_result(project, SYNC_TIMEOUT, "Installing project files")
+            ino_file = project_path / "osu-v4.ino"
+
+            if not ino_file.exists():
+                raise Exception(f"Firmware file not found:\n{ino_file}")
+
+            stage_result(libraries, SYNC_TIMEOUT, "Installing libraries")
+            build = stage("firmware", "compiling...", compile_firmware, project_path, done=lambda d: "ready")
+            port_list = stage_result(ports, DETECT_TIMEOUT + 5, "Detecting ESP32")
+
+            def progress(done, failed, total):
+                post("flash", f"{total} board(s): {done} ready, {failed} failed")
+
+            boards, errors = flash_boards(project_path, port_list, build, ssid, password, progress)
+        except BaseException:
+            cancel_event.set()  # stop the stages still running
+            raise
+
+    if build.exception() is not None:
+        raise build.exception()
+
+    if not boards:
+        check_cancelled()
+        raise Exception(next(iter(errors.values())))
+
+    save_config(boards)
+
+    if len(port_list) == 1:
+        summary = f"ESP32 connected: {boards[0]['ip']}"
+    else:
+        summary = f"{len(boards)} of {len(port_list)} boards connected."
+
+        if errors:
+            summary += f"\nFailed: {', '.join(sorted(errors))}"
+
+    print(f"Install finished in {time.monotonic() - started:.0f}s")
+    return summary
+
+def install_worker(ssid, password, all_boards):
+    def post(stage, text):
+        events.put((stage, text))
+
+    try:
+        summary = run_install(ssid, password, all_boards, post)
+        post("done", f"Setup complete. {summary}\nYou may now open Calico Launcher.")
+    except Cancelled:
+        post("failed", "Install cancelled.")
+    except Exception as e:
+        post("failed", f"Error: {e}")
+
+def poll_events():
+    """
+    Show progress posted by the install thread (Tk is only touched here,
+    on the main thread).
+    """
+    finished = False
+
+    while True:
+        try:
+            stage, text = events.get_nowait()
+        except queue.Empty:
+            break
+
+        if stage in ("done", "failed"):
+            status_label.config(text=text)
+            finished = True
+        else:
+            stage_text[stage] = text
+            status_label.config(text="\n".join(
+                f"{STAGE_LABELS[name]}: {value}" for name, value in stage_text.items()
+            ))
+
+    if finished:
+        install_button.state(["!disabled"])
+        cancel_button.state(["disabled"])
+    else:
+        root.after(POLL_MS, poll_events)
+
 def submit():
+    global install_thread
+
     ssid = ssid_var.get().strip()
     password = password_var.get().strip()
 
@@ -251,60 +1027,32 @@ def submit():
         )
         return
 
-    try:
-        project_path = BASE_DIR / "Arduino" / "osu-v4"
-        libraries_dir = BASE_DIR / "Arduino" / "libraries"
-        
-        if not libraries_dir.exists():
-            install_libraries()
-
-        if not project_path.exists():
-            project_path = install_project()
-        
-        status_label.config(text="Patching firmware...")
-        root.update()
-        
-        ino_file = project_path / "osu-v4.ino"
+    cancel_event.clear()
+    stage_text.clear()
+    status_label.config(text="Starting...")
+    install_button.state(["disabled"])
+    cancel_button.state(["!disabled"])
 
-        if not ino_file.exists():
-            raise Exception(f"Firmware file not found:\n{ino_file}")
-        
-        patch_ino_wifi(project_path, ssid, password)
-
-        status_label.config(text="Detecting ESP32...")
-        root.update()
-
-        port = detect_esp32_port()
-
-        status_label.config(text="Compiling firmware...")
-        root.update()
-
-        compile_firmware(project_path)
-
-        status_label.config(text="Uploading firmware...")
-        root.update()
-
-        upload_firmware(project_path, port)
+    install_thread = threading.Thread(
+        target=install_worker,
+        args=(ssid, password, all_boards_var.get()),
+        daemon=True
+    )
+    install_thread.start()
+    root.after(POLL_MS, poll_events)
 
-        status_label.config(text="Waiting for ESP32 IP...")
-        root.update()
+def cancel():
+    cancel_event.set()
+    status_label.config(text="Cancelling...")
 
-        esp_ip = wait_for_esp32_ip(port)
-        
-        status_label.config(text=f"ESP32 connected:\n{esp_ip}")
-        root.update()
-        
-        save_config(esp_ip)
+def on_close():
+    # Kill any running arduino-cli/esptool before exiting.
+    cancel_event.set()
 
-        status_label.config(text="Windows may ask for firewall permission.\nPlease click Allow.")
-        root.update()
-        
-        status_label.config(text="Setup complete.\nYou may now open Calico Launcher.")
-        root.update()
+    if install_thread is not None:
+        install_thread.join(timeout=5)
 
-    except Exception as e:
-        status_label.config(text=f"Error: {e}")
-        root.update()
+    root.destroy()
 
 if __name__ == "__main__":
     arduino_path = bootstrap_check()
@@ -315,7 +1063,7 @@ if __name__ == "__main__":
     root = tk.Tk()
     root.configure(bg="white")
     root.title("Calico Installer")
-    root.geometry("550x400")
+    root.geometry("550x480")
     root.resizable(False, False)
     
     style = ttk.Style()
@@ -325,6 +1073,7 @@ if __name__ == "__main__":
 
     ssid_var = tk.StringVar()
     password_var = tk.StringVar()
+    all_boards_var = tk.BooleanVar()
 
     ttk.Label(root, text="WiFi SSID/Name", font=("Segoe UI", 12, "bold"), background="white").pack(pady=10)
     ttk.Entry(root, textvariable=ssid_var, font=("Segoe UI", 12)).pack(fill="x", padx=30, ipady=6)
@@ -332,9 +1081,25 @@ if __name__ == "__main__":
     ttk.Label(root, text="WiFi Password", font=("Segoe UI", 12, "bold"), background="white").pack(pady=5)
     ttk.Entry(root, textvariable=password_var, show="*", font=("Segoe UI", 12)).pack(fill="x", padx=30, ipady=6)
 
-    ttk.Button(root, text="Install", command=submit, style="Green.TButton").pack(pady=20)
+    style.configure("White.TCheckbutton", background="white", font=("Segoe UI", 11))
+    ttk.Checkbutton(root, text="Flash every connected board", variable=all_boards_var, style="White.TCheckbutton").pack(pady=(10, 0))
+
+    buttons = tk.Frame(root, bg="white")
+    buttons.pack(pady=20)
+
+    install_button = ttk.Button(buttons, text="Install", command=submit, style="Green.TButton")
+    install_button.pack(side="left", padx=5)
+
+    cancel_button = ttk.Button(buttons, text="Cancel", command=cancel)
+    cancel_button.pack(side="left", padx=5)
+    cancel_button.state(["disabled"])
 
     status_label = ttk.Label(root, text="", font=("Segoe UI", 11), background="white")
     status_label.pack()
 
+    events = queue.Queue()  # (stage, text) from the install thread
+    stage_text = {}
+    install_thread = None
+    root.protocol("WM_DELETE_WINDOW", on_close)
+
     root.mainloop()
\ No newline at end of file
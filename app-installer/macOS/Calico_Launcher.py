@@ -54,14 +54,20 @@ def wait_for_server(host="127.0.0.1", port=5001, timeout=30):
 
     return False
 
-def launch_server(esp_ip=None):
+def launch_server(esp_ip=None, robots_config=None):
     server_exe = get_resource("osu_server")
 
     env = os.environ.copy()
+    # Threaded production server, not the Flask debug server.
+    env.setdefault("SERVER_MODE", "production")
 
     if esp_ip:
         env["ESP32_IP"] = esp_ip
 
+    # Written by the installer's "Flash every connected board" mode.
+    if robots_config:
+        env["ROBOTS_CONFIG"] = str(robots_config)
+
     subprocess.Popen(
         [str(server_exe)],
         cwd=str(server_exe.parent),
@@ -80,8 +86,10 @@ def submit():
 
         config = load_config()
         esp_ip = config.get("esp_ip")
+        robots = config.get("robots") or {}
+        ips = [esp_ip] if esp_ip else [entry["ip"] for entry in robots.values()]
 
-        if not esp_ip:
+        if not ips:
             status_label.config(text=("No device configured.\n"
                                       "Run Calico Installer."))
             return
@@ -89,7 +97,7 @@ def submit():
         status_label.config(text="Checking device...")
         root.update()
 
-        if not esp32_online(esp_ip):
+        if not any(esp32_online(ip) for ip in ips):
             status_label.config(text=("Device not reachable.\n"
                                       "Run Installer again if your wifi settings changed."))
             
@@ -99,7 +107,9 @@ def submit():
             return
 
         if not server_running():
-            launch_server(esp_ip)
+            # A fleet comes only from ROBOTS_CONFIG; ESP32_IP would add its
+            # first robot again as "default".
+            launch_server(esp_ip, CONFIG_FILE if robots else None)
 
         if wait_for_server():
             status_label.config(text="Calico Ready")
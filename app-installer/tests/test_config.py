@@ -0,0 +1,86 @@
+"""
+save_config: the config.json the launcher and server read after an install.
+
+Run with: python -m pytest app-installer/tests
+"""
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("tkinter")
+pytest.importorskip("serial")
+
+HERE = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(params=["Windows", "macOS"])
+def installer(request, tmp_path, monkeypatch):
+    path = HERE / request.param / "Calico_Installer.py"
+    spec = importlib.util.spec_from_file_location(f"calico_installer_{request.param}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "CONFIG_FILE", tmp_path / "Arduino" / "config.json")
+    return module
+
+
+def board(ip, port, serial=None, mac=None):
+    return {"port": port, "serial": serial, "mac": mac, "ip": ip, "uploaded": True}
+
+
+def saved(installer):
+    return json.loads(installer.CONFIG_FILE.read_text())
+
+
+def test_fleet_rerun_keeps_ids_for_boards_without_serial_numbers(installer):
+    installer.save_config([
+        board("10.0.0.5", "COM3", mac="AA:AA:AA:AA:AA:01"),
+        board("10.0.0.6", "COM4", mac="AA:AA:AA:AA:AA:02"),
+        board("10.0.0.7", "COM5", serial="5A7B"),
+    ])
+    first = saved(installer)["robots"]
+
+    # Same boards, new IPs and shuffled ports.
+    installer.save_config([
+        board("10.0.0.16", "COM7", mac="AA:AA:AA:AA:AA:02"),
+        board("10.0.0.17", "COM3", serial="5A7B"),
+        board("10.0.0.15", "COM8", mac="AA:AA:AA:AA:AA:01"),
+    ])
+    second = saved(installer)["robots"]
+
+    assert sorted(second) == sorted(first)
+    by_mac = {entry["mac"]: rid for rid, entry in first.items() if entry["mac"]}
+    assert second[by_mac["AA:AA:AA:AA:AA:01"]]["ip"] == "10.0.0.15"
+    assert second[by_mac["AA:AA:AA:AA:AA:02"]]["ip"] == "10.0.0.16"
+    assert "esp_ip" not in saved(installer)
+
+
+def test_boards_without_serial_or_mac_are_matched_by_port(installer):
+    installer.save_config([board("10.0.0.5", "COM3"), board("10.0.0.6", "COM4")])
+    first = saved(installer)["robots"]
+
+    installer.save_config([board("10.0.0.9", "COM4"), board("10.0.0.8", "COM3")])
+    second = saved(installer)["robots"]
+
+    assert {rid: e["port"] for rid, e in second.items()} == {rid: e["port"] for rid, e in first.items()}
+
+
+def test_single_board_rerun_replaces_the_fleet(installer):
+    installer.save_config([
+        board("10.0.0.5", "COM3", serial="A"),
+        board("10.0.0.6", "COM4", serial="B"),
+    ])
+
+    installer.save_config([board("10.0.0.9", "COM3", serial="A")])
+
+    assert saved(installer) == {"esp_ip": "10.0.0.9"}
+
+
+def test_only_this_runs_boards_are_written(installer):
+    installer.save_config([board(f"10.0.0.{i}", f"COM{i}", serial=f"S{i}") for i in range(1, 4)])
+
+    installer.save_config([board("10.0.0.21", "COM1", serial="S1"), board("10.0.0.23", "COM3", serial="S3")])
+
+    robots = saved(installer)["robots"]
+    assert sorted(entry["serial"] for entry in robots.values()) == ["S1", "S3"]
@@ -0,0 +1,127 @@
+"""
+Byte-level checks of the installer's NVS partition image against layouts
+written by ESP-IDF's nvs_partition_gen.py (esp-idf-nvs-partition-gen 0.3.0,
+format version 2, unencrypted, same partition size).
+
+Run with: python -m pytest app-installer/tests
+"""
+import hashlib
+import importlib.util
+import struct
+import zlib
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("tkinter")
+pytest.importorskip("serial")
+
+HERE = Path(__file__).resolve().parent.parent
+PAGE = 4096
+
+# nvs_partition_gen.py output for namespace "calico" holding
+# ssid="Calico-Lab" and password="hunter22" (header, bitmap, 5 entries).
+KNOWN_GOOD_PAGE = bytes.fromhex(
+    "feffffff00000000feffffffffffffffffffffffffffffffffffffff842dbab9"  # header
+    "aafeffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff"  # entry state bitmap
+    "000101ffb8ed480e63616c69636f0000000000000000000001ffffffffffffff"  # namespace calico -> 1
+    "012102ffd4a191fd737369640000000000000000000000000b00ffff8a69324e"  # ssid, 11 bytes
+    "43616c69636f2d4c616200ffffffffffffffffffffffffffffffffffffffffff"
+    "012102ff278cf62170617373776f726400000000000000000900ffff7dceb5ed"  # password, 9 bytes
+    "68756e746572323200ffffffffffffffffffffffffffffffffffffffffffffff"
+)
+
+# sha256 of the whole image nvs_partition_gen.py writes for each case.
+KNOWN_GOOD_IMAGES = [
+    ({"ssid": "Calico-Lab", "password": "hunter22"}, 0x5000,
+     "bb019e9572b69834d7692e41bf773f162dc82d2bd34b9e67cf65c3b00935256c"),
+    ({"a": "x" * 2000, "b": "y" * 2000, "c": "z" * 2000}, 0x5000,
+     "15ab72a84e08eb7960db6f43b30a3d3b48ecebfb578b69796016497926caa6af"),
+    ({"ssid": "café ☕", "password": ""}, 0x3000,
+     "6374be12f00cc03ffe0560d01cd0bb2f9e3132e3a946ca597e69fd3d997173f6"),
+]
+
+
+def load_installer(platform_dir):
+    path = HERE / platform_dir / "Calico_Installer.py"
+    spec = importlib.util.spec_from_file_location(f"calico_installer_{platform_dir}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module", params=["Windows", "macOS"])
+def installer(request):
+    return load_installer(request.param)
+
+
+def crc(data):
+    return zlib.crc32(bytes(data), 0xFFFFFFFF) & 0xFFFFFFFF
+
+
+def test_page_matches_known_good_layout(installer):
+    image = installer.nvs_image("calico", {"ssid": "Calico-Lab", "password": "hunter22"})
+
+    assert len(image) == installer.NVS_SIZE
+    assert image[:len(KNOWN_GOOD_PAGE)] == KNOWN_GOOD_PAGE
+    assert set(image[len(KNOWN_GOOD_PAGE):]) == {0xFF}
+
+
+@pytest.mark.parametrize("values, size, digest", KNOWN_GOOD_IMAGES)
+def test_image_matches_nvs_partition_gen(installer, values, size, digest):
+    image = installer.nvs_image("calico", values, size)
+
+    assert len(image) == size
+    assert hashlib.sha256(image).hexdigest() == digest
+
+
+def test_page_headers_and_bitmaps(installer):
+    # 1 + 64 entries on the first page; the next 64 do not fit in the 125
+    # a page takes for multi-entry items, so each string gets its own page.
+    image = installer.nvs_image("calico", {"a": "x" * 2000, "b": "y" * 2000, "c": "z" * 2000})
+    used = [65, 64, 64]
+
+    for seq, count in enumerate(used):
+        page = image[seq * PAGE:(seq + 1) * PAGE]
+        state, page_seq = struct.unpack_from("<II", page, 0)
+        assert state == (installer.NVS_PAGE_ACTIVE if seq == len(used) - 1 else installer.NVS_PAGE_FULL)
+        assert page_seq == seq
+        assert page[8] == installer.NVS_VERSION
+        assert page[9:28] == b"\xff" * 19
+        assert struct.unpack_from("<I", page, 28)[0] == crc(page[4:28])
+
+        bitmap = int.from_bytes(page[32:64], "little")
+        for i in range(installer.NVS_PAGE_ENTRIES):
+            assert (bitmap >> (2 * i)) & 3 == (0b10 if i < count else 0b11), (seq, i)
+
+    assert set(image[len(used) * PAGE:]) == {0xFF}
+
+
+def test_entry_and_data_crcs(installer):
+    image = installer.nvs_image("calico", {"ssid": "Calico-Lab", "password": "hunter22"})
+    entries = [image[64 + i * 32:64 + (i + 1) * 32] for i in range(5)]
+
+    for entry in (entries[0], entries[1], entries[3]):
+        assert struct.unpack_from("<I", entry, 4)[0] == crc(entry[0:4] + entry[8:32])
+
+    namespace = entries[0]
+    assert (namespace[0], namespace[1], namespace[2]) == (0, installer.NVS_TYPE_U8, 1)
+    assert namespace[8:24] == b"calico".ljust(16, b"\0")
+    assert namespace[24] == 1
+
+    for header, data, value in ((entries[1], entries[2], b"Calico-Lab\0"),
+                                (entries[3], entries[4], b"hunter22\0")):
+        assert (header[0], header[1], header[2]) == (1, installer.NVS_TYPE_STR, 2)
+        size, _, data_crc = struct.unpack_from("<HHI", header, 24)
+        assert size == len(value)
+        assert data_crc == crc(value)
+        assert data[:size] == value
+
+
+def test_rejects_oversized_values(installer):
+    with pytest.raises(ValueError):
+        installer.nvs_image("calico", {"a_key_longer_than_15": "x"})
+    with pytest.raises(ValueError):
+        installer.nvs_image("calico", {"ssid": "x" * installer.NVS_MAX_STR})
+    with pytest.raises(ValueError):
+        installer.nvs_image("calico", {f"k{i}": "x" * 2000 for i in range(4)}, 0x3000)
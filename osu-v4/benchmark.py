@@ -0,0 +1,245 @@
+"""
+Benchmark server.py against mock robots (see mock_robot.py).
+
+Drives the Flask app in-process with one test client per worker thread and
+reports, per scenario, requests/sec, latency percentiles and a histogram,
+connection churn and (for uploads) MB/s through /upload_image. Results are
+written as JSON so runs can be compared across commits:
+
+    python benchmark.py --out bench.json
+    python benchmark.py --only upload --seconds 5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from mock_robot import MockFleet
+
+HEALTHY = {"latency_ms": 1.0, "jitter_ms": 0.5, "drop": 0.0}
+LOSSY = {"latency_ms": 5.0, "jitter_ms": 3.0, "drop": 0.02}
+COMMAND_MIX = ["setRed", "GET_LED_COLOR", "setGreen", "GET_LED_COLOR", "setBlue"]
+UPLOAD_BYTES = 256 * 1024
+HISTOGRAM_BOUNDS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def percentile(sorted_values: list, p: float):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(p / 100.0 * (len(sorted_values) - 1))))
+    return round(sorted_values[k], 3)
+
+
+def histogram(values: list) -> dict:
+    counts = {f"le_{b}": 0 for b in HISTOGRAM_BOUNDS_MS}
+    counts["inf"] = 0
+    for v in values:
+        for b in HISTOGRAM_BOUNDS_MS:
+            if v <= b:
+                counts[f"le_{b}"] += 1
+                break
+        else:
+            counts["inf"] += 1
+    return counts
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": round(latencies[-1], 3) if latencies else None,
+        "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "histogram": histogram(latencies),
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Bench:
+    def __init__(self, max_robots: int, base_port: int, http_base_port: int):
+        self.fleet = MockFleet(max_robots, base_port=base_port, http_base_port=http_base_port,
+                               seed=1, **HEALTHY).start()
+        self.workdir = tempfile.mkdtemp(prefix="osu-bench-")
+        config = os.path.join(self.workdir, "fleet.json")
+        with open(config, "w") as f:
+            json.dump(self.fleet.config(), f)
+
+        # server.py reads its configuration at import time.
+        os.environ["ROBOTS_CONFIG"] = config
+        os.environ["UPLOAD_FOLDER"] = os.path.join(self.workdir, "pics")
+        os.environ["SHADOW_MAX_AGE"] = "0"    # measure the network path, not the shadow
+        with contextlib.redirect_stdout(io.StringIO()):
+            import server
+        self.server = server
+        self.app = server.app
+
+    def close(self):
+        self.server.robot_gateway.close_all()
+        self.fleet.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _conditions(self, condition: dict):
+        for robot in self.fleet.robots:
+            robot.latency_ms = condition["latency_ms"]
+            robot.jitter_ms = condition["jitter_ms"]
+            robot.drop = condition["drop"]
+
+    def _connection_totals(self) -> dict:
+        totals = {"connects": 0, "reconnects": 0, "connect_failures": 0, "failures": 0}
+        for stats in self.server.robot_gateway.stats():
+            for key in totals:
+                totals[key] += stats.get(key, 0)
+        return totals
+
+    def run(self, name: str, robots: int, clients: int, seconds: float, condition: dict,
+            request) -> dict:
+        """
+        Run `request(client, robot_id, i) -> (ok, bytes)` from `clients`
+        threads for `seconds`, spreading requests over the first `robots`.
+        """
+        self._conditions(condition)
+        robot_ids = [r.name for r in self.fleet.robots[:robots]]
+        latencies, results = [], {"ok": 0, "errors": 0, "bytes": 0}
+        lock = threading.Lock()
+        stop_at = time.perf_counter() + seconds
+        before = self._connection_totals()
+
+        def worker(n):
+            client = self.app.test_client()
+            local, ok, errors, nbytes, i = [], 0, 0, 0, n
+            while time.perf_counter() < stop_at:
+                robot_id = robot_ids[i % len(robot_ids)]
+                start = time.perf_counter()
+                success, size = request(client, robot_id, i)
+                local.append((time.perf_counter() - start) * 1000)
+                ok += success
+                errors += not success
+                nbytes += size
+                i += clients
+            with lock:
+                latencies.extend(local)
+                results["ok"] += ok
+                results["errors"] += errors
+                results["bytes"] += nbytes
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        elapsed = time.perf_counter() - started
+        after = self._connection_totals()
+
+        total = results["ok"] + results["errors"]
+        return {
+            "name": name,
+            "robots": robots,
+            "clients": clients,
+            "condition": condition,
+            "seconds": round(elapsed, 3),
+            "requests": total,
+            "ok": results["ok"],
+            "errors": results["errors"],
+            "requests_per_s": round(total / elapsed, 1),
+            "mb_per_s": round(results["bytes"] / elapsed / 1e6, 3) if results["bytes"] else None,
+            "latency_ms": summarize(latencies),
+            "connections": {k: after[k] - before[k] for k in after},
+        }
+
+    # --- request kinds ---
+
+    @staticmethod
+    def command(client, robot_id, i):
+        command = COMMAND_MIX[i % len(COMMAND_MIX)]
+        resp = client.get(f"/robots/{robot_id}/execute/{command}")
+        return resp.status_code == 200, 0
+
+    @staticmethod
+    def upload(client, robot_id, i, payload=os.urandom(UPLOAD_BYTES)):
+        resp = client.post(f"/robots/{robot_id}/upload_image?preprocess=0&force=1",
+                           data={"file": (io.BytesIO(payload), f"bench{i % 8}.png")},
+                           content_type="multipart/form-data")
+        return resp.status_code == 200, len(payload) if resp.status_code == 200 else 0
+
+
+def scenarios(robot_counts, client_counts):
+    for kind in ("command", "upload"):
+        for robots in robot_counts:
+            for label, condition in (("healthy", HEALTHY), ("lossy", LOSSY)):
+                if kind == "upload" and label == "lossy":
+                    continue   # a dropped upload just costs a read timeout
+                for clients in client_counts:
+                    mode = "sequential" if clients == 1 else "concurrent"
+                    yield f"{kind}/{robots}-robots/{label}/{mode}", kind, robots, clients, condition
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server.py against mock robots.")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of each scenario")
+    parser.add_argument("--robots", default="1,50", help="robot counts to test, comma separated")
+    parser.add_argument("--clients", default="1,16", help="client thread counts, comma separated")
+    parser.add_argument("--only", help="run scenarios whose name contains this text")
+    parser.add_argument("--out", help="write JSON results here (default: stdout)")
+    parser.add_argument("--port", type=int, default=23333, help="first mock command port")
+    parser.add_argument("--http-port", type=int, default=28080, help="first mock upload port")
+    args = parser.parse_args()
+
+    robot_counts = [int(n) for n in args.robots.split(",")]
+    client_counts = [int(n) for n in args.clients.split(",")]
+    bench = Bench(max(robot_counts), args.port, args.http_port)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seconds_per_scenario": args.seconds,
+            "command_mix": COMMAND_MIX,
+            "upload_bytes": UPLOAD_BYTES,
+        },
+        "scenarios": [],
+    }
+    try:
+        for name, kind, robots, clients, condition in scenarios(robot_counts, client_counts):
+            if args.only and args.only not in name:
+                continue
+            result = bench.run(name, robots, clients, args.seconds, condition, getattr(Bench, kind))
+            report["scenarios"].append(result)
+            lat = result["latency_ms"]
+            print(f"[bench] {name:42s} {result['requests_per_s']:9.1f} req/s  "
+                  f"p50 {lat['p50']} ms  p99 {lat['p99']} ms  errors {result['errors']}"
+                  + (f"  {result['mb_per_s']} MB/s" if result["mb_per_s"] else ""),
+                  file=sys.stderr)
+    finally:
+        bench.close()
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[bench] wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import collections
+import threading
+import time
+import uuid
+
+from events import EVENTS
+from robot_link import motion_ms
+
+STOP_COMMAND = "stopMotor"
+PRIORITY_STOP = 0      # goes out at once on the control connection
+PRIORITY_COMMAND = 1   # LED colors and queries: sent at once, the firmware serves them mid-motion
+PRIORITY_MOTION = 2    # queued and paced back to back by the robot's motion clock
+MOTION_LEAD = 0.25     # seconds before the current motion ends that the next one is sent
+MOTION_SETTLE = 0.05   # seconds after the previous motion starts, so it has left the firmware's slot
+MAX_QUEUED = 64        # motions per robot; beyond this submit() raises QueueFull
+KEEP_FINISHED = 50
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class QueuedCommand:
+    """
+    One command submitted to a robot's queue, with its outcome.
+    """
+
+    def __init__(self, command: str, priority: int, fresh=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.priority = priority
+        self.fresh = fresh
+        self.status = "queued"     # queued -> sent -> done | failed, or cancelled
+        self.result = None
+        self.starts_in = 0.0       # estimated seconds until it is sent, at submit time
+        self.created_at = time.time()
+        self.sent_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "sent")
+
+    def wait(self, timeout: float) -> bool:
+        return self._done.wait(timeout)
+
+    def _finish(self, status: str, result=None):
+        self.status = status
+        self.result = result
+        self.finished_at = time.time()
+        self._done.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "command_id": self.id,
+            "command": self.command,
+            "priority": self.priority,
+            "status": self.status,
+            "response": self.result,
+            "created_at": self.created_at,
+            "sent_at": self.sent_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class CommandQueue:
+    """
+    Per-robot command queue with three priorities.
+
+    stopMotor jumps everything: queued motions are cancelled and the stop
+    is written at once on the robot's separate control connection, so it
+    never waits behind a backlog on the main stream. LED colors and queries
+    are sent straight away on the caller's thread (they are pipelined on
+    the main stream and the firmware serves them while the motors run).
+    Motions wait in a FIFO; each is sent MOTION_LEAD seconds before the
+    robot's current motion ends, but never before the previous one has
+    started (per its state shadow), so the firmware always has the next
+    move ready and its single queue slot never overflows. Batches, program
+    runs and broadcasts to a busy robot send their motions through here too.
+    """
+
+    def __init__(self, robot, max_queued=MAX_QUEUED):
+        self.robot = robot
+        self.max_queued = max_queued
+        self._motions = collections.deque()
+        self._recent = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._last_stop = 0.0
+
+    # --- submitting ---
+
+    def submit(self, command: str, fresh=False) -> QueuedCommand:
+        """
+        Run a command at its priority. stopMotor and non-motion commands are
+        done when this returns; motions are queued (see QueuedCommand.wait).
+        Raises QueueFull when `max_queued` motions are already waiting.
+        """
+        if command == STOP_COMMAND:
+            return self.stop()
+        if not motion_ms(command):
+            item = QueuedCommand(command, PRIORITY_COMMAND, fresh)
+            self._send(item)   # finished on return, so not kept for lookups
+            return item
+
+        item = QueuedCommand(command, PRIORITY_MOTION)
+        with self._cond:
+            if len(self._motions) >= self.max_queued:
+                raise QueueFull(f"{len(self._motions)} motions already queued for {self.robot.id}")
+            ahead = sum(motion_ms(m.command) for m in self._motions) / 1000.0
+            shadow = self.robot.shadow
+            item.starts_in = max(shadow.motion_hold(MOTION_LEAD, MOTION_SETTLE),
+                                 shadow.motion_remaining() + ahead - MOTION_LEAD)
+            self._motions.append(item)
+            self._remember(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"queue-{self.robot.id}",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        EVENTS.publish("command.queued", self.robot.id, command_id=item.id, command=command,
+                       starts_in_ms=round(item.starts_in * 1000))
+        return item
+
+    def stop(self, cancel_run=True) -> QueuedCommand:
+        """
+        Emergency stop: cancel queued motions and send stopMotor now. With
+        cancel_run=False the robot's active program keeps running (for a
+        stopMotor() in the program itself).
+        """
+        item = QueuedCommand(STOP_COMMAND, PRIORITY_STOP)
+        self._last_stop = item.created_at
+        cancelled = self.cancel_motions()
+        with self._cond:
+            self._remember(item)
+        item.sent_at = time.time()
+        item.status = "sent"
+        result = self.robot.stop_now(cancel_run=cancel_run)
+        item._finish("done" if result is not None else "failed", result)
+        if cancelled:
+            print(f"[queue] {self.robot.id}: stop cancelled {cancelled} queued motion(s)")
+        return item
+
+    def cancel_motions(self) -> int:
+        with self._cond:
+            dropped = list(self._motions)
+            self._motions.clear()
+            self._cond.notify()
+        for item in dropped:
+            item._finish("cancelled")
+            EVENTS.publish("command.cancelled", self.robot.id, command_id=item.id, command=item.command)
+        return len(dropped)
+
+    def _remember(self, item: QueuedCommand):
+        self._recent[item.id] = item
+        if len(self._recent) > KEEP_FINISHED + self.max_queued:
+            finished = [i for i in self._recent.values() if not i.active]
+            for old in sorted(finished, key=lambda i: i.created_at)[:-KEEP_FINISHED]:
+                del self._recent[old.id]
+
+    # --- lookups ---
+
+    def get(self, command_id: str):
+        with self._cond:
+            return self._recent.get(command_id)
+
+    def pending(self) -> list:
+        with self._cond:
+            return list(self._motions)
+
+    def to_dict(self) -> dict:
+        return {
+            "robot": self.robot.id,
+            "queued": [item.to_dict() for item in self.pending()],
+            "motion_remaining_ms": round(self.robot.shadow.motion_remaining() * 1000),
+        }
+
+    # --- sending ---
+
+    def _send(self, item: QueuedCommand):
+        item.sent_at = time.time()
+        item.status = "sent"
+        try:
+            result = self.robot.send(item.command, fresh=item.fresh)
+        except Exception as e:
+            print(f"[queue] {self.robot.id}: {item.command} failed: {e!r}")
+            result = None
+        item._finish("done" if result is not None else "failed", result)
+
+    def _next_motion(self) -> QueuedCommand:
+        with self._cond:
+            while True:
+                if not self._motions:
+                    self._cond.wait()
+                    continue
+                hold = self.robot.shadow.motion_hold(MOTION_LEAD, MOTION_SETTLE)
+                if hold > 0:
+                    self._cond.wait(hold)   # a stop wakes us early
+                    continue
+                return self._motions.popleft()
+
+    def _loop(self):
+        while True:
+            item = self._next_motion()
+            if item.created_at <= self._last_stop:
+                item._finish("cancelled")   # popped just before a stop arrived
+                continue
+            self._send(item)
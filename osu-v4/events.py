@@ -0,0 +1,140 @@
+import collections
+import itertools
+import json
+import threading
+import time
+
+HISTORY = 256              # recent events kept for Last-Event-ID resume
+SUBSCRIBER_BACKLOG = 512   # events buffered per subscriber before the oldest are dropped
+MAX_SUBSCRIBERS = 32       # each open stream holds a server thread
+HEARTBEAT_SECONDS = 15.0   # idle streams get a comment line so proxies keep them open
+
+
+class Subscription:
+    """
+    One subscriber's queue. A subscriber that falls more than `backlog`
+    events behind loses the oldest ones (counted in `dropped`) instead of
+    holding memory or slowing the publisher.
+    """
+
+    def __init__(self, broadcaster, robot_ids=None, types=None, backlog=SUBSCRIBER_BACKLOG):
+        self._broadcaster = broadcaster
+        self.robot_ids = set(robot_ids) if robot_ids else None
+        self.types = set(types) if types else None
+        self.dropped = 0
+        self.closed = False
+        self._queue = collections.deque()
+        self._backlog = backlog
+        self._cond = threading.Condition()
+
+    def wants(self, event: dict) -> bool:
+        if self.types is not None and event["type"] not in self.types:
+            return False
+        if self.robot_ids is not None and event["robot_id"] not in self.robot_ids:
+            return False
+        return True
+
+    def _put(self, event: dict):
+        with self._cond:
+            if len(self._queue) >= self._backlog:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(event)
+            self._cond.notify()
+
+    def get(self, timeout: float) -> list:
+        """
+        Every queued event, waiting up to `timeout` seconds for the first.
+        Empty on timeout or once closed.
+        """
+        with self._cond:
+            if not self._queue and not self.closed:
+                self._cond.wait(timeout)
+            events = list(self._queue)
+            self._queue.clear()
+            return events
+
+    def close(self):
+        self._broadcaster._remove(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class EventBroadcaster:
+    """
+    Fans events (command dispatched/acked, robot connected/disconnected,
+    state and run changes) out to every subscribed browser tab. publish()
+    only appends to in-memory queues, so it is safe on the robot gateway's
+    event loop and on request threads.
+    """
+
+    def __init__(self, history=HISTORY, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._ids = itertools.count(1)
+        self._history = collections.deque(maxlen=history)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def publish(self, event_type: str, robot_id=None, **data) -> dict:
+        event = {"type": event_type, "robot_id": robot_id, "t": time.time(), "data": data}
+        with self._lock:
+            event["id"] = next(self._ids)
+            self._history.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if sub.wants(event):
+                sub._put(event)
+        return event
+
+    def subscribe(self, robot_ids=None, types=None, last_id=None) -> Subscription:
+        """
+        A new subscription, or None if `max_subscribers` are already open.
+        With `last_id`, retained events after it are queued first.
+        """
+        sub = Subscription(self, robot_ids, types)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.append(sub)
+            # Replayed under the lock so newer events queue after them.
+            for event in self._history:
+                if last_id is not None and event["id"] > last_id and sub.wants(event):
+                    sub._put(event)
+        return sub
+
+    def close_all(self):
+        """
+        End every open stream (server shutdown).
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.close()
+
+    def _remove(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "last_id": self._history[-1]["id"] if self._history else 0,
+            }
+
+
+def sse_format(event: dict) -> str:
+    """
+    One event in the text/event-stream wire format.
+    """
+    payload = json.dumps({"robot_id": event["robot_id"], "t": event["t"], **event["data"]},
+                         separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+EVENTS = EventBroadcaster()
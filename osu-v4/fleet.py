@@ -0,0 +1,368 @@
+import json
+import os
+import threading
+import time
+
+from command_queue import CommandQueue, QueueFull, STOP_COMMAND
+from events import EVENTS
+from program_runner import ProgramRunner, parse_program, extract_loop_lines
+from robot_link import motion_ms
+from robot_state import RobotShadow, SHADOW_MAX_AGE
+
+DEFAULT_ROBOT_ID = "default"
+DEFAULT_PORT = 3333
+DEFAULT_HTTP_PORT = 80   # the robot's /upload_image web server
+MAX_ROBOTS = 256   # keeps a typo'd config from creating unbounded state
+PROGRAM_START_LEAD = 0.15  # seconds between warm-up and a broadcast program's shared start
+RUN_MOTION_SLACK = 2.0     # seconds a program waits for a paced motion past its expected start
+
+
+class Robot:
+    """
+    One robot in the fleet: its address, its shared connection on the
+    gateway (plus a control connection reserved for stopMotor), its program
+    runner, its priority command queue and its state shadow.
+    """
+
+    def __init__(self, robot_id: str, host: str, port: int, gateway, shadow_max_age=SHADOW_MAX_AGE,
+                 http_port=DEFAULT_HTTP_PORT):
+        self.id = robot_id
+        self.host = host
+        self.port = port
+        self.http_port = http_port
+        self.conn = gateway.get(host, port)
+        self.control = gateway.get(host, port, channel="control")
+        self.shadow = RobotShadow(shadow_max_age, on_change=self._state_changed)
+        self.runner = ProgramRunner(self._run_send, on_status=self._run_changed)
+        self.queue = CommandQueue(self)
+
+    @property
+    def upload_url(self) -> str:
+        if self.http_port == DEFAULT_HTTP_PORT:
+            return f"http://{self.host}/upload_image"
+        return f"http://{self.host}:{self.http_port}/upload_image"
+
+    # --- events (see events.py) ---
+
+    def _state_changed(self, state: dict):
+        EVENTS.publish("state.changed", self.id, **state)
+
+    def _run_changed(self, run):
+        EVENTS.publish("run.status", self.id, run_id=run.id, status=run.status, error=run.error,
+                       steps_sent=run.steps, failures=run.failures)
+
+    def _dispatched(self, commands: list):
+        EVENTS.publish("command.dispatched", self.id, commands=commands)
+
+    def _acked(self, command: str, response, source="robot", started=None):
+        EVENTS.publish("command.acked", self.id, command=command, response=response,
+                       ok=response is not None, source=source,
+                       latency_ms=None if started is None else round((time.monotonic() - started) * 1000, 2))
+
+    def send(self, command: str, fresh=False):
+        """
+        Send one command. GET_LED_COLOR is answered from the shadow when it
+        is recent enough, unless `fresh` is set.
+        """
+        cached = None if fresh else self.shadow.answer(command)
+        if cached is not None:
+            self._acked(command, cached, source="shadow")
+            return cached
+        if motion_ms(command):
+            self.control.warm()   # so a stop during this move needs no handshake
+        started = time.monotonic()
+        self._dispatched([command])
+        result = self.conn.send(command)
+        self._acked(command, result, started=started)
+        self.shadow.observe(command, result)
+        return result
+
+    def stop_now(self, cancel_run=True):
+        """
+        stopMotor on the control connection, ahead of anything queued or in
+        flight on the main stream; cancels an active program run too unless
+        `cancel_run` is False (a stopMotor() the run itself sends).
+        """
+        run = self.runner.active() if cancel_run else None
+        if run is not None:
+            run.cancel()
+        started = time.monotonic()
+        self._dispatched([STOP_COMMAND])
+        result = self.control.send(STOP_COMMAND)
+        if result is None:
+            result = self.conn.send(STOP_COMMAND)
+        self._acked(STOP_COMMAND, result, started=started)
+        self.shadow.observe(STOP_COMMAND, result)
+        return result
+
+    def _run_send(self, command: str):
+        """
+        How program runs send: motions and stopMotor through the queue (so a
+        run, /execute and batches never overfill the firmware's one-deep
+        motion queue), anything else directly.
+        """
+        if command == STOP_COMMAND:
+            return self.queue.stop(cancel_run=False).result
+        if not motion_ms(command):
+            return self.send(command)
+        item = self.queue.submit(command)
+        item.wait(item.starts_in + RUN_MOTION_SLACK)
+        return paced_result(item)
+
+    def send_batch(self, commands: list, fresh=False):
+        """
+        Send commands in one write, answering GET_LED_COLOR from the shadow
+        where possible. Motions and stopMotor go through the queue instead,
+        in order, so a batch of moves is paced rather than dropped by the
+        firmware; their entries in the result are QueuedCommands. None if
+        the write failed. Raises QueueFull like CommandQueue.submit.
+        """
+        paced = [command == STOP_COMMAND or motion_ms(command) > 0 for command in commands]
+        direct = [c for c, p in zip(commands, paced) if not p]
+        results = self._send_wire_batch(direct, fresh) if direct else []
+        if results is None:
+            return None
+        results = iter(results)
+        return [self.queue.submit(c) if p else next(results) for c, p in zip(commands, paced)]
+
+    def _send_wire_batch(self, commands: list, fresh=False):
+        answers = [None] * len(commands) if fresh else self.shadow.plan(commands)
+        wire = [c for c, a in zip(commands, answers) if a is None]
+        started = time.monotonic()
+        if wire:
+            self._dispatched(wire)
+        results = self.conn.send_batch(wire) if wire else []
+        if results is None:
+            for command in wire:
+                self._acked(command, None, started=started)
+            return None
+        results = iter(results)
+        out = []
+        for command, answer in zip(commands, answers):
+            if answer is None:
+                answer = next(results)
+                self._acked(command, answer, started=started)
+                self.shadow.observe(command, answer)
+            else:
+                self._acked(command, answer, source="shadow")
+            out.append(answer)
+        return out
+
+    def to_dict(self) -> dict:
+        active = self.runner.active()
+        stats = self.conn.stats()
+        return {
+            "id": self.id,
+            "ip": self.host,
+            "port": self.port,
+            "http_port": self.http_port,
+            "connected": stats["connected"],
+            "active_run": active.id if active else None,
+            "queued": len(self.queue.pending()),
+            "led_color": self.shadow.led_color,
+        }
+
+
+def paced_result(item):
+    """
+    A queued command's outcome as a reply: its response once sent, None if
+    sending failed, else its status ("queued", "sent" or "cancelled").
+    """
+    if item.status == "failed":
+        return None
+    return item.result if item.status == "done" else item.status
+
+
+class RobotRegistry:
+    """
+    Robots keyed by id. Loaded from a JSON config, either the installer's
+    single-robot form {"esp_ip": "..."} or a fleet:
+
+        {"robots": {"r1": {"ip": "10.0.0.11"}, "r2": {"ip": "10.0.0.12", "port": 3333}}}
+
+    A list of {"id": ..., "ip": ...} objects is accepted for "robots" too.
+    """
+
+    def __init__(self, gateway, shadow_max_age=SHADOW_MAX_AGE):
+        self.gateway = gateway
+        self.shadow_max_age = shadow_max_age
+        self._robots = {}
+        self._lock = threading.Lock()
+        gateway.listeners.append(self._connection_changed)
+
+    def _connection_changed(self, host, port, connected, reason):
+        for robot in self.all():
+            if (robot.host, robot.port) == (host, port):
+                if connected:
+                    EVENTS.publish("robot.connected", robot.id, ip=host, port=port)
+                else:
+                    EVENTS.publish("robot.disconnected", robot.id, ip=host, port=port, reason=reason)
+
+    def add(self, robot_id: str, host: str, port: int = DEFAULT_PORT,
+            http_port: int = DEFAULT_HTTP_PORT) -> Robot:
+        robot_id = str(robot_id)
+        port, http_port = int(port), int(http_port)
+        with self._lock:
+            existing = self._robots.get(robot_id)
+            if existing is not None and (existing.host, existing.port, existing.http_port) == (host, port, http_port):
+                return existing
+            if existing is None and len(self._robots) >= MAX_ROBOTS:
+                raise ValueError(f"Fleet is limited to {MAX_ROBOTS} robots")
+            robot = self._robots[robot_id] = Robot(robot_id, host, port, self.gateway,
+                                                   self.shadow_max_age, http_port)
+            return robot
+
+    def load(self, path: str) -> int:
+        """
+        Register the robots listed in `path`. Returns how many were loaded.
+        """
+        with open(path) as f:
+            config = json.load(f)
+
+        entries = []
+        if "esp_ip" in config:
+            entries.append((DEFAULT_ROBOT_ID, config["esp_ip"], config.get("esp_port", DEFAULT_PORT),
+                            config.get("esp_http_port", DEFAULT_HTTP_PORT)))
+        robots = config.get("robots", {})
+        if isinstance(robots, dict):
+            robots = [dict(entry, id=robot_id) for robot_id, entry in robots.items()]
+        for entry in robots:
+            entries.append((entry["id"], entry["ip"], entry.get("port", DEFAULT_PORT),
+                            entry.get("http_port", DEFAULT_HTTP_PORT)))
+
+        for robot_id, host, port, http_port in entries:
+            self.add(robot_id, host, port, http_port)
+        print(f"[fleet] loaded {len(entries)} robot(s) from {path}")
+        return len(entries)
+
+    def get(self, robot_id: str):
+        with self._lock:
+            return self._robots.get(robot_id)
+
+    def all(self) -> list:
+        with self._lock:
+            return list(self._robots.values())
+
+    def select(self, robot_ids=None) -> tuple:
+        """
+        Robots for the given ids (all robots if None), plus unknown ids.
+        """
+        if robot_ids is None:
+            return self.all(), []
+        found, unknown = [], []
+        for robot_id in robot_ids:
+            robot = self.get(str(robot_id))
+            (found if robot else unknown).append(robot or robot_id)
+        return found, unknown
+
+    # --- fan-out ---
+
+    @staticmethod
+    def _skew(times: list):
+        times = [t for t in times if t is not None]
+        return round(max(times) - min(times), 3) if len(times) > 1 else 0.0
+
+    def broadcast_command(self, robots: list, command: str, deadline: float) -> dict:
+        """
+        Push one command to every robot in parallel. Each robot gets at most
+        `deadline` seconds; dead robots cost nothing extra for the others.
+        """
+        queued = {}
+        if motion_ms(command):
+            # A robot still moving (or with moves waiting) gets this one
+            # through its queue: written now, it could overflow the
+            # firmware's one-deep motion queue and be dropped. Idle robots
+            # still start together.
+            for robot in robots:
+                if robot.queue.pending() or robot.shadow.motion_remaining() > 0:
+                    queued[robot.id] = self._queue_motion(robot, command)
+        everyone, robots = robots, [r for r in robots if r.id not in queued]
+
+        conns = [r.conn for r in robots]
+        if command == STOP_COMMAND:
+            # Emergency stop for the room: drop queued moves and runs, and
+            # use the control connections so nothing is ahead of it.
+            conns = [r.control for r in robots]
+            for robot in robots:
+                robot.queue.cancel_motions()
+                run = robot.runner.active()
+                if run is not None:
+                    run.cancel()
+        started = time.monotonic()
+        for robot in robots:
+            robot._dispatched([command])
+        results = self.gateway.broadcast(conns, command, deadline) if conns else []
+        for robot, res in zip(robots, results):
+            robot._acked(command, res["response"] if res["ok"] else None, started=started)
+            if res["ok"]:
+                robot.shadow.observe(command, res["response"])
+        by_robot = dict(zip([r.id for r in robots], results))
+        by_robot.update(queued)
+        results = [by_robot[r.id] for r in everyone]
+        return {
+            "command": command,
+            "results": {r.id: res for r, res in zip(everyone, results)},
+            "ok": sum(1 for res in results if res["ok"]),
+            "failed": sum(1 for res in results if not res["ok"]),
+            "start_skew_ms": self._skew([res["sent_ms"] for res in results]),
+        }
+
+    @staticmethod
+    def _queue_motion(robot, command: str) -> dict:
+        try:
+            item = robot.queue.submit(command)
+        except QueueFull as e:
+            return {"ok": False, "response": None, "sent_ms": None, "error": str(e)}
+        return {"ok": True, "response": None, "sent_ms": None, "error": None, "queued": True,
+                "command_id": item.id, "starts_in_ms": round(item.starts_in * 1000)}
+
+    def broadcast_program(self, robots: list, code: str, default_ms: int, deadline: float) -> dict:
+        """
+        Start the same program on every robot against one shared monotonic
+        start time. Connections are opened first (concurrently) so no robot
+        starts late because of a handshake.
+        """
+        parse_program(extract_loop_lines(code))   # fail fast (ProgramError) before touching robots
+        connected = self.gateway.warm_up([r.conn for r in robots], deadline)
+        start_at = time.monotonic() + PROGRAM_START_LEAD
+
+        results, runs = {}, {}
+        for robot, ok in zip(robots, connected):
+            if not ok:
+                results[robot.id] = {"ok": False, "run_id": None, "error": "not reachable"}
+                continue
+            try:
+                run = robot.runner.start(code, default_ms=default_ms, start_at=start_at)
+            except RuntimeError as e:
+                results[robot.id] = {"ok": False, "run_id": None, "error": str(e)}
+                continue
+            runs[robot.id] = run
+            results[robot.id] = {"ok": True, "run_id": run.id, "error": None}
+
+        # Wait for every run's first command so the skew figure is real.
+        give_up = start_at + deadline
+        while time.monotonic() < give_up and any(
+                r.first_sent_at is None and r.active for r in runs.values()):
+            time.sleep(0.005)
+        first = {}
+        for robot_id, run in runs.items():
+            sent = None
+            if run.first_sent_at is not None:
+                sent = round((run.first_sent_at - start_at) * 1000, 3)
+            results[robot_id]["first_command_ms"] = sent
+            first[robot_id] = sent
+
+        return {
+            "results": results,
+            "ok": len(runs),
+            "failed": len(robots) - len(runs),
+            "start_skew_ms": self._skew(list(first.values())),
+        }
+
+
+def config_path(base_dir: str):
+    """
+    ROBOTS_CONFIG from the environment, else a config.json next to server.py.
+    """
+    path = os.environ.get("ROBOTS_CONFIG") or os.path.join(base_dir, "config.json")
+    return path if os.path.isfile(path) else None
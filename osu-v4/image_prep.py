@@ -0,0 +1,137 @@
+import io
+import struct
+
+try:
+    from PIL import Image  # optional: pip install pillow
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np  # optional: pip install numpy (raw frames only)
+except ImportError:
+    np = None
+
+DISPLAY_SIZE = (240, 240)   # the robot's round GC9A01 screen / rawImage buffer
+DEFAULT_COLORS = 64
+FIT_MODES = ("cover", "contain", "stretch")
+BACKGROUND = (0, 0, 0)      # letterbox bars and transparent pixels; drawRotated fills with black too
+
+# Raw frame file: "R565", uint16 width, uint16 height (little-endian), then
+# width*height big-endian RGB565 pixels, row-major -- byte for byte what
+# PNGDrawCallback leaves in rawImage (PNG_RGB565_BIG_ENDIAN).
+RAW_FRAME_MAGIC = b"R565"
+RAW_FRAME_HEADER = struct.Struct("<4sHH")
+RAW_FRAME_EXT = ".565"
+
+
+class ImageError(ValueError):
+    """
+    The upload is not an image Pillow can read, or the options are invalid.
+    """
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def raw_available() -> bool:
+    return Image is not None and np is not None
+
+
+def _fit(img, mode: str):
+    w, h = DISPLAY_SIZE
+    if mode == "stretch":
+        return img.resize(DISPLAY_SIZE, Image.LANCZOS)
+    scale = (max if mode == "cover" else min)(w / img.width, h / img.height)
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    img = img.resize(size, Image.LANCZOS)
+    if mode == "cover":
+        left, top = (size[0] - w) // 2, (size[1] - h) // 2
+        return img.crop((left, top, left + w, top + h))
+    canvas = Image.new("RGB", DISPLAY_SIZE, BACKGROUND)
+    canvas.paste(img, ((w - size[0]) // 2, (h - size[1]) // 2))
+    return canvas
+
+
+def to_display(data: bytes, fit: str = "cover"):
+    """
+    Decode an uploaded picture and fit it to the 240x240 display as RGB:
+    "cover" scales and centre-crops, "contain" letterboxes, "stretch"
+    ignores the aspect ratio. Returns (image, original (w, h)).
+    """
+    if fit not in FIT_MODES:
+        raise ImageError(f"fit must be one of {', '.join(FIT_MODES)}")
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception as e:
+        raise ImageError(f"Cannot read image: {e}")
+    original = img.size
+    img = img.convert("RGBA")
+    flat = Image.new("RGB", img.size, BACKGROUND)
+    flat.paste(img, mask=img.getchannel("A"))
+    return _fit(flat, fit), original
+
+
+def prepare_png(data: bytes, fit: str = "cover", colors: int = DEFAULT_COLORS):
+    """
+    Re-encode an uploaded picture for the robot: 240x240, quantized to
+    `colors` palette entries (0 keeps full RGB) and saved at maximum PNG
+    compression. An upload that is already 240x240 and smaller than the
+    result is kept as is.
+
+    Returns (png bytes, info) where info has the before/after byte counts.
+    """
+    if not 0 <= colors <= 256:
+        raise ImageError("colors must be between 0 and 256")
+    img, original = to_display(data, fit)
+    if colors:
+        img = img.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True, compress_level=9)
+    png = out.getvalue()
+    kept = original == DISPLAY_SIZE and len(data) <= len(png)
+    if kept:
+        png = data
+    return png, {
+        "original_bytes": len(data),
+        "bytes": len(png),
+        "saved_bytes": len(data) - len(png),
+        "original_size": list(original),
+        "size": list(DISPLAY_SIZE),
+        "fit": fit,
+        "colors": colors,
+        "kept_original": kept,
+        "format": "png",
+    }
+
+
+def rgb565_frame(img) -> bytes:
+    """
+    Pack an RGB image into a raw frame (header + big-endian RGB565), using
+    the same truncation as PNGdec's getLineAsRGB565.
+    """
+    rgb = np.asarray(img.convert("RGB"), dtype=np.uint16)
+    pixels = ((rgb[..., 0] & 0xF8) << 8) | ((rgb[..., 1] & 0xFC) << 3) | (rgb[..., 2] >> 3)
+    return RAW_FRAME_HEADER.pack(RAW_FRAME_MAGIC, img.width, img.height) + pixels.astype(">u2").tobytes()
+
+
+def prepare_raw(data: bytes, fit: str = "cover"):
+    """
+    Convert an uploaded picture into a 240x240 raw frame the robot can load
+    with one sequential read instead of a PNG decode.
+
+    Returns (frame bytes, info) like prepare_png.
+    """
+    img, original = to_display(data, fit)
+    frame = rgb565_frame(img)
+    return frame, {
+        "original_bytes": len(data),
+        "bytes": len(frame),
+        "saved_bytes": len(data) - len(frame),
+        "original_size": list(original),
+        "size": list(DISPLAY_SIZE),
+        "fit": fit,
+        "format": "raw",
+    }
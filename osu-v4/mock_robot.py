@@ -0,0 +1,362 @@
+"""
+Pure-Python stand-in for the osu-v4 ESP32 firmware, for exercising
+server.py without hardware.
+
+Each mock robot speaks the firmware's protocols:
+  - TCP command server (3333 on the real robot): newline-terminated
+    commands, GET_LED_COLOR answered with "#RRGGBB\\r\\n", at most 4
+    clients at a time. By default motions run in the background like the
+    firmware's: one more may wait for the current one, further ones are
+    ignored (counted in the stats) and stopMotor clears both;
+    --motion block restores the old firmware's blocking moves.
+  - HTTP POST /upload_image (port 80 on the real robot): multipart upload
+    stored in memory, answered with "Upload complete".
+
+Many robots run on one asyncio loop, so hundreds fit in one process:
+
+    python mock_robot.py --count 200 --config mock_fleet.json
+    ROBOTS_CONFIG=mock_fleet.json python server.py
+
+Latency, jitter, dropped commands and the motion model are configurable,
+see --help.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+
+LED_COLORS = {"setRed": 0xFF0000, "setGreen": 0x00FF00, "setBlue": 0x0000FF}
+MOTION_RE = re.compile(r"^move(Forward|Backward)(?:\((.*)\))?$")
+MOTION_DEFAULT_MS = 5000
+MAX_TCP_CLIENTS = 4
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024
+FILENAME_RE = re.compile(rb'filename="([^"]*)"')
+
+
+def _to_int(text: str) -> int:
+    # Arduino String::toInt(): leading digits, 0 if none.
+    match = re.match(r"\s*(-?\d+)", text)
+    return int(match.group(1)) if match else 0
+
+
+class MockRobot:
+    """
+    One simulated robot.
+
+    motion="queue" mirrors the firmware: motions run in the background, one
+    more motion can wait for the current one to end, further ones are
+    dropped, and stopMotor clears both. motion="block" models older
+    firmware, where a motion delay()s the whole command loop so later
+    commands (on any connection) wait.
+    """
+
+    def __init__(self, name: str, host="127.0.0.1", port=3333, http_port=80,
+                 latency_ms=0.0, jitter_ms=0.0, drop=0.0, motion="queue",
+                 max_clients=MAX_TCP_CLIENTS, seed=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.http_port = http_port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.drop = drop
+        self.motion = motion
+        self.max_clients = max_clients
+        self.led_color = 0xFF0000      # firmware boot color
+        self.motor = "stopped"
+        self.motor_active = False
+        self.queued_motion = None      # (direction, ms) waiting for the current motion
+        self.files = {}                # SPIFFS: name -> bytes
+        self.stats = {"connections": 0, "rejected": 0, "commands": 0, "replies": 0,
+                      "dropped": 0, "ignored": 0, "motions": 0, "unknown": 0, "uploads": 0, "upload_bytes": 0}
+        self._random = random.Random(seed)
+        self._pending_led = None
+        self._motion_timer = None
+        self._cpu = None               # asyncio.Lock: the firmware's single loop()
+        self._clients = 0
+        self._servers = []
+        self._writers = set()
+
+    # --- lifecycle ---
+
+    async def start(self):
+        self._cpu = asyncio.Lock()
+        self._servers.append(await asyncio.start_server(self._tcp_client, self.host, self.port))
+        if self.http_port:
+            self._servers.append(await asyncio.start_server(self._http_client, self.host, self.http_port))
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+        for writer in list(self._writers):
+            writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    def to_config(self) -> dict:
+        return {"ip": self.host, "port": self.port, "http_port": self.http_port}
+
+    # --- timing model ---
+
+    async def _network_delay(self):
+        delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+
+    def _dropped(self) -> bool:
+        if self.drop and self._random.random() < self.drop:
+            self.stats["dropped"] += 1
+            return True
+        return False
+
+    # --- command server ---
+
+    async def _tcp_client(self, reader, writer):
+        if self._clients >= self.max_clients:
+            self.stats["rejected"] += 1
+            writer.close()
+            return
+        self._clients += 1
+        self._writers.add(writer)
+        self.stats["connections"] += 1
+        buffer = b""
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                if not lines:
+                    continue
+                await self._network_delay()
+                async with self._cpu:
+                    for line in lines:
+                        await self._command(line.decode("utf-8", "replace").strip(), writer)
+                    # loop() applies LED commands after servicing the clients.
+                    self._apply_led()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._clients -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+    def _apply_led(self):
+        if self._pending_led is not None:
+            self.led_color, self._pending_led = self._pending_led, None
+
+    async def _command(self, cmd: str, writer):
+        if self._dropped():
+            return
+        self.stats["commands"] += 1
+        if cmd in LED_COLORS:
+            self._pending_led = LED_COLORS[cmd]
+            return
+        if cmd == "GET_LED_COLOR":
+            writer.write(f"#{self.led_color:06X}\r\n".encode("ascii"))
+            self.stats["replies"] += 1
+            return
+        if cmd == "stopMotor":
+            self.queued_motion = None
+            self._motion_done()
+            return
+        match = MOTION_RE.match(cmd)
+        if not match:
+            self.stats["unknown"] += 1
+            return
+        ms = _to_int(match.group(2)) if match.group(2) is not None else MOTION_DEFAULT_MS
+        direction = match.group(1).lower()
+        if self.motor_active:
+            if self.motion == "queue" and self.queued_motion is None:
+                self.queued_motion = (direction, ms)
+            else:
+                self.stats["ignored"] += 1
+            return
+        if self.motion == "block":
+            self.motor, self.motor_active = direction, True
+            self.stats["motions"] += 1
+            await asyncio.sleep(max(ms, 0) / 1000.0)
+            self.motor, self.motor_active = "stopped", False
+        else:
+            self._start_motion(direction, ms)
+
+    def _start_motion(self, direction: str, ms: int):
+        self.motor, self.motor_active = direction, True
+        self.stats["motions"] += 1
+        self._motion_timer = asyncio.get_running_loop().call_later(
+            max(ms, 0) / 1000.0, self._motion_elapsed)
+
+    def _motion_elapsed(self):
+        self._motion_timer = None
+        if self.queued_motion is not None:
+            direction, ms = self.queued_motion
+            self.queued_motion = None
+            self._start_motion(direction, ms)
+        else:
+            self._motion_done()
+
+    def _motion_done(self):
+        if self._motion_timer is not None:
+            self._motion_timer.cancel()
+            self._motion_timer = None
+        self.motor, self.motor_active = "stopped", False
+
+    # --- HTTP upload endpoint ---
+
+    async def _http_client(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", "0"))
+            if length > MAX_UPLOAD_BYTES:
+                await self._http_reply(writer, 413, "Too large")
+                return
+            body = await reader.readexactly(length)
+            method, path = request_line.split(" ")[:2]
+            if method != "POST" or path.split("?")[0] != "/upload_image":
+                await self._http_reply(writer, 404, "Not found")
+                return
+            if self._dropped():
+                return   # the connection just closes, like a lost upload
+            await self._network_delay()
+            name, data = self._parse_upload(headers.get("content-type", ""), body)
+            if name:
+                self.files[name] = data   # FILE_WRITE on the first chunk
+                self.stats["uploads"] += 1
+                self.stats["upload_bytes"] += len(data)
+            await self._http_reply(writer, 200, "Upload complete")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+                ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_upload(content_type: str, body: bytes):
+        match = re.search(r"boundary=([^;]+)", content_type)
+        if not match:
+            return None, b""
+        boundary = b"--" + match.group(1).strip('"').encode("latin-1")
+        for part in body.split(boundary):
+            head, sep, data = part.partition(b"\r\n\r\n")
+            name = FILENAME_RE.search(head)
+            if sep and name:
+                return name.group(1).decode("utf-8", "replace"), data[:-2] if data.endswith(b"\r\n") else data
+        return None, b""
+
+    @staticmethod
+    async def _http_reply(writer, status: int, text: str):
+        body = text.encode("utf-8")
+        reason = {200: "OK", 404: "Not Found", 413: "Payload Too Large"}.get(status, "")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+
+class MockFleet:
+    """
+    Several mock robots on consecutive ports, served from one event loop on
+    a background thread (for use from tests and benchmarks).
+    """
+
+    def __init__(self, count: int, host="127.0.0.1", base_port=13333, http_base_port=18080, **options):
+        self.robots = [
+            MockRobot(f"mock{i}", host, base_port + i, http_base_port + i if http_base_port else 0,
+                      **options)
+            for i in range(count)
+        ]
+        self._loop = None
+        self._thread = None
+
+    async def _start_all(self):
+        for robot in self.robots:
+            await robot.start()
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_all())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="mock-fleet", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        async def stop_all():
+            for robot in self.robots:
+                await robot.stop()
+            # Closed connections see EOF; give their handlers a moment to exit.
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=1.0)
+        asyncio.run_coroutine_threadsafe(stop_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def config(self) -> dict:
+        """
+        A fleet config for server.py (ROBOTS_CONFIG).
+        """
+        return {"robots": {r.name: r.to_config() for r in self.robots}}
+
+    def stats(self) -> dict:
+        totals = {}
+        for robot in self.robots:
+            for key, value in robot.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock osu-v4 robots for offline testing.")
+    parser.add_argument("--count", type=int, default=1, help="number of robots")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=13333, help="first robot's command port")
+    parser.add_argument("--http-port", type=int, default=18080,
+                        help="first robot's upload port (0 disables uploads)")
+    parser.add_argument("--latency", type=float, default=0.0, help="added delay per read/upload, ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- random delay, ms")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability a command/upload is lost")
+    parser.add_argument("--motion", choices=("queue", "block"), default="queue",
+                        help="queue: motions run in the background with one more waiting, like the "
+                             "firmware; block: motions stall the robot like older firmware's delay()")
+    parser.add_argument("--config", help="write a ROBOTS_CONFIG file for server.py here")
+    parser.add_argument("--seed", type=int, help="random seed for jitter/drop")
+    args = parser.parse_args()
+
+    fleet = MockFleet(args.count, args.host, args.port, args.http_port,
+                      latency_ms=args.latency, jitter_ms=args.jitter, drop=args.drop,
+                      motion=args.motion, seed=args.seed).start()
+    if args.config:
+        with open(args.config, "w") as f:
+            json.dump(fleet.config(), f, indent=2)
+        print(f"[mock] wrote fleet config to {args.config}")
+    last = fleet.robots[-1]
+    print(f"[mock] {args.count} robot(s) on {args.host}:{args.port}-{last.port}"
+          + (f", uploads on {args.http_port}-{last.http_port}" if args.http_port else ""))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fleet.stop()
+        print(f"[mock] stats: {json.dumps(fleet.stats())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@
 
 #include <FastLED.h>
 #include "SPIFFS.h"
+#include <Preferences.h>
 #include <vector>
 #include <ESPAsyncWebServer.h>
 #include "esp_log.h"  
@@ -57,8 +58,14 @@ IPAddress subnet(255, 255, 255, 0);     // Subnet mask
 IPAddress primaryDNS(8, 8, 8, 8);        // DNS
 IPAddress secondaryDNS(8, 8, 4, 4);      // Secondary DNS
 
+// Compiled-in defaults. The Calico installer flashes the real network as an
+// NVS image (namespace "calico", keys "ssid"/"password"), which wins if present.
 const char* ssid = "Verizon_B4TKXX";
 const char* password = "fox3-veto-dun";
+#define WIFI_PREFS_NAMESPACE "calico"
+String wifiSsid = ssid;
+String wifiPassword = password;
+String usbLine;  // command being read from the USB serial port
 
 // --------------------- Global Variables ---------------------
 std::vector<String> imageFiles;  // To store filenames found in SPIFFS
@@ -67,6 +74,10 @@ std::vector<String> imageFiles;  // To store filenames found in SPIFFS
 AsyncWebServer espServer(80);
 // WiFiServer for additional commands.
 WiFiServer server(3333);
+#define MAX_TCP_CLIENTS 4
+WiFiClient tcpClients[MAX_TCP_CLIENTS];  // Persistent command connections.
+String tcpBuffers[MAX_TCP_CLIENTS];      // Partial line per connection.
+bool tcpInUse[MAX_TCP_CLIENTS] = {false};
 
 PNG png;  
 Adafruit_MCP23X17 mcp;  // MCP23017 for motor control
@@ -97,6 +108,13 @@ String lastUploadedFilename = "";         // To track the last file processed.
 int currentImageIndex = 0;
 static uint16_t rawImage[240 * 240];  // Framebuffer (240x240)
 static int imgWidth = 0, imgHeight = 0;
+
+// Raw frames (*.565) are pre-rendered by server.py (?format=raw): an 8-byte
+// header ("R565", uint16 width, uint16 height, little-endian) followed by
+// width*height big-endian RGB565 pixels -- the same bytes PNGDrawCallback
+// writes into rawImage, so showing one is a plain sequential read.
+#define RAW_FRAME_EXT ".565"
+#define RAW_FRAME_HEADER 8
 uint32_t currentLEDColor = 0xFF0000;
 
 float lastAngle = -1;
@@ -112,10 +130,16 @@ lv_coord_t startX = 0, startY = 0;
 lv_coord_t lastX = 0, lastY = 0;
 const int SWIPE_THRESHOLD = 30;
 
-// Motor control variables.
+// Motor control variables. Motions run in the background: loop() stops
+// the motor once motorDuration has elapsed, so commands (stopMotor above
+// all) are still served while the robot moves. One further motion can wait
+// its turn and starts the moment the current one ends.
 unsigned long motorCommandStart = 0;
 unsigned long motorDuration = 0;
 bool motorActive = false;
+bool queuedMotion = false;
+bool queuedForward = true;
+unsigned long queuedDuration = 0;
 
 // --------------------- ESP32 Upload Endpoint Functions ---------------------
 
@@ -124,7 +148,9 @@ void handleUpload(AsyncWebServerRequest *request, String filename,
   if (!index) {  
     Serial.printf("Upload Start: %s\n", filename.c_str());
   }
-  fs::File file = SPIFFS.open("/" + filename, FILE_APPEND);
+  // Start a fresh file on the first chunk so re-uploading a name replaces
+  // the picture instead of appending to it.
+  fs::File file = SPIFFS.open("/" + filename, index == 0 ? FILE_WRITE : FILE_APPEND);
   if (file) {
     file.write(data, len);
     file.close();
@@ -164,7 +190,8 @@ void scanForImageFiles() {
     String fileName = file.name();
     size_t fileSize = file.size();
     Serial.printf("Found file: %s (size: %d bytes)\n", fileName.c_str(), fileSize);
-    if (fileName.endsWith(".png") && fileSize > 0) {
+    if ((fileName.endsWith(".png") && fileSize > 0) ||
+        (fileName.endsWith(RAW_FRAME_EXT) && fileSize >= RAW_FRAME_HEADER + sizeof(rawImage))) {
       imageFiles.push_back(fileName);
     } else {
       Serial.printf("File %s is ignored (non-image or size 0).\n", fileName.c_str());
@@ -218,13 +245,47 @@ void showImageFromSPIFFS_Stream(const char* filename) {
   isDecoding = false;
 }
 
+void showRawFrameFromSPIFFS(const char* filename) {
+  String fullPath = String(filename);
+  if (!fullPath.startsWith("/")) fullPath = "/" + fullPath;
+
+  fs::File f = SPIFFS.open(fullPath, FILE_READ);
+  if (!f) {
+    Serial.printf("Raw frame open failed: %s\n", filename);
+    return;
+  }
+  uint8_t header[RAW_FRAME_HEADER];
+  int w = 0, h = 0;
+  if (f.read(header, RAW_FRAME_HEADER) == RAW_FRAME_HEADER && memcmp(header, "R565", 4) == 0) {
+    w = header[4] | (header[5] << 8);
+    h = header[6] | (header[7] << 8);
+  }
+  if (w != 240 || h != 240) {
+    Serial.printf("Raw frame %s has an unsupported header (w:%d, h:%d)\n", filename, w, h);
+    f.close(); return;
+  }
+  size_t got = f.read((uint8_t*)rawImage, sizeof(rawImage));
+  f.close();
+  if (got != sizeof(rawImage)) {
+    Serial.printf("Raw frame %s is truncated (%d bytes)\n", filename, (int)got);
+    return;
+  }
+  imgWidth = w;
+  imgHeight = h;
+  Serial.printf("Displayed raw frame %s (w:%d, h:%d)\n", filename, imgWidth, imgHeight);
+}
+
 void showImage(int index) {
   if (index < 0 || index >= (int)imageFiles.size()) {
     Serial.println("Index out of range");
     return;
   }
   const char* filename = imageFiles[index].c_str();
-  showImageFromSPIFFS_Stream(filename);
+  if (imageFiles[index].endsWith(RAW_FRAME_EXT)) {
+    showRawFrameFromSPIFFS(filename);
+  } else {
+    showImageFromSPIFFS_Stream(filename);
+  }
 }
 
 // --------------------- LED Functions ---------------------
@@ -353,13 +414,49 @@ void listImageFiles() {
   fs::File file = root.openNextFile();
   while (file) {
     String fileName = file.name();
-    if (fileName.endsWith(".png")) {
+    if (fileName.endsWith(".png") || fileName.endsWith(RAW_FRAME_EXT)) {
       Serial.println("Found image: " + fileName);
     }
     file = root.openNextFile();
   }
 }
 
+// --------------------- WiFi Credentials ---------------------
+
+// Credentials written by the installer live in NVS, so moving robots to a
+// new network only rewrites that partition instead of recompiling.
+void loadWifiCredentials() {
+  Preferences prefs;
+  if (!prefs.begin(WIFI_PREFS_NAMESPACE, true)) {
+    Serial.println("No WiFi credentials in NVS; using compiled-in defaults.");
+    return;
+  }
+  if (prefs.isKey("ssid")) {
+    wifiSsid = prefs.getString("ssid", ssid);
+    wifiPassword = prefs.getString("password", password);
+    Serial.println("WiFi credentials loaded from NVS.");
+  }
+  prefs.end();
+}
+
+// The installer sends "GET_IP" over USB in case it opened the port after the
+// boot-time ESP32_MAC= / ESP32_IP= lines had already gone out.
+void handleUsbSerial() {
+  while (Serial.available()) {
+    char c = Serial.read();
+    if (c == '\n') {
+      usbLine.trim();
+      if (usbLine == "GET_IP" && WiFi.status() == WL_CONNECTED) {
+        Serial.print("ESP32_MAC="); Serial.println(WiFi.macAddress());
+        Serial.print("ESP32_IP="); Serial.println(WiFi.localIP());
+      }
+      usbLine = "";
+    } else if (usbLine.length() < 32) {
+      usbLine += c;
+    }
+  }
+}
+
 // --------------------- Setup ---------------------
 
 void setup() {
@@ -387,17 +484,21 @@ void setup() {
   // WiFi
   WiFi.mode(WIFI_STA);
   WiFi.persistent(false);
-  WiFi.begin(ssid, password);
+  loadWifiCredentials();
+  WiFi.begin(wifiSsid.c_str(), wifiPassword.c_str());
   while (WiFi.status() != WL_CONNECTED) { delay(500); Serial.print("."); }
   Serial.println();
   Serial.print("Connected! IP=");      Serial.println(WiFi.localIP());
   Serial.print("Gateway=");           Serial.println(WiFi.gatewayIP());
   Serial.print("Subnet=");            Serial.println(WiFi.subnetMask());
   Serial.print("SSID=");              Serial.println(WiFi.SSID());
+  Serial.print("ESP32_MAC=");         Serial.println(WiFi.macAddress());  // installer: board id
+  Serial.print("ESP32_IP=");          Serial.println(WiFi.localIP());  // read by the installer
   esp_wifi_set_ps(WIFI_PS_NONE);
 
   setupESP32UploadEndpoint();
   server.begin();
+  server.setNoDelay(true);
   Serial.print("Setup task running on core "); Serial.println(xPortGetCoreID());
 
   // TFT
@@ -452,38 +553,51 @@ void processSerialCommand(String cmd, WiFiClient &client) {
     client.println(currentColor);
     return;
   }
-  if (motorActive) { Serial.println("Motor command already active. Ignoring."); return; }
-
-  if (cmd.startsWith("moveForward(")) {
-    int startIdx = cmd.indexOf('('), endIdx = cmd.indexOf(')');
-    String durationStr = cmd.substring(startIdx + 1, endIdx);
-    motorDuration = durationStr.toInt();
-    moveForward();
-    Serial.printf("Executed moveForward for %u ms\n", (unsigned)motorDuration);
-    motorActive = true; delay(motorDuration); stopMotor(); Serial.println("Motor stopped."); motorActive = false; return;
-  } else if (cmd.startsWith("moveBackward(")) {
-    int startIdx = cmd.indexOf('('), endIdx = cmd.indexOf(')');
-    String durationStr = cmd.substring(startIdx + 1, endIdx);
-    motorDuration = durationStr.toInt();
-    moveBackward();
-    Serial.printf("Executed moveBackward for %u ms\n", (unsigned)motorDuration);
-    motorActive = true; delay(motorDuration); stopMotor(); Serial.println("Motor stopped."); motorActive = false; return;
-  } else if (cmd == "moveForward") {
-    motorDuration = 5000; moveForward(); Serial.printf("moveForward default %u ms\n", (unsigned)motorDuration);
-    motorActive = true; delay(motorDuration); stopMotor(); Serial.println("Motor stopped."); motorActive = false; return;
-  } else if (cmd == "moveBackward") {
-    motorDuration = 5000; moveBackward(); Serial.printf("moveBackward default %u ms\n", (unsigned)motorDuration);
-    motorActive = true; delay(motorDuration); stopMotor(); Serial.println("Motor stopped."); motorActive = false; return;
-  } else if (cmd == "stopMotor") {
+  if (cmd == "stopMotor") {
+    queuedMotion = false;
     stopMotor(); Serial.println("Executed stopMotor()"); motorActive = false; return;
   }
 
-  Serial.print("Unrecognized command: "); Serial.println(cmd);
+  bool forward;
+  unsigned long duration;
+  if (!parseMotion(cmd, forward, duration)) {
+    Serial.print("Unrecognized command: "); Serial.println(cmd);
+    return;
+  }
+  if (!motorActive) { startMotion(forward, duration); return; }
+  if (queuedMotion) { Serial.println("Motion queue full. Ignoring."); return; }
+  queuedMotion = true; queuedForward = forward; queuedDuration = duration;
+  Serial.printf("Queued %s for %u ms\n", forward ? "moveForward" : "moveBackward", (unsigned)duration);
+}
+
+// moveForward / moveBackward, with an optional "(ms)" duration (default 5000).
+bool parseMotion(const String &cmd, bool &forward, unsigned long &duration) {
+  String name = cmd;
+  duration = 5000;
+  int startIdx = cmd.indexOf('(');
+  if (startIdx >= 0) {
+    int endIdx = cmd.indexOf(')');
+    duration = cmd.substring(startIdx + 1, endIdx).toInt();
+    name = cmd.substring(0, startIdx);
+  }
+  if (name == "moveForward")  { forward = true;  return true; }
+  if (name == "moveBackward") { forward = false; return true; }
+  return false;
+}
+
+void startMotion(bool forward, unsigned long duration) {
+  if (forward) moveForward(); else moveBackward();
+  motorDuration = duration;
+  motorCommandStart = millis();
+  motorActive = true;
+  Serial.printf("Executed %s for %u ms\n", forward ? "moveForward" : "moveBackward", (unsigned)duration);
 }
 
 // --------------------- Main Loop ---------------------
 
 void loop() {
+  handleUsbSerial();
+
   if (newFileUploaded) {
     newFileUploaded = false;
     scanForImageFiles();
@@ -538,29 +652,63 @@ void loop() {
   }
   
   if (motorActive && (millis() - motorCommandStart >= motorDuration)) {
-    stopMotor(); motorActive = false; SERIAL_PORT.println("Motor command duration elapsed; motor stopped.");
-  }
-
-  WiFiClient client = server.available();
-  if (client) {
-    Serial.println("TCP client connected.");
-    String command = "";
-    while (client.connected()) {
-      while (client.available()) {
-        char c = client.read();
-        if (c == '\n') {
-          command.trim();
-          Serial.print("Received over WiFi: "); Serial.println(command);
-          processSerialCommand(command, client);
-          command = "";
-        } else {
-          command += c;
-        }
+    if (queuedMotion) {
+      queuedMotion = false;
+      startMotion(queuedForward, queuedDuration);
+    } else {
+      stopMotor(); motorActive = false; SERIAL_PORT.println("Motor command duration elapsed; motor stopped.");
+    }
+  }
+
+  serviceTcpClients();
+}
+
+// --------------------- TCP Command Clients ---------------------
+// The server keeps a long-lived connection open, so clients are polled
+// without blocking loop(): each pass drains whatever bytes have arrived and
+// executes every complete '\n'-terminated line.
+
+void serviceTcpClients() {
+  WiFiClient incoming = server.available();
+  if (incoming) {
+    int slot = -1;
+    for (int i = 0; i < MAX_TCP_CLIENTS; i++) {
+      if (!tcpInUse[i]) { slot = i; break; }
+    }
+    if (slot < 0) {
+      Serial.println("TCP client rejected (all slots busy).");
+      incoming.stop();
+    } else {
+      tcpClients[slot] = incoming;
+      tcpInUse[slot] = true;
+      tcpClients[slot].setNoDelay(true);
+      tcpBuffers[slot] = "";
+      Serial.printf("TCP client connected (slot %d).\n", slot);
+    }
+  }
+
+  for (int i = 0; i < MAX_TCP_CLIENTS; i++) {
+    WiFiClient &client = tcpClients[i];
+    if (!tcpInUse[i]) continue;
+    if (!client.connected()) {
+      client.stop();
+      tcpInUse[i] = false;
+      tcpBuffers[i] = "";
+      Serial.printf("TCP client disconnected (slot %d).\n", i);
+      continue;
+    }
+    while (client.available()) {
+      char c = client.read();
+      if (c == '\n') {
+        String command = tcpBuffers[i];
+        tcpBuffers[i] = "";
+        command.trim();
+        Serial.print("Received over WiFi: "); Serial.println(command);
+        processSerialCommand(command, client);
+      } else {
+        tcpBuffers[i] += c;
       }
-      yield();
     }
-    client.stop();
-    Serial.println("TCP client disconnected.");
   }
 }
 
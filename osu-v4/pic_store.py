@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+STORE_DIRNAME = ".store"
+INDEX_FILENAME = "index.json"
+HASH_CHUNK = 64 * 1024
+
+
+def stream_digest(stream) -> str:
+    """
+    SHA-256 of what is left in a seekable stream; the position is restored.
+    """
+    pos = stream.tell()
+    h = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK), b""):
+        h.update(chunk)
+    stream.seek(pos)
+    return h.hexdigest()
+
+
+class _NullSink:
+    def write(self, data):
+        return len(data)
+
+
+class _ObjectWriter:
+    """
+    Sink for a new object: written to a temp file and moved into place on
+    success, so a failed upload never leaves a partial object behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp = f"{path}.{threading.get_ident()}.part"
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.tmp, "wb")
+        return self._f
+
+    def __exit__(self, exc_type, exc, tb):
+        self._f.close()
+        if exc_type is None:
+            os.replace(self.tmp, self.path)
+        else:
+            os.remove(self.tmp)
+        return False
+
+
+class _Existing:
+    def __enter__(self):
+        return _NullSink()
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class PicStore:
+    """
+    Content-addressed picture store.
+
+    Objects live once under pics/.store/objects/<sha256>; pics/<name> is a
+    hard link to the object (a copy where links are not supported), so pics/
+    still reads as a plain folder of pictures. An in-memory index, persisted
+    to pics/.store/index.json, maps names to digests and records which
+    robot holds which name/digest, so re-uploading identical bytes can skip
+    the network and "what does robot X have" needs no disk access.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, STORE_DIRNAME, "objects")
+        self.index_path = os.path.join(root, STORE_DIRNAME, INDEX_FILENAME)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._names = {}     # name -> digest
+        self._sizes = {}     # digest -> bytes
+        self._robots = {}    # robot id -> {name on robot: digest}
+        self._lock = threading.Lock()
+        self._load()
+
+    # --- persistence ---
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._names = index.get("names", {})
+        self._sizes = index.get("sizes", {})
+        self._robots = index.get("robots", {})
+
+    def _save(self):
+        # Called with self._lock held.
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"names": self._names, "sizes": self._sizes, "robots": self._robots}, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+    # --- objects ---
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest)
+
+    def has(self, digest: str) -> bool:
+        with self._lock:
+            return digest in self._sizes
+
+    def writer(self, digest: str):
+        """
+        Context manager yielding a sink for `digest`'s bytes; a no-op sink
+        if the object is already stored.
+        """
+        if self.has(digest) and os.path.isfile(self.object_path(digest)):
+            return _Existing()
+        return _ObjectWriter(self.object_path(digest))
+
+    def _link(self, name: str, digest: str):
+        target = os.path.join(self.root, name)
+        tmp = f"{target}.{threading.get_ident()}.part"
+        try:
+            os.link(self.object_path(digest), tmp)
+        except OSError:
+            shutil.copyfile(self.object_path(digest), tmp)
+        os.replace(tmp, target)
+
+    def add(self, name: str, digest: str, size: int):
+        """
+        Point `name` at a stored object.
+        """
+        with self._lock:
+            unchanged = self._names.get(name) == digest
+            self._names[name] = digest
+            self._sizes[digest] = size
+            if not unchanged:
+                self._save()
+        if not unchanged or not os.path.exists(os.path.join(self.root, name)):
+            self._link(name, digest)
+
+    # --- which robot holds what ---
+
+    def held_as(self, robot_id: str, digest: str):
+        """
+        Name under which `robot_id` already holds `digest`, or None.
+        """
+        with self._lock:
+            for name, held in self._robots.get(robot_id, {}).items():
+                if held == digest:
+                    return name
+        return None
+
+    def mark_sent(self, robot_id: str, name: str, digest: str):
+        with self._lock:
+            self._robots.setdefault(robot_id, {})[name] = digest
+            self._save()
+
+    def forget_robot(self, robot_id: str) -> int:
+        """
+        Drop what we know about a robot (e.g. after its SPIFFS was wiped).
+        """
+        with self._lock:
+            count = len(self._robots.pop(robot_id, {}))
+            self._save()
+        return count
+
+    def robot_pictures(self, robot_id: str) -> dict:
+        with self._lock:
+            return dict(self._robots.get(robot_id, {}))
+
+    def pictures(self) -> dict:
+        with self._lock:
+            holders = {}
+            for robot_id, held in self._robots.items():
+                for digest in set(held.values()):
+                    holders.setdefault(digest, []).append(robot_id)
+            return {
+                name: {"digest": digest, "bytes": self._sizes.get(digest),
+                       "robots": sorted(holders.get(digest, []))}
+                for name, digest in self._names.items()
+            }
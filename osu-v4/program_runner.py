@@ -0,0 +1,452 @@
+import ast
+import operator
+import re
+import threading
+import time
+import uuid
+
+# --- Program timing (mirrors the old executeSequence() in data/index.html) ---
+DEFAULT_STEP_MS = 5000      # lines without an explicit "(ms)" argument
+MAX_WHILE_ITERATIONS = 100  # same safeguard the browser unroller used
+MAX_STEPS = 10000           # hard cap on commands sent by a single run
+KEEP_FINISHED_RUNS = 20     # finished runs kept around for /run/<id> lookups
+
+LOOP_BODY_RE = re.compile(r"void\s+loop\s*\(\s*\)\s*{([\s\S]*?)^}", re.M)
+FOR_RE = re.compile(r"^for\s*\(\s*(?:int\s+)?(\w+)\s*=\s*(\d+)\s*;\s*\1\s*(<|<=)\s*(\d+)\s*;")
+ASSIGN_RE = re.compile(r"^(?:(?:int|long|float|double|String)\s+)?(\w+)\s*=\s*([^=].*?);?$")
+DURATION_RE = re.compile(r"\((\d+(?:\.\d*)?|\.\d+)\)")
+DELAY_RE = re.compile(r"^delay\s*\(\s*(\d+(?:\.\d*)?|\.\d+)\s*\)\s*;?$")
+MY_VAR_RE = re.compile(r"^my_([0-9_]+)$")
+
+
+class ProgramError(Exception):
+    pass
+
+
+class RunCancelled(Exception):
+    pass
+
+
+# --- Parsing: generated Arduino code -> nested statement list ---
+
+def _header_condition(line: str, keyword: str) -> str:
+    """
+    Pull the parenthesised condition out of an if/while header, allowing
+    nested parentheses such as getCurrentLEDColor().
+    """
+    start = line.index("(", len(keyword))
+    depth = 0
+    for i in range(start, len(line)):
+        if line[i] == "(":
+            depth += 1
+        elif line[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return line[start + 1:i].strip()
+    raise ProgramError(f"Unbalanced parentheses in: {line}")
+
+
+def extract_loop_lines(code: str) -> list:
+    """
+    Return the trimmed, non-empty lines of the generated `void loop()` body.
+    Input that has no loop() is treated as a bare list of lines.
+    """
+    match = LOOP_BODY_RE.search(code)
+    body = match.group(1) if match else code
+    lines = []
+    for line in body.split("\n"):
+        line = line.split("//", 1)[0].strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def parse_program(lines: list) -> list:
+    """
+    Turn loop() lines into statements:
+      ("cmd", text, duration_ms) / ("wait", ms) / ("set", name, expr)
+      ("if", cond, body, else_body) / ("for", count, body) / ("while", cond, body)
+    """
+    root = []
+    stack = [(None, root)]   # (open statement, list receiving children)
+    pending = None           # header waiting for a "{" on the next line
+
+    def open_block(stmt, body):
+        stack.append((stmt, body))
+
+    for line in lines:
+        if pending is not None:
+            if line == "{":
+                open_block(*pending)
+                pending = None
+                continue
+            raise ProgramError(f"Expected '{{' after block header, got: {line}")
+
+        if line.startswith("}"):
+            if len(stack) == 1:
+                raise ProgramError("Unmatched '}'")
+            stmt, _ = stack.pop()
+            rest = line[1:].strip()
+            if rest.startswith("else"):
+                if stmt is None or stmt[0] != "if":
+                    raise ProgramError("'else' without 'if'")
+                else_body = stmt[3]
+                rest = rest[4:].strip()
+                if rest.startswith("if"):
+                    raise ProgramError("'else if' is not supported")
+                if rest == "{":
+                    open_block(stmt, else_body)
+                else:
+                    pending = (stmt, else_body)
+            continue
+
+        body = stack[-1][1]
+        opens = line.endswith("{")
+        head = line[:-1].strip() if opens else line
+
+        if head.startswith("if") and head[2:3] in ("(", " "):
+            stmt = ("if", _header_condition(head, "if"), [], [])
+        elif head.startswith("while") and head[5:6] in ("(", " "):
+            stmt = ("while", _header_condition(head, "while"), [])
+        elif head.startswith("for") and head[3:4] in ("(", " "):
+            match = FOR_RE.match(head)
+            count = 0
+            if match:
+                start, op, end = int(match.group(2)), match.group(3), int(match.group(4))
+                count = max(0, end - start + (1 if op == "<=" else 0))
+            stmt = ("for", count, [])
+        else:
+            stmt = None
+
+        if stmt is not None:
+            body.append(stmt)
+            block_body = stmt[2]
+            if opens:
+                open_block(stmt, block_body)
+            else:
+                pending = (stmt, block_body)
+            continue
+
+        delay = DELAY_RE.match(line)
+        if delay:
+            body.append(("wait", round(float(delay.group(1)))))
+            continue
+
+        assign = ASSIGN_RE.match(line)
+        if assign and "(" not in assign.group(1):
+            body.append(("set", assign.group(1), assign.group(2).strip()))
+            continue
+
+        command = line.rstrip(";").strip()
+        if command.endswith("()"):
+            # The firmware matches bare names ("stopMotor"), not "stopMotor()".
+            command = command[:-2].strip()
+        if command:
+            duration = DURATION_RE.search(command)
+            ms = None
+            if duration:
+                # Blocks can emit fractional ms (a 0.3333 s move); the
+                # firmware's toInt() only reads whole numbers, so round here.
+                ms = round(float(duration.group(1)))
+                command = command[:duration.start()] + f"({ms})" + command[duration.end():]
+            body.append(("cmd", command, ms))
+
+    if pending is not None or len(stack) != 1:
+        raise ProgramError("Unterminated block (missing '}')")
+    return root
+
+
+# --- Conditions: a small, safe subset of C expressions ---
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub,
+    ast.UAdd, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+    ast.Constant, ast.Name, ast.Load, ast.Call,
+)
+
+
+_BIN_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.Mod: operator.mod,
+}
+_CMP_OPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+
+def _to_python(expr: str) -> str:
+    expr = expr.replace("&&", " and ").replace("||", " or ")
+    expr = re.sub(r"!(?!=)", " not ", expr)
+    expr = re.sub(r"\btrue\b", "True", expr)
+    expr = re.sub(r"\bfalse\b", "False", expr)
+    return expr
+
+
+def evaluate(expr: str, variables: dict, functions: dict):
+    """
+    Evaluate a generated-code expression against the run's variables.
+    Only literals, arithmetic, comparisons, boolean logic and the calls in
+    `functions` are allowed. Unknown my_<n> tokens behave like the browser
+    did: my_1_5 reads as 1.5, anything else as 0.
+    """
+    try:
+        tree = ast.parse(_to_python(expr).strip(), mode="eval")
+    except SyntaxError as e:
+        raise ProgramError(f"Cannot parse expression {expr!r}: {e}") from None
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ProgramError(f"Unsupported syntax in expression {expr!r}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in functions or node.args:
+                raise ProgramError(f"Unsupported call in expression {expr!r}")
+
+    def ev(node):
+        if isinstance(node, ast.Expression):
+            return ev(node.body)
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id in variables:
+                return variables[node.id]
+            if node.id in ("HIGH", "LOW"):
+                return 1 if node.id == "HIGH" else 0
+            match = MY_VAR_RE.match(node.id)
+            if match:
+                try:
+                    return float(match.group(1).replace("_", "."))
+                except ValueError:
+                    return 0
+            return 0
+        if isinstance(node, ast.Call):
+            return functions[node.func.id]()
+        if isinstance(node, ast.BoolOp):
+            if isinstance(node.op, ast.And):
+                return all(ev(v) for v in node.values)
+            return any(ev(v) for v in node.values)
+        if isinstance(node, ast.UnaryOp):
+            value = ev(node.operand)
+            if isinstance(node.op, ast.Not):
+                return not value
+            return -value if isinstance(node.op, ast.USub) else +value
+        if isinstance(node, ast.BinOp):
+            return _BIN_OPS[type(node.op)](ev(node.left), ev(node.right))
+        if isinstance(node, ast.Compare):
+            left = ev(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = ev(comparator)
+                if not _CMP_OPS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        raise ProgramError(f"Unsupported syntax in expression {expr!r}")
+
+    try:
+        return ev(tree)
+    except ProgramError:
+        raise
+    except Exception as e:
+        raise ProgramError(f"Error evaluating {expr!r}: {e}") from None
+
+
+# --- Execution ---
+
+class ProgramRun:
+    """
+    One program executing on a background thread.
+
+    Commands are released on a monotonic-clock schedule: each command is due
+    at (start + sum of the previous durations), so slow sends or condition
+    queries never push the rest of the program later.
+    """
+
+    def __init__(self, statements, send, default_ms=DEFAULT_STEP_MS, start_at=None, on_status=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.statements = statements
+        self.send = send
+        self.on_status = on_status   # on_status(run) when the run starts and ends
+        self.default_ms = default_ms
+        self.status = "pending"
+        self.error = None
+        self.variables = {}
+        self.steps = 0
+        self.failures = 0
+        self.current = None
+        self.max_lateness_ms = 0.0
+        self.created_at = time.time()
+        self.finished_at = None
+        self.log = []
+        self._cancel = threading.Event()
+        self.start_at = start_at   # monotonic start time shared by a broadcast
+        self.first_sent_at = None
+        self._t0 = None
+        self._due = 0.0        # seconds after _t0 when the next step may start
+        self._thread = threading.Thread(target=self._run, name=f"run-{self.id}", daemon=True)
+
+    # --- scheduling helpers ---
+
+    def _wait_until_due(self):
+        delay = self._t0 + self._due - time.monotonic()
+        if delay > 0 and self._cancel.wait(delay):
+            raise RunCancelled()
+        if self._cancel.is_set():
+            raise RunCancelled()
+        lateness = (time.monotonic() - (self._t0 + self._due)) * 1000
+        self.max_lateness_ms = max(self.max_lateness_ms, round(lateness, 2))
+
+    def _query_led(self):
+        self._wait_until_due()
+        reply = self.send("GET_LED_COLOR")
+        self._record("GET_LED_COLOR", reply)
+        return reply or ""
+
+    def _record(self, command, reply):
+        self.log.append({
+            "t_ms": round((time.monotonic() - self._t0) * 1000, 1),
+            "command": command,
+            "response": reply,
+        })
+        if len(self.log) > 200:
+            del self.log[0]
+
+    def _exec(self, statements):
+        functions = {"getCurrentLEDColor": self._query_led}
+        for stmt in statements:
+            kind = stmt[0]
+            if kind == "cmd":
+                _, command, duration = stmt
+                if self.steps >= MAX_STEPS:
+                    raise ProgramError(f"Program exceeded {MAX_STEPS} commands")
+                self._wait_until_due()
+                self.current = command
+                if self.first_sent_at is None:
+                    self.first_sent_at = time.monotonic()
+                reply = self.send(command)
+                self.steps += 1
+                if reply is None:
+                    self.failures += 1
+                self._record(command, reply)
+                self._due += (duration if duration is not None else self.default_ms) / 1000.0
+            elif kind == "wait":
+                self._due += stmt[1] / 1000.0
+            elif kind == "set":
+                self.variables[stmt[1]] = evaluate(stmt[2], self.variables, functions)
+            elif kind == "if":
+                branch = stmt[2] if evaluate(stmt[1], self.variables, functions) else stmt[3]
+                self._exec(branch)
+            elif kind == "for":
+                for _ in range(stmt[1]):
+                    self._exec(stmt[2])
+            elif kind == "while":
+                count = 0
+                while count < MAX_WHILE_ITERATIONS and evaluate(stmt[1], self.variables, functions):
+                    self._exec(stmt[2])
+                    count += 1
+
+    def _status_changed(self):
+        if self.on_status is not None:
+            try:
+                self.on_status(self)
+            except Exception as e:
+                print(f"[run] {self.id} status listener failed: {e!r}")
+
+    def _run(self):
+        self.status = "running"
+        self._t0 = self.start_at if self.start_at is not None else time.monotonic()
+        self._status_changed()
+        try:
+            self._exec(self.statements)
+            # Let the last command's duration elapse before reporting done.
+            self._wait_until_due()
+            self.status = "done"
+        except RunCancelled:
+            self.status = "cancelled"
+            self.send("stopMotor")
+        except ProgramError as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"[run] {self.id} failed: {e}")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"[run] {self.id} crashed: {e}")
+        finally:
+            self.current = None
+            self.finished_at = time.time()
+            self._status_changed()
+
+    # --- public API ---
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def to_dict(self) -> dict:
+        elapsed = None
+        if self._t0 is not None:
+            elapsed = round((time.monotonic() - self._t0) * 1000, 1)
+        return {
+            "run_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "steps_sent": self.steps,
+            "failures": self.failures,
+            "current_command": self.current,
+            "variables": dict(self.variables),
+            "elapsed_ms": elapsed if self.active else None,
+            "max_lateness_ms": self.max_lateness_ms,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "log": list(self.log[-50:]),
+        }
+
+
+class ProgramRunner:
+    """
+    Owns the program runs of one robot: at most one active at a time, plus a
+    short history of finished runs for status lookups.
+    """
+
+    def __init__(self, send, on_status=None):
+        self.send = send
+        self.on_status = on_status
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def start(self, code: str, default_ms=DEFAULT_STEP_MS, start_at=None) -> ProgramRun:
+        """
+        Parse and start a program. `start_at` (a time.monotonic() value)
+        delays the first step so several robots can start together.
+        Raises ProgramError on bad input and RuntimeError if another run is
+        still active.
+        """
+        statements = parse_program(extract_loop_lines(code))
+        with self._lock:
+            if any(r.active for r in self._runs.values()):
+                raise RuntimeError("A program is already running")
+            run = ProgramRun(statements, self.send, default_ms, start_at, self.on_status)
+            self._runs[run.id] = run
+            finished = [r for r in self._runs.values() if not r.active]
+            for old in sorted(finished, key=lambda r: r.created_at)[:-KEEP_FINISHED_RUNS]:
+                del self._runs[old.id]
+        run.start()
+        return run
+
+    def get(self, run_id: str):
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def active(self):
+        with self._lock:
+            for run in self._runs.values():
+                if run.active:
+                    return run
+        return None
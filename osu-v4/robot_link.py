@@ -0,0 +1,562 @@
+import asyncio
+import collections
+import concurrent.futures
+import re
+import socket
+import threading
+import time
+
+from metrics import REGISTRY
+
+# --- Link tuning ---
+CONNECT_TIMEOUT = 1.5   # seconds to wait for the ESP32 to accept
+RECV_TIMEOUT = 1.5      # seconds to wait for a GET_ reply line
+WRITE_TIMEOUT = 1.5     # seconds to wait for the kernel to take a write
+BACKOFF_MIN = 0.25      # first retry delay after a failed connect
+BACKOFF_MAX = 8.0       # retry delay ceiling while a robot stays unreachable
+MOTION_DEFAULT_MS = 5000  # firmware default for a bare moveForward/moveBackward
+DEADLINE_SLACK = 0.25   # extra time a caller waits on top of the link timeouts
+
+MOTION_RE = re.compile(r"^move(?:Forward|Backward)(?:\((\d+)\))?$")
+
+# --- Instrumentation (see /metrics); labelled by robot address ---
+CONNECT_SECONDS = REGISTRY.histogram(
+    "robot_connect_seconds", "TCP connect time to a robot.", ("robot",))
+WRITE_SECONDS = REGISTRY.histogram(
+    "robot_write_seconds", "Time to hand a command frame to the robot (incl. reconnect).", ("robot",))
+REPLY_SECONDS = REGISTRY.histogram(
+    "robot_reply_seconds", "Time from write to the reply of a GET_ query.", ("robot",))
+COMMANDS_TOTAL = REGISTRY.counter(
+    "robot_commands_total", "Commands written to a robot.", ("robot", "kind"))
+FAILURES_TOTAL = REGISTRY.counter(
+    "robot_failures_total", "Failed connects, writes and replies.", ("robot", "stage"))
+
+
+def is_query(command: str) -> bool:
+    """
+    GET_ commands are the only ones the firmware answers with a line.
+    """
+    return command.startswith("GET_")
+
+
+def motion_ms(command: str) -> int:
+    """
+    How long the motors run for this command (0 if it is not a motion).
+    """
+    match = MOTION_RE.match(command.rstrip(';').strip())
+    if not match:
+        return 0
+    return int(match.group(1)) if match.group(1) else MOTION_DEFAULT_MS
+
+
+class _AsyncConnection:
+    """
+    One long-lived TCP connection to a robot's command server, living on the
+    gateway's event loop.
+
+    The stream is opened lazily and kept open between commands, so a command
+    costs a single write instead of connect + write + close. Writes are
+    serialized under an asyncio lock, but replies are not: a reader task
+    splits the incoming byte stream into lines (however TCP segments them)
+    and hands each line to the oldest outstanding query. The firmware
+    processes lines strictly in order, so FIFO matching pairs every reply
+    with its request while many queries are in flight at once.
+
+    If the robot drops the connection the next command reconnects
+    transparently; repeated connect failures back off exponentially so a
+    dead robot fails fast instead of costing a full connect timeout on
+    every call.
+    """
+
+    def __init__(self, host: str, port: int, on_change=None, channel=None):
+        self.host = host
+        self.port = port
+        self.channel = channel
+        self.on_change = on_change   # on_change(host, port, connected, reason)
+        self._label = f"{host}:{port}" + (f"/{channel}" if channel else "")
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = collections.deque()  # futures awaiting a reply line, oldest first
+        self._busy_until = 0.0     # monotonic time the robot finishes queued motion
+        self._lock = None          # created on the loop, see _ensure_lock()
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._stats = {
+            "connects": 0,
+            "connect_failures": 0,
+            "reconnects": 0,
+            "commands": 0,
+            "queries": 0,
+            "failures": 0,
+            "bytes_sent": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "unsolicited_lines": 0,
+            "last_error": None,
+            "last_latency_ms": None,
+            "connected_since": None,
+        }
+
+    # --- stream lifecycle ---
+
+    def _ensure_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _alive(self) -> bool:
+        # The reader task notices EOF as soon as the robot closes the
+        # connection (e.g. after a reboot) and drops the stream.
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _connect(self):
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise ConnectionError(
+                f"backing off, retry in {self._retry_at - now:.2f}s")
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            self._stats["connect_failures"] += 1
+            FAILURES_TOTAL.inc(self._label, "connect")
+            self._backoff = min(max(self._backoff * 2, BACKOFF_MIN), BACKOFF_MAX)
+            self._retry_at = now + self._backoff
+            print(f"[wifi] CONNECT failed to {self.host}:{self.port} -> {e!r} "
+                  f"(next retry in {self._backoff:.2f}s)")
+            raise ConnectionError(f"connect failed: {e!r}") from e
+        CONNECT_SECONDS.observe(time.perf_counter() - started, self._label)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if self._stats["connects"]:
+            self._stats["reconnects"] += 1
+        self._stats["connects"] += 1
+        self._stats["connected_since"] = time.time()
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._busy_until = 0.0
+        self._reader, self._writer = reader, writer
+        self._reader_task = asyncio.ensure_future(self._read_replies(reader))
+        self._changed(True, None)
+
+    def _changed(self, connected: bool, reason):
+        if self.on_change is not None:
+            try:
+                self.on_change(self.host, self.port, connected, reason)
+            except Exception as e:
+                print(f"[wifi] connection listener failed: {e!r}")
+
+    def _drop(self, reason="connection dropped"):
+        """
+        Close the stream and fail every query still waiting on it: once a
+        reply is missing, later lines can no longer be matched safely.
+        """
+        was_connected = self._writer is not None
+        if self._reader_task is not None and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = self._reader_task = None
+        self._stats["connected_since"] = None
+        while self._pending:
+            fut = self._pending.popleft()
+            if not fut.done():
+                fut.set_exception(ConnectionError(reason))
+        self._stats["in_flight"] = 0
+        if was_connected:
+            self._changed(False, reason)
+
+    async def _read_replies(self, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.endswith(b"\n"):
+                    break  # EOF (a trailing partial line is discarded)
+                text = line.decode(errors="replace").strip()
+                if not self._pending:
+                    self._stats["unsolicited_lines"] += 1
+                    continue
+                fut = self._pending.popleft()
+                self._stats["in_flight"] = len(self._pending)
+                # A waiter that gave up still owns its slot; its reply is dropped here.
+                if not fut.done():
+                    fut.set_result(text)
+        except asyncio.CancelledError:
+            raise
+        except (OSError, ValueError) as e:
+            self._stats["last_error"] = repr(e)
+        if self._reader is reader:
+            self._drop("connection closed by robot")
+
+    def _expect(self, commands: list) -> tuple:
+        """
+        Register a reply slot for every query in `commands`, in order. Must
+        run before the write so a fast reply always finds its slot. Each
+        reply deadline includes the motion queued ahead of it, since older
+        firmware blocks while a move runs (current firmware answers at once).
+        """
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        busy_until = max(now, self._busy_until)
+        waiters = []
+        for command in commands:
+            if is_query(command):
+                fut = loop.create_future()
+                self._pending.append(fut)
+                waiters.append((fut, busy_until + RECV_TIMEOUT))
+            else:
+                busy_until += motion_ms(command) / 1000.0
+        self._stats["in_flight"] = len(self._pending)
+        self._stats["max_in_flight"] = max(self._stats["max_in_flight"], len(self._pending))
+        return waiters, busy_until
+
+    def _write_now(self, commands: list) -> list:
+        """
+        Queue one newline-delimited frame on the live stream without
+        yielding to the loop. Returns (future, deadline) for each query.
+        """
+        payload = "".join(c + "\n" for c in commands).encode()
+        waiters, busy_until = self._expect(commands)
+        self._writer.write(payload)
+        self._busy_until = busy_until
+        self._stats["bytes_sent"] += len(payload)
+        self._stats["commands"] += len(commands)
+        self._stats["queries"] += len(waiters)
+        if len(commands) > len(waiters):
+            COMMANDS_TOTAL.inc(self._label, "command", amount=len(commands) - len(waiters))
+        if waiters:
+            COMMANDS_TOTAL.inc(self._label, "query", amount=len(waiters))
+        return waiters
+
+    async def _write(self, commands: list) -> list:
+        """
+        Write the commands as one newline-delimited frame, reconnecting once
+        if the stream turns out stale. Returns (future, deadline) for each
+        query, in order.
+        """
+        with WRITE_SECONDS.time(self._label):
+            return await self._write_locked(commands)
+
+    async def _write_locked(self, commands: list) -> list:
+        async with self._ensure_lock():
+            for attempt in (1, 2):
+                try:
+                    if not self._alive():
+                        self._drop()
+                        await self._connect()
+                    waiters = self._write_now(commands)
+                    await asyncio.wait_for(self._writer.drain(), WRITE_TIMEOUT)
+                    return waiters
+                except (OSError, asyncio.TimeoutError) as e:
+                    self._drop(repr(e))
+                    self._stats["last_error"] = repr(e)
+                    if attempt == 2 or self._retry_at or isinstance(e, asyncio.TimeoutError):
+                        raise ConnectionError(str(e) or repr(e)) from e
+
+    async def ensure_connected(self):
+        """
+        Open the stream now if it is not already open (raises on failure).
+        """
+        async with self._ensure_lock():
+            if not self._alive():
+                self._drop()
+                await self._connect()
+
+    async def _reply(self, fut, deadline: float) -> str:
+        started = time.perf_counter()
+        try:
+            reply = await asyncio.wait_for(fut, max(0.0, deadline - time.monotonic()))
+            REPLY_SECONDS.observe(time.perf_counter() - started, self._label)
+            return reply
+        except asyncio.TimeoutError:
+            # An overdue reply would shift every later match; start clean.
+            self._drop("reply timed out")
+            raise
+
+    def busy_remaining(self) -> float:
+        return max(0.0, self._busy_until - time.monotonic())
+
+    # --- coroutines run by the gateway ---
+
+    async def send(self, command: str):
+        """
+        Send a single-line command. Returns the reply line for GET_
+        queries, "OK" for fire-and-forget commands, or None on failure.
+        """
+        command = command.rstrip(';')
+        start = time.perf_counter()
+        stage = "send"
+        try:
+            waiters = await self._write([command])
+            stage = "recv"
+            reply = "OK"
+            for fut, deadline in waiters:
+                reply = await self._reply(fut, deadline) or "OK"
+        except (OSError, asyncio.TimeoutError) as e:
+            self._stats["failures"] += 1
+            self._stats["last_error"] = repr(e)
+            FAILURES_TOTAL.inc(self._label, stage)
+            print(f"[wifi] SEND/RECV failed on {self.host}:{self.port} -> {e!r}")
+            return None
+        self._stats["last_latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return reply
+
+    async def send_batch(self, commands: list):
+        """
+        Send several commands as one newline-delimited write and collect the
+        replies to the GET_ queries in order. Returns one result per
+        command ("OK" or the reply line), or None if the write failed.
+        """
+        commands = [c.rstrip(';') for c in commands]
+        start = time.perf_counter()
+        try:
+            waiters = await self._write(commands)
+        except ConnectionError as e:
+            self._stats["failures"] += 1
+            FAILURES_TOTAL.inc(self._label, "send")
+            print(f"[wifi] batch SEND failed -> {e}")
+            return None
+
+        results = []
+        replies = iter(waiters)
+        for command in commands:
+            if not is_query(command):
+                results.append("OK")
+                continue
+            fut, deadline = next(replies)
+            try:
+                results.append(await self._reply(fut, deadline) or "OK")
+            except (OSError, asyncio.TimeoutError) as e:
+                # Everything was written; only this and later replies are lost.
+                self._stats["failures"] += 1
+                self._stats["last_error"] = repr(e)
+                FAILURES_TOTAL.inc(self._label, "recv")
+                print(f"[wifi] batch RECV failed from {self.host}:{self.port} -> {e!r}")
+                results.append(None)
+        self._stats["last_latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return results
+
+    async def close(self):
+        async with self._ensure_lock():
+            self._drop("connection closed")
+
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["host"] = self.host
+        out["port"] = self.port
+        out["channel"] = self.channel
+        out["label"] = self._label
+        out["connected"] = self._writer is not None
+        out["backoff_s"] = self._backoff
+        return out
+
+
+class RobotConnection:
+    """
+    Thread-side handle for one robot. Calls hand the work to the gateway's
+    event loop and wait on the resulting future with a deadline, so a slow
+    or unreachable robot costs the calling thread at most that deadline and
+    no socket of its own.
+    """
+
+    def __init__(self, gateway, conn: _AsyncConnection):
+        self._gateway = gateway
+        self._conn = conn
+        self.host = conn.host
+        self.port = conn.port
+
+    def send(self, command: str, timeout: float = None):
+        if timeout is None:
+            timeout = CONNECT_TIMEOUT + WRITE_TIMEOUT
+            if is_query(command):
+                timeout += RECV_TIMEOUT + self._conn.busy_remaining()
+        return self._gateway.call(self._conn.send(command), timeout + DEADLINE_SLACK)
+
+    def send_batch(self, commands: list, timeout: float = None):
+        if timeout is None:
+            queries = sum(1 for c in commands if is_query(c))
+            timeout = (CONNECT_TIMEOUT + WRITE_TIMEOUT + queries * RECV_TIMEOUT
+                       + self._conn.busy_remaining()
+                       + sum(motion_ms(c) for c in commands) / 1000.0)
+        return self._gateway.call(self._conn.send_batch(commands), timeout + DEADLINE_SLACK)
+
+    def busy_remaining(self) -> float:
+        return self._conn.busy_remaining()
+
+    def submit(self, command: str) -> concurrent.futures.Future:
+        """
+        Non-blocking send: returns a future resolving to the send() result.
+        """
+        return self._gateway.submit(self._conn.send(command))
+
+    def warm(self):
+        """
+        Open the stream in the background if it is not open yet.
+        """
+        if not self._conn._alive() and time.monotonic() >= self._conn._retry_at:
+            self._gateway.submit(self._conn.ensure_connected())
+
+    def stats(self) -> dict:
+        return self._conn.stats()
+
+    def close(self):
+        self._gateway.call(self._conn.close(), CONNECT_TIMEOUT)
+
+
+class RobotGateway:
+    """
+    Owns every robot connection on a single asyncio event loop running in a
+    background thread. Any number of in-flight commands and queries are
+    multiplexed on that loop, so Flask request threads never block on a
+    socket themselves.
+    """
+
+    def __init__(self):
+        self._conns = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        # Called as listener(host, port, connected, reason) on the event
+        # loop whenever a robot connection opens or drops; must not block.
+        self.listeners = []
+
+    def _connection_changed(self, host, port, connected, reason):
+        for listener in list(self.listeners):
+            listener(host, port, connected, reason)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # Started lazily so the debug reloader's parent process stays idle.
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="robot-gateway", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def call(self, coro, timeout: float):
+        """
+        Run a coroutine on the gateway and wait at most `timeout` seconds.
+        Returns None (and cancels the work) if the deadline passes.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            print(f"[wifi] gateway deadline of {timeout:.2f}s exceeded")
+            return None
+
+    async def _warm_up(self, conns: list, timeout: float) -> list:
+        async def one(conn):
+            try:
+                await asyncio.wait_for(conn.ensure_connected(), timeout)
+                return True
+            except (OSError, asyncio.TimeoutError):
+                return False
+        return await asyncio.gather(*(one(c) for c in conns))
+
+    def warm_up(self, conns: list, timeout: float) -> list:
+        """
+        Connect to every robot concurrently. Returns True/False per robot.
+        """
+        ok = self.call(self._warm_up([c._conn for c in conns], timeout), timeout + DEADLINE_SLACK)
+        return ok if ok is not None else [False] * len(conns)
+
+    async def _broadcast(self, conns: list, command: str, deadline: float) -> list:
+        t0 = time.monotonic()
+        results = [{"ok": False, "response": None, "sent_ms": None, "error": None} for _ in conns]
+
+        def write(conn, result):
+            result["waiters"] = conn._write_now([command])
+            result["sent_at"] = time.monotonic()
+
+        # Every live stream gets its frame in the same loop tick, so the
+        # start skew across robots is the cost of a few buffered writes.
+        # Robots that need a reconnect get theirs as soon as they are up.
+        for conn, result in zip(conns, results):
+            if conn._alive():
+                write(conn, result)
+
+        async def finish(conn, result):
+            if "sent_at" not in result:
+                try:
+                    await asyncio.wait_for(conn.ensure_connected(), max(0.0, t0 + deadline - time.monotonic()))
+                except (OSError, asyncio.TimeoutError):
+                    result["error"] = conn._stats["last_error"] or "not connected"
+                    return
+                write(conn, result)
+            try:
+                remaining = max(0.0, t0 + deadline - time.monotonic())
+                await asyncio.wait_for(conn._writer.drain(), remaining)
+                reply = "OK"
+                for fut, reply_deadline in result["waiters"]:
+                    reply = await conn._reply(fut, min(reply_deadline, t0 + deadline)) or "OK"
+                result["ok"], result["response"] = True, reply
+            except (OSError, asyncio.TimeoutError, AttributeError) as e:
+                conn._drop(repr(e))
+                conn._stats["failures"] += 1
+                result["error"] = repr(e)
+
+        await asyncio.gather(*(finish(c, r) for c, r in zip(conns, results)))
+        for result in results:
+            result.pop("waiters", None)
+            sent_at = result.pop("sent_at", None)
+            if sent_at is not None:
+                result["sent_ms"] = round((sent_at - t0) * 1000, 3)
+        return results
+
+    def broadcast(self, conns: list, command: str, deadline: float) -> list:
+        """
+        Send one command to many robots at once, each bounded by `deadline`
+        seconds. Returns per-robot dicts with ok/response/error and the
+        write time in ms since the broadcast began (sent_ms).
+        """
+        results = self.call(self._broadcast([c._conn for c in conns], command.rstrip(';'), deadline),
+                            deadline + CONNECT_TIMEOUT + DEADLINE_SLACK)
+        if results is None:
+            results = [{"ok": False, "response": None, "sent_ms": None, "error": "deadline exceeded"}
+                       for _ in conns]
+        return results
+
+    def get(self, host: str, port: int, channel=None) -> RobotConnection:
+        """
+        The shared connection to host:port. A `channel` name gives a
+        separate stream to the same robot (e.g. "control" for stopMotor);
+        only the main stream reports to `listeners`.
+        """
+        key = (host, port, channel)
+        with self._lock:
+            conn = self._conns.get(key)
+            if conn is None:
+                on_change = self._connection_changed if channel is None else None
+                conn = self._conns[key] = RobotConnection(
+                    self, _AsyncConnection(host, port, on_change, channel))
+            return conn
+
+    def stats(self) -> list:
+        with self._lock:
+            conns = list(self._conns.values())
+        return [c.stats() for c in conns]
+
+    def close_all(self):
+        with self._lock:
+            conns = list(self._conns.values())
+            self._conns.clear()
+        for c in conns:
+            c.close()
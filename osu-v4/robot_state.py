@@ -0,0 +1,199 @@
+import threading
+import time
+
+from robot_link import motion_ms
+
+LED_COMMANDS = {"setRed": "#FF0000", "setGreen": "#00FF00", "setBlue": "#0000FF"}
+LED_QUERY = "GET_LED_COLOR"
+SHADOW_MAX_AGE = 30.0   # seconds a shadowed LED color may answer GET_LED_COLOR
+LED_SETTLE = 0.5        # the firmware applies setX on its next loop(); ignore replies racing it
+RECONCILE_INTERVAL = 0  # seconds between background GET_LED_COLOR checks (0 = off)
+
+
+class RobotShadow:
+    """
+    What the server believes a robot's state is, built from the commands it
+    forwards: LED color, motor state and the last command.
+
+    GET_LED_COLOR is answered from the shadow while the color is younger
+    than `max_age` seconds; otherwise (or if the color was never set by
+    this server) the query goes to the robot and its reply refreshes the
+    shadow.
+    """
+
+    def __init__(self, max_age: float = SHADOW_MAX_AGE, on_change=None):
+        self.max_age = max_age
+        self.on_change = on_change   # on_change(state_dict) when LED color or motor changes
+        self.led_color = None
+        self.led_source = None       # "command" or "robot"
+        self._led_at = None          # monotonic time of the last LED update
+        self._led_set_at = None      # monotonic time of the last setX we sent
+        self.motor = "stopped"
+        self._motor_until = 0.0
+        self._motion_start = 0.0     # when the latest accepted motion starts (later if queued)
+        self.dropped_motions = 0     # motions the firmware ignored (its one queue slot was taken)
+        self.last_command = None
+        self.last_command_at = None  # wall clock
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0          # robot replies that disagreed with the shadow
+        self._lock = threading.Lock()
+
+    # --- updates ---
+
+    def observe(self, command: str, result):
+        """
+        Record a command the robot accepted (`result` not None).
+        """
+        if result is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            before = (self.led_color, self.motor, self._motor_until)
+            self.last_command = command
+            self.last_command_at = time.time()
+            if command in LED_COMMANDS:
+                self.led_color = LED_COMMANDS[command]
+                self.led_source = "command"
+                self._led_at = self._led_set_at = now
+            elif command == LED_QUERY:
+                self._observe_reply(result, now)
+            elif command == "stopMotor":
+                self.motor, self._motor_until, self._motion_start = "stopped", 0.0, 0.0
+            elif motion_ms(command):
+                if self._motion_start > now:
+                    # The firmware holds one motion behind the running one
+                    # and ignores any further motion until that one starts.
+                    self.dropped_motions += 1
+                else:
+                    # A queued motion starts when the previous one ends.
+                    start = max(now, self._motor_until)
+                    self.motor = "forward" if command.startswith("moveForward") else "backward"
+                    self._motion_start = start
+                    self._motor_until = start + motion_ms(command) / 1000.0
+            changed = before != (self.led_color, self.motor, self._motor_until)
+        if changed and self.on_change is not None:
+            self.on_change(self.to_dict())
+
+    def _observe_reply(self, reply: str, now: float):
+        if not reply.startswith("#"):
+            return
+        if self._led_set_at is not None and now - self._led_set_at < LED_SETTLE:
+            return
+        if self.led_color is not None and reply.upper() != self.led_color:
+            self.mismatches += 1
+        self.led_color = reply.upper()
+        self.led_source = "robot"
+        self._led_at = now
+
+    # --- answers ---
+
+    def _fresh(self, now: float) -> bool:
+        return (self.max_age > 0 and self.led_color is not None
+                and now - self._led_at <= self.max_age)
+
+    def answer(self, command: str):
+        """
+        The shadowed reply for a query, or None if it has to go to the robot.
+        """
+        if command != LED_QUERY:
+            return None
+        with self._lock:
+            if self._fresh(time.monotonic()):
+                self.hits += 1
+                return self.led_color
+            self.misses += 1
+            return None
+
+    def plan(self, commands: list) -> list:
+        """
+        Shadowed replies for a batch, applying the batch's own LED commands
+        in order (the firmware would still report the old color for a
+        GET_LED_COLOR in the same write). None where the robot must answer.
+        """
+        with self._lock:
+            color = self.led_color if self._fresh(time.monotonic()) else None
+        answers = []
+        for command in commands:
+            if command in LED_COMMANDS:
+                color = LED_COMMANDS[command]
+            answers.append(color if command == LED_QUERY else None)
+        with self._lock:
+            for answer, command in zip(answers, commands):
+                if command == LED_QUERY:
+                    if answer is None:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+        return answers
+
+    def motion_hold(self, lead: float, settle: float = 0.0) -> float:
+        """
+        Seconds until another motion can be sent without the firmware
+        dropping it: not until `settle` seconds after the latest motion has
+        started (the firmware holds only one behind the running one), and
+        otherwise `lead` seconds before the motions run out.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return max(0.0, self._motion_start + settle - now, self._motor_until - lead - now)
+
+    def motion_remaining(self) -> float:
+        """
+        Seconds until the motions sent so far have run out (0 if stopped).
+        """
+        with self._lock:
+            return max(0.0, self._motor_until - time.monotonic())
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            moving = self.motor != "stopped" and now < self._motor_until
+            return {
+                "led_color": self.led_color,
+                "led_source": self.led_source,
+                "led_age_s": None if self._led_at is None else round(now - self._led_at, 3),
+                "led_fresh": self._fresh(now),
+                "motor": self.motor if moving else "stopped",
+                "motor_remaining_ms": round((self._motor_until - now) * 1000) if moving else 0,
+                "last_command": self.last_command,
+                "last_command_at": self.last_command_at,
+                "max_age_s": self.max_age,
+                "hits": self.hits,
+                "misses": self.misses,
+                "mismatches": self.mismatches,
+                "dropped_motions": self.dropped_motions,
+            }
+
+
+class ShadowReconciler:
+    """
+    Background thread that asks idle, connected robots for GET_LED_COLOR
+    every `interval` seconds so their shadows stay fresh and drift (a
+    reboot, another controller) is noticed.
+    """
+
+    def __init__(self, registry, interval: float):
+        self.registry = registry
+        self.interval = interval
+        self.rounds = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="shadow-reconcile", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            for robot in self.registry.all():
+                if robot.runner.active() or robot.conn.busy_remaining() > 0:
+                    continue   # never delay a running program
+                if not robot.conn.stats()["connected"]:
+                    continue
+                reply = robot.conn.send(LED_QUERY)
+                if reply is not None:
+                    robot.shadow.observe(LED_QUERY, reply)
+            self.rounds += 1
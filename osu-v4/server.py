@@ -1,29 +1,145 @@
-from flask import Flask, send_from_directory, jsonify, request
+from flask import Flask, jsonify, request, abort, g, Response
 from flask_cors import CORS
+import argparse
+import io
 import os
 import time
-import socket
-import requests
 from glob import glob
 from werkzeug.utils import secure_filename
 from urllib.parse import unquote
+from robot_link import RobotGateway
+from program_runner import ProgramError, DEFAULT_STEP_MS
+from fleet import RobotRegistry, DEFAULT_ROBOT_ID, config_path
+from command_queue import QueueFull, QueuedCommand
+from robot_state import ShadowReconciler, LED_QUERY, SHADOW_MAX_AGE, RECONCILE_INTERVAL
+from static_assets import StaticAssets
+from upload_pipeline import UploadPipeline
+from pic_store import PicStore
+import image_prep
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import serving
+from events import EVENTS, HEARTBEAT_SECONDS, sse_format
 
 # --- Paths ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_FOLDER = os.path.join(BASE_DIR, "data")
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "pics")
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", os.path.join(BASE_DIR, "pics"))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", os.path.join(BASE_DIR, ".asset_cache"))
+ASSET_HOT_CACHE_MB = int(os.environ.get("ASSET_HOT_CACHE_MB", "32"))
+
+# Compressed variants, content-hash ETags and immutable caching for data/.
+# The manifest is built once here; hot files are then served from memory.
+assets = StaticAssets(DATA_FOLDER, ASSET_CACHE_DIR, hot_bytes=ASSET_HOT_CACHE_MB * 1024 * 1024)
+assets.build_manifest()
 
 # --- Network target (set ESP32_IP via env to avoid editing code) ---
 ESP32_IP = os.environ.get("ESP32_IP", "172.20.10.13")  # <-- set to the IP printed by your ESP32
 ESP32_PORT = 3333
+BROADCAST_DEADLINE_MS = 2000  # per-robot budget for /broadcast
+EXECUTE_WAIT_S = 4.0          # how long /execute waits for a motion that can start now
+
+# All robot sockets live on one asyncio event loop thread; request threads
+# submit work to it and wait on futures with deadlines.
+robot_gateway = RobotGateway()
+
+# --- Fleet: robots keyed by id (ROBOTS_CONFIG or ./config.json) ---
+# The legacy single-robot routes (/execute, /run, ...) use the "default" robot:
+# ESP32_IP when set, or the built-in address when no fleet is configured.
+# A fleet config without one gets no phantom default robot; those routes then
+# drive its first robot.
+robots = RobotRegistry(robot_gateway,
+                       shadow_max_age=float(os.environ.get("SHADOW_MAX_AGE", SHADOW_MAX_AGE)))
+_config = config_path(BASE_DIR)
+_loaded = robots.load(_config) if _config else 0
+if "ESP32_IP" in os.environ or not _loaded:
+    robots.add(DEFAULT_ROBOT_ID, ESP32_IP, ESP32_PORT)
+
+# Each robot's LED color / motor state is shadowed from the commands sent to
+# it, so GET_LED_COLOR rarely needs the network. SHADOW_RECONCILE_S > 0
+# re-reads the real color from idle robots in the background.
+SHADOW_RECONCILE_S = float(os.environ.get("SHADOW_RECONCILE_S", RECONCILE_INTERVAL))
+reconciler = None
+if SHADOW_RECONCILE_S > 0:
+    reconciler = ShadowReconciler(robots, SHADOW_RECONCILE_S)
+    reconciler.start()
 
 app = Flask(__name__)
 CORS(app)  # Allow cross-origin requests from any domain
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Larger request bodies get 413 (the robot's SPIFFS is a few MB anyway).
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "16"))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Uploads are stored once per content hash (pics/.store) and streamed to the
+# robot in one pass, optionally as background jobs (?background=1). Pictures
+# a robot already holds are not sent again (?force=1 resends).
+pictures = PicStore(UPLOAD_FOLDER)
+uploads = UploadPipeline(pictures)
+
+# --- Instrumentation, scraped from /metrics (Prometheus text format) ---
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Flask request handling time.", ("endpoint", "method", "status"))
+REGISTRY.gauge("robot_connected", "1 if the robot's command stream is open.",
+               lambda: {(s["label"],): int(s["connected"]) for s in robot_gateway.stats()},
+               ("robot",))
+REGISTRY.gauge("robot_in_flight", "Queries waiting for a reply.",
+               lambda: {(s["label"],): s["in_flight"] for s in robot_gateway.stats()},
+               ("robot",))
+REGISTRY.callback_counter("robot_shadow_hits_total", "GET_LED_COLOR answered from the state shadow.",
+                          lambda: {(r.id,): r.shadow.hits for r in robots.all()}, ("robot_id",))
+REGISTRY.callback_counter("robot_shadow_misses_total", "GET_LED_COLOR that had to ask the robot.",
+                          lambda: {(r.id,): r.shadow.misses for r in robots.all()}, ("robot_id",))
+REGISTRY.gauge("event_subscribers", "Open /events streams.",
+               lambda: {(): EVENTS.stats()["subscribers"]})
+REGISTRY.gauge("asset_hot_cache", "Static asset memory cache counters.",
+               lambda: {(k,): v for k, v in assets.hot.stats().items()}, ("field",))
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_timing(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started, rule, request.method, response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+def lookup_robot(robot_id):
+    """
+    The robot a request targets: the default robot for the legacy routes
+    (robot_id None, falling back to the first configured robot), else the
+    registry entry. None if the id is unknown.
+    """
+    if robot_id is not None:
+        return robots.get(robot_id)
+    robot = robots.get(DEFAULT_ROBOT_ID)
+    if robot is None:
+        fleet = robots.all()
+        robot = fleet[0] if fleet else None
+    return robot
+
+
+def unknown_robot(robot_id):
+    return jsonify({"error": f"Unknown robot '{robot_id}'"}), 404
+
+
+@app.route('/upload_image', methods=['POST'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/upload_image', methods=['POST'])
+def upload_image(robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
 
-@app.route('/upload_image', methods=['POST'])
-def upload_image():
     # Ensure a file was provided.
     if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
@@ -37,92 +153,451 @@ def upload_image():
             return jsonify({"error": "Only PNG files are allowed."}), 400
 
         filename = secure_filename(file.filename)
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-        # Save locally 
-        file.save(image_path)
-        print("Saved file to:", image_path)
-
-        # Forward the file to the ESP32's upload endpoint.
-        esp32_url = f"http://{ESP32_IP}/upload_image"
-        with open(image_path, 'rb') as f:
-            files = {'file': (filename, f, file.mimetype or 'image/png')}
-            resp = requests.post(esp32_url, files=files, timeout=5)
-
-        return jsonify({
-            "message": "Image saved and forwarded successfully",
-            "filename": filename,
-            "esp32_ip": ESP32_IP,
-            "esp32_response_status": resp.status_code,
-            "esp32_response_text": resp.text
-        }), 200
+        mimetype = file.mimetype or 'image/png'
+
+        # Fit the picture to the 240x240 screen before it leaves the server
+        # (?preprocess=0 sends it untouched; ?fit=cover|contain|stretch, ?colors=N).
+        # ?format=raw sends a pre-rendered RGB565 frame (<name>.565) instead
+        # of a PNG, so the robot skips the PNG decode on every swipe.
+        source, prep = file.stream, None
+        fmt = request.values.get('format', 'png').lower()
+        fit = request.values.get('fit', 'cover')
+        if fmt == 'raw' and image_prep.raw_available():
+            try:
+                frame, prep = image_prep.prepare_raw(file.stream.read(), fit=fit)
+            except image_prep.ImageError as e:
+                return jsonify({"error": str(e)}), 400
+            source, mimetype = io.BytesIO(frame), 'application/octet-stream'
+            filename = os.path.splitext(filename)[0] + image_prep.RAW_FRAME_EXT
+        elif request.values.get('preprocess', '1').lower() not in ('0', 'false', 'no'):
+            if image_prep.available():
+                try:
+                    png, prep = image_prep.prepare_png(
+                        file.stream.read(), fit=fit,
+                        colors=int(request.values.get('colors', image_prep.DEFAULT_COLORS)))
+                except (image_prep.ImageError, ValueError) as e:
+                    return jsonify({"error": str(e)}), 400
+                source, mimetype = io.BytesIO(png), 'image/png'
+            else:
+                prep = {"skipped": "Pillow is not installed (pip install pillow)"}
+        if fmt == 'raw' and not image_prep.raw_available():
+            # The robot still reads PNGs, so fall back to one.
+            prep = dict(prep or {}, format="png",
+                        note="Raw frames need Pillow and NumPy; sent as PNG")
+
+        force = request.values.get('force', '').lower() in ('1', 'true', 'yes')
+        if request.values.get('background', '').lower() in ('1', 'true', 'yes'):
+            # The upload's own stream is closed when this request ends.
+            if source is file.stream:
+                source = io.BytesIO(file.stream.read())
+            job = uploads.submit(robot, source, filename, mimetype, force)
+            return jsonify({
+                "message": "Upload queued",
+                "job_id": job.id,
+                "filename": filename,
+                "robot": robot.id,
+                "status_url": f"/upload_jobs/{job.id}",
+                "preprocess": prep,
+            }), 202
+
+        result = uploads.forward(robot, source, filename, mimetype, force)
+        result["preprocess"] = prep
+        if result["error"]:
+            return jsonify(result), 502
+        if result["skipped"]:
+            result["message"] = "Image saved; the robot already has it"
+        else:
+            result["message"] = "Image saved and forwarded successfully"
+        return jsonify(result), 200
     except Exception as e:
         print("Exception in upload_image:", e)
         return jsonify({"error": str(e)}), 500
 
 
-def send_command_via_wifi(command: str):
+@app.route('/upload_jobs/<job_id>', methods=['GET'])
+def upload_job_status(job_id):
+    job = uploads.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload job"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/pictures', methods=['GET'])
+def list_pictures():
+    return jsonify({"pictures": pictures.pictures()}), 200
+
+
+@app.route('/robots/<robot_id>/pictures', methods=['GET', 'DELETE'])
+def robot_pictures(robot_id):
     """
-    Send a single-line command to the ESP32 TCP server.
-    For non-query commands (no GET_/CHECK_), treat fire-and-forget as success ("OK").
+    GET: pictures (name -> sha256) the server has sent to this robot.
+    DELETE: forget them, e.g. after the robot's SPIFFS was wiped, so the
+    next uploads are sent again.
     """
-    try:
-        cmd = (command.rstrip(';') + "\n").encode()
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1.5)  # set BEFORE connect so connect fails fast
-            try:
-                s.connect((ESP32_IP, ESP32_PORT))
-            except Exception as e:
-                print(f"[wifi] CONNECT failed to {ESP32_IP}:{ESP32_PORT} -> {e}")
-                return None
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    if request.method == 'DELETE':
+        return jsonify({"robot": robot.id, "forgotten": pictures.forget_robot(robot.id)}), 200
+    return jsonify({"robot": robot.id, "pictures": pictures.robot_pictures(robot.id)}), 200
 
-            try:
-                s.sendall(cmd)
-                is_query = command.startswith("GET_") or command.startswith("CHECK_")
-                if not is_query:
-                    return "OK"  # fire-and-forget: don't wait for reply
-
-                s.settimeout(1.5)
-                data = s.recv(1024)
-                return data.decode().strip() if data else "OK"
-            except Exception as e:
-                print(f"[wifi] SEND/RECV failed -> {e}")
-                return None
+
+def send_command_via_wifi(command: str, robot=None, fresh=False):
+    """
+    Send a single-line command to the ESP32 TCP server over the shared
+    persistent connection owned by the asyncio gateway (see robot_link).
+    For non-query commands (no GET_), treat fire-and-forget as success ("OK").
+    GET_LED_COLOR may be answered from the robot's state shadow unless `fresh`.
+    """
+    try:
+        return (robot or lookup_robot(None)).send(command, fresh=fresh)
     except Exception as e:
         print("Error sending command via wifi:", e)
         return None
 
 
+def send_batch_via_wifi(commands: list, robot=None):
+    """
+    Send a list of commands to the ESP32 in a single newline-delimited write.
+    Returns one result per command (see Robot.send_batch) or None.
+    """
+    try:
+        return (robot or lookup_robot(None)).send_batch(commands)
+    except QueueFull:
+        raise
+    except Exception as e:
+        print("Error sending batch via wifi:", e)
+        return None
+
+
+@app.route('/robot/stats', methods=['GET'])
+def robot_stats():
+    return jsonify({"connections": robot_gateway.stats()}), 200
+
+
+@app.route('/robot/state', methods=['GET'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/state', methods=['GET'])
+def robot_state(robot_id):
+    """
+    The server's shadow of the robot: LED color, motor state, last command.
+    """
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    return jsonify({"robot": robot.id, "state": robot.shadow.to_dict()}), 200
+
+
+@app.route('/events', methods=['GET'])
+def event_stream():
+    """
+    Server-Sent Events: command.dispatched, command.acked, robot.connected,
+    robot.disconnected, state.changed and run.status. ?robots=r1,r2 and
+    ?types=... narrow the stream; EventSource's Last-Event-ID resumes it.
+    """
+    robot_ids = [r for r in request.args.get("robots", "").split(",") if r] or None
+    types = [t for t in request.args.get("types", "").split(",") if t] or None
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id")
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    sub = EVENTS.subscribe(robot_ids, types, last_id)
+    if sub is None:
+        return jsonify({"error": "Too many event streams open"}), 503
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                events = sub.get(HEARTBEAT_SECONDS)
+                if sub.closed:
+                    return
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "".join(sse_format(e) for e in events)
+        finally:
+            sub.close()
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/robots', methods=['GET'])
+def list_robots():
+    return jsonify({"robots": [r.to_dict() for r in robots.all()]}), 200
+
+
+@app.route('/robots/<robot_id>/stats', methods=['GET'])
+def robot_stats_one(robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    return jsonify(robot.conn.stats()), 200
+
+
 @app.route('/')
 def index():
-    return send_from_directory(DATA_FOLDER, "index.html")
+    return assets.serve_index() or abort(404)
 
 
 @app.route('/<path:filename>')
 def serve_file(filename):
-    return send_from_directory(DATA_FOLDER, filename)
+    return assets.serve(filename) or abort(404)
 
 # Accept any path chars
-@app.route('/execute/<path:command>', methods=['GET'])
-def execute_command(command):
+@app.route('/execute/<path:command>', methods=['GET'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/execute/<path:command>', methods=['GET'])
+def execute_command(command, robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+
     command = unquote(command).strip()
     if command.endswith(';'):
         command = command[:-1]
 
     if command.startswith("CHECK_COLOR:"):
-        resp = send_command_via_wifi(command)
+        # The firmware does not answer CHECK_ commands; report the LED
+        # color through the query it does answer.
+        resp = send_command_via_wifi(LED_QUERY, robot)
         if resp is not None:
             return jsonify({"status": "Color check response", "LED_color": resp}), 200
         else:
             return jsonify({"error": "Failed to retrieve LED color"}), 500
 
-    resp = send_command_via_wifi(command)
-    if resp is not None:
-        return jsonify({"status": "Command sent", "command": command, "response": resp}), 200
+    # Through the robot's priority queue: stopMotor preempts, motions are
+    # paced back to back, anything else goes out at once.
+    fresh = request.args.get('fresh', '').lower() in ('1', 'true', 'yes')
+    try:
+        item = robot.queue.submit(command, fresh=fresh)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    if item.starts_in > 0 or not item.wait(EXECUTE_WAIT_S):
+        return jsonify({"status": "Command queued", "command": command, "command_id": item.id,
+                        "starts_in_ms": round(item.starts_in * 1000)}), 202
+    if item.result is not None:
+        return jsonify({"status": "Command sent", "command": command, "command_id": item.id,
+                        "response": item.result}), 200
     else:
-        return jsonify({"error": f"Failed to send command via WiFi to {ESP32_IP}:{ESP32_PORT}"}), 500
+        return jsonify({"error": f"Failed to send command via WiFi to {robot.host}:{robot.port}"}), 500
+
+
+@app.route('/queue', methods=['GET'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/queue', methods=['GET'])
+def queue_status(robot_id):
+    """
+    Motions waiting to be sent to the robot.
+    """
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    return jsonify(robot.queue.to_dict()), 200
+
+
+@app.route('/queue/<command_id>', methods=['GET'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/queue/<command_id>', methods=['GET'])
+def queued_command(command_id, robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    item = robot.queue.get(command_id)
+    if item is None:
+        return jsonify({"error": f"Unknown command {command_id}"}), 404
+    return jsonify(item.to_dict()), 200
+
+
+@app.route('/queue', methods=['DELETE'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/queue', methods=['DELETE'])
+def clear_queue(robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    return jsonify({"status": "Queue cleared", "cancelled": robot.queue.cancel_motions()}), 200
+
+
+@app.route('/execute_batch', methods=['POST'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/execute_batch', methods=['POST'])
+def execute_batch(robot_id):
+    """
+    Body: a JSON list of commands, or {"commands": [...]}. The commands go to
+    the robot in one TCP write; query replies come back in order. Motions
+    and stopMotor go through the robot's queue instead (as with /execute),
+    so their results carry a command_id and status.
+    """
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+
+    body = request.get_json(silent=True)
+    commands = body.get("commands") if isinstance(body, dict) else body
+    if not isinstance(commands, list) or not commands or not all(isinstance(c, str) for c in commands):
+        return jsonify({"error": "Expected a non-empty JSON list of command strings"}), 400
+
+    commands = [unquote(c).strip().rstrip(';') for c in commands]
+    if any(not c or "\n" in c for c in commands):
+        return jsonify({"error": "Commands must be non-empty single lines"}), 400
+
+    try:
+        results = send_batch_via_wifi(commands, robot)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    if results is None:
+        return jsonify({"error": f"Failed to send batch via WiFi to {robot.host}:{robot.port}"}), 500
+    out = []
+    for c, r in zip(commands, results):
+        if isinstance(r, QueuedCommand):
+            out.append({"command": c, "command_id": r.id, "status": r.status,
+                        "starts_in_ms": round(r.starts_in * 1000), "response": r.result})
+        else:
+            out.append({"command": c, "response": r})
+    return jsonify({
+        "status": "Batch sent",
+        "count": len(commands),
+        "results": out,
+    }), 200
+
+
+@app.route('/broadcast', methods=['POST'])
+def broadcast():
+    """
+    Push one command or one program to many robots at once.
+    Body: {"command": "setRed"} or {"program": "<generated code>"}, plus
+    optional "robots": [ids] (default: all), "deadline_ms" per robot and
+    "default_ms" for programs. Returns a per-robot result map and the start
+    skew across robots in ms.
+    """
+    body = request.get_json(silent=True) or {}
+    command, code = body.get("command"), body.get("program")
+    if (command is None) == (code is None):
+        return jsonify({"error": "Give exactly one of 'command' or 'program'"}), 400
+    robot_ids = body.get("robots")
+    if robot_ids is not None and not isinstance(robot_ids, list):
+        return jsonify({"error": "'robots' must be a list of robot ids"}), 400
+    try:
+        deadline = int(body.get("deadline_ms", BROADCAST_DEADLINE_MS)) / 1000.0
+        default_ms = int(body.get("default_ms", DEFAULT_STEP_MS))
+    except (ValueError, TypeError):
+        return jsonify({"error": "'deadline_ms' and 'default_ms' must be integers"}), 400
+
+    targets, unknown = robots.select(robot_ids)
+    if unknown:
+        return jsonify({"error": f"Unknown robot(s): {unknown}"}), 404
+    if not targets:
+        return jsonify({"error": "No robots to broadcast to"}), 400
+
+    if command is not None:
+        command = unquote(str(command)).strip().rstrip(';')
+        if not command or "\n" in command:
+            return jsonify({"error": "Command must be a non-empty single line"}), 400
+        return jsonify(robots.broadcast_command(targets, command, deadline)), 200
+
+    if not isinstance(code, str) or not code.strip():
+        return jsonify({"error": "Missing 'program' (generated code string)"}), 400
+    try:
+        return jsonify(robots.broadcast_program(targets, code, default_ms, deadline)), 200
+    except ProgramError as e:
+        return jsonify({"error": f"Invalid program: {e}"}), 400
+
+
+# --- Server-side program execution (replaces the browser setTimeout scheduler) ---
+
+@app.route('/run', methods=['POST'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/run', methods=['POST'])
+def run_program(robot_id):
+    """
+    Start the generated Blockly program. Body: {"program": "<generated code>"}
+    with an optional "default_ms" step length for lines without a duration.
+    """
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+
+    body = request.get_json(silent=True) or {}
+    code = body.get("program")
+    if not isinstance(code, str) or not code.strip():
+        return jsonify({"error": "Missing 'program' (generated code string)"}), 400
+    try:
+        default_ms = int(body.get("default_ms", DEFAULT_STEP_MS))
+        run = robot.runner.start(code, default_ms=default_ms)
+    except (ProgramError, ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid program: {e}"}), 400
+    except RuntimeError as e:
+        active = robot.runner.active()
+        return jsonify({"error": str(e), "run_id": active.id if active else None}), 409
+    return jsonify({"status": "Program started", "robot": robot.id, "run_id": run.id}), 202
+
+
+@app.route('/run/status', methods=['GET'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/run/status', methods=['GET'])
+def run_status_active(robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    run = robot.runner.active()
+    if run is None:
+        return jsonify({"status": "idle"}), 200
+    return jsonify(run.to_dict()), 200
+
+
+@app.route('/run/<run_id>', methods=['GET'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/run/<run_id>', methods=['GET'])
+def run_status(run_id, robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    run = robot.runner.get(run_id)
+    if run is None:
+        return jsonify({"error": f"Unknown run {run_id}"}), 404
+    return jsonify(run.to_dict()), 200
+
+
+@app.route('/run/<run_id>/cancel', methods=['POST'], defaults={'robot_id': None})
+@app.route('/robots/<robot_id>/run/<run_id>/cancel', methods=['POST'])
+def run_cancel(run_id, robot_id):
+    robot = lookup_robot(robot_id)
+    if robot is None:
+        return unknown_robot(robot_id)
+    run = robot.runner.get(run_id)
+    if run is None:
+        return jsonify({"error": f"Unknown run {run_id}"}), 404
+    run.cancel()
+    return jsonify({"status": "Cancel requested", "run_id": run_id}), 200
+
+
+def shutdown():
+    """
+    Stop background work and close robot connections (production mode,
+    after the HTTP server has drained).
+    """
+    if reconciler is not None:
+        reconciler.stop()
+    for robot in robots.all():
+        run = robot.runner.active()
+        if run is not None:
+            run.cancel()
+    uploads.close()
+    robot_gateway.close_all()
 
 
 if __name__ == "__main__":
-    # Run on all interfaces so your browser at 127.0.0.1 can reach it
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    parser = argparse.ArgumentParser(description="osu-v4 robot server")
+    parser.add_argument("--production", action="store_true",
+                        help="serve with a threaded production server (or SERVER_MODE=production)")
+    parser.add_argument("--host", default=os.environ.get("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVER_PORT", "5001")))
+    parser.add_argument("--threads", type=int,
+                        default=int(os.environ.get("SERVER_THREADS", serving.DEFAULT_THREADS)),
+                        help="request threads in production mode (each /events stream gets its own on top)")
+    args = parser.parse_args()
+
+    mode = "production" if args.production else os.environ.get("SERVER_MODE", "dev")
+    if mode not in serving.SERVER_MODES:
+        parser.error(f"SERVER_MODE must be one of {', '.join(serving.SERVER_MODES)}")
+    if mode == "production":
+        serving.serve(app, args.host, args.port, threads=args.threads + EVENTS.max_subscribers,
+                      max_body=app.config['MAX_CONTENT_LENGTH'], on_stop=EVENTS.close_all,
+                      on_shutdown=shutdown)
+    else:
+        # Run on all interfaces so your browser at 127.0.0.1 can reach it
+        app.run(host=args.host, port=args.port, debug=True)
@@ -0,0 +1,110 @@
+"""
+Run the Flask app under a production WSGI server instead of the Werkzeug
+debug server:
+
+    python server.py --production
+    SERVER_MODE=production python server.py
+
+Waitress (pip install waitress) is used when available, otherwise Werkzeug's
+threaded server with debugging and the reloader off.
+
+Requests are served by a pool of threads in ONE process. Robot sockets,
+state shadows, program runs and the picture index live in this process, and
+the firmware accepts only four TCP clients, so several worker processes
+would each open their own connections and disagree about robot state.
+Request threads mostly wait on the robot gateway's event loop, which is
+where the concurrency comes from.
+"""
+import signal
+import threading
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+SERVER_MODES = ("dev", "production")
+DEFAULT_THREADS = 32             # enough for a classroom's worth of open browsers
+DEFAULT_CONNECTION_LIMIT = 256   # open sockets, keep-alive included
+DEFAULT_KEEPALIVE = 30           # seconds an idle connection is kept open
+DEFAULT_MAX_BODY = 16 * 1024 * 1024
+SHUTDOWN_GRACE = 10              # seconds in-flight requests get to finish
+
+
+def _stop_on(signals, stop):
+    """
+    Call `stop()` on each of `signals` (main thread only).
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in signals:
+        if hasattr(signal, sig):
+            signal.signal(getattr(signal, sig), lambda *_: stop())
+
+
+def _serve_waitress(app, host, port, threads, connection_limit, keepalive, max_body, on_stop):
+    server = waitress.create_server(
+        app, host=host, port=port, threads=threads,
+        connection_limit=connection_limit,
+        channel_timeout=keepalive,
+        max_request_body_size=max_body,
+        ident="osu-v4",
+    )
+    print(f"[serve] waitress on http://{host}:{port} ({threads} threads, "
+          f"{connection_limit} connections, keep-alive {keepalive}s)")
+
+    def stop():
+        if on_stop is not None:
+            on_stop()
+        raise SystemExit   # waitress.run() then drains its task queue
+
+    _stop_on(("SIGINT", "SIGTERM", "SIGBREAK"), stop)
+    try:
+        server.run()
+    finally:
+        server.task_dispatcher.shutdown(timeout=SHUTDOWN_GRACE)
+        server.close()
+
+
+def _serve_werkzeug(app, host, port, keepalive, on_stop):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class _Handler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive
+        timeout = keepalive
+
+    server = make_server(host, port, app, threaded=True, request_handler=_Handler)
+    server.daemon_threads = False       # let in-flight requests finish on shutdown
+    print(f"[serve] waitress not installed; Werkzeug threaded server on http://{host}:{port}")
+
+    def stop():
+        if on_stop is not None:
+            on_stop()
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    _stop_on(("SIGINT", "SIGTERM", "SIGBREAK"), stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def serve(app, host="0.0.0.0", port=5001, threads=DEFAULT_THREADS,
+          connection_limit=DEFAULT_CONNECTION_LIMIT, keepalive=DEFAULT_KEEPALIVE,
+          max_body=DEFAULT_MAX_BODY, on_stop=None, on_shutdown=None):
+    """
+    Serve `app` until SIGINT/SIGTERM. `on_stop()` runs as soon as the
+    signal arrives (e.g. to end long-lived streams), then in-flight requests
+    finish and `on_shutdown()` runs.
+    """
+    try:
+        if waitress is not None:
+            _serve_waitress(app, host, port, threads, connection_limit, keepalive, max_body, on_stop)
+        else:
+            _serve_werkzeug(app, host, port, keepalive, on_stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("[serve] shutting down")
+        if on_shutdown is not None:
+            on_shutdown()
@@ -0,0 +1,390 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, send_file, Response
+from werkzeug.security import safe_join
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_EXTS = {
+    ".html", ".htm", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".xml",
+    ".txt", ".md", ".csv", ".ttf", ".otf", ".eot", ".ico", ".cur",
+}
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+ENCODING_EXTS = {"br": ".br", "gzip": ".gz"}
+RECHECK_SECONDS = 2.0             # how stale a manifest entry may get before it is re-stat'ed
+HOT_CACHE_BYTES = 32 * 1024 * 1024
+HOT_FILE_MAX_BYTES = 1024 * 1024  # bigger files are streamed from disk
+
+# src="./x.js" / href="css/y.css" -> local, relative asset URLs only
+ASSET_URL_RE = re.compile(r'''(\b(?:src|href)\s*=\s*")(\./)?([^"?#:]+?)(")''')
+
+
+class _Entry:
+    __slots__ = ("path", "size", "mtime", "hash", "mime", "checked", "variants")
+
+    def __init__(self, path, size, mtime, digest, mime):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.hash = digest
+        self.mime = mime
+        self.checked = time.monotonic()
+        self.variants = {}   # encoding -> variant path, or None if not worth it
+
+
+class _HotCache:
+    """
+    Size-bounded LRU of file bodies, keyed by (content hash, encoding). A
+    changed file gets a new hash, so stale bodies are never served; they
+    just age out (or are dropped by `discard`).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._items[key] = body
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def discard(self, digest: str):
+        with self._lock:
+            for key in [k for k in self._items if k[0] == digest]:
+                self.bytes -= len(self._items.pop(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self.bytes,
+                    "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()[:20]
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class StaticAssets:
+    """
+    Static asset layer for the Blockly UI in data/.
+
+    - Content-hash ETags, answered with 304 on If-None-Match.
+    - Pre-built gzip (and brotli, when the `brotli` module is installed)
+      variants, cached on disk by content hash and picked by Accept-Encoding.
+    - index.html is served with every local script/stylesheet/image URL
+      fingerprinted (?v=<hash>). Fingerprinted requests are cached as
+      immutable for a year; everything else revalidates with its ETag.
+
+    - `build_manifest()` records size, hash and MIME type of every file at
+      startup. Requests are answered from the manifest and, for small files,
+      from an in-memory LRU, so the hot path does no stat/open; an entry is
+      re-stat'ed at most every `recheck` seconds to pick up edits.
+
+    Run `python static_assets.py` to pre-build all compressed variants ahead
+    of time (otherwise each variant is built on its first request).
+    """
+
+    def __init__(self, root: str, cache_dir: str, index_name="index.html",
+                 hot_bytes=HOT_CACHE_BYTES, recheck=RECHECK_SECONDS):
+        self.root = os.path.abspath(root)
+        self.cache_dir = cache_dir
+        self.index_name = index_name
+        self.recheck = recheck
+        self.hot = _HotCache(hot_bytes)
+        self._entries = {}
+        self._generation = 0    # bumped whenever a manifest entry changes
+        self._index = None      # ((hash, generation), refs, {encoding: body}, etag) of index.html
+        self._lock = threading.Lock()
+        self.encodings = ["br", "gzip"] if brotli else ["gzip"]
+
+    # --- manifest ---
+
+    def _key(self, rel: str):
+        rel = posixpath.normpath(rel.replace("\\", "/").lstrip("/"))
+        # safe_join also rejects what only Windows treats as absolute or a
+        # separator, e.g. "C:secret" or a drive-relative path.
+        if rel in (".", "..") or safe_join(self.root, rel) is None:
+            return None
+        return rel
+
+    def _load(self, key: str, old=None):
+        """
+        stat() one file and (re)hash it if it changed since `old`.
+        """
+        path = safe_join(self.root, key)
+        try:
+            st = os.stat(path) if path is not None else None
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            if old is not None:
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._generation += 1
+                self.hot.discard(old.hash)
+            return None
+        if old is not None and old.mtime == st.st_mtime and old.size == st.st_size:
+            old.checked = time.monotonic()
+            return old
+
+        mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        entry = _Entry(path, st.st_size, st.st_mtime, _file_hash(path), mime)
+        with self._lock:
+            self._entries[key] = entry
+            self._generation += 1
+        if old is not None and old.hash != entry.hash:
+            self.hot.discard(old.hash)
+        return entry
+
+    def build_manifest(self) -> dict:
+        """
+        Walk root once and record size, hash and MIME type of every file.
+        """
+        started = time.monotonic()
+        files = total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                key = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                with self._lock:
+                    old = self._entries.get(key)
+                entry = self._load(key, old)
+                if entry is not None:
+                    files += 1
+                    total += entry.size
+        summary = {"files": files, "bytes": total,
+                   "seconds": round(time.monotonic() - started, 3)}
+        print(f"[assets] manifest: {files} files, {total} bytes in {summary['seconds']}s")
+        return summary
+
+    def entry(self, rel: str):
+        """
+        Manifest entry (hash/MIME metadata) for a file under root, or None if
+        it does not exist. Files added after startup are picked up on demand.
+        """
+        key = self._key(rel)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.checked < self.recheck:
+            return entry
+        return self._load(key, entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            files, total = len(self._entries), sum(e.size for e in self._entries.values())
+            generation = self._generation
+        return {"files": files, "bytes": total, "generation": generation, "hot": self.hot.stats()}
+
+    @staticmethod
+    def compressible(entry) -> bool:
+        ext = os.path.splitext(entry.path)[1].lower()
+        return entry.size >= COMPRESS_MIN_BYTES and ext in COMPRESSIBLE_EXTS
+
+    # --- compressed variants (on disk, keyed by content hash) ---
+
+    def variant(self, entry, encoding: str):
+        """
+        Path of the pre-built `encoding` variant for `entry`, building it on
+        first use. None if compression would not pay off.
+        """
+        if encoding in entry.variants:
+            return entry.variants[encoding]
+        path = os.path.join(self.cache_dir, entry.hash + ENCODING_EXTS[encoding])
+        if os.path.isfile(path):
+            entry.variants[encoding] = path if os.path.getsize(path) > 0 else None
+            return entry.variants[encoding]
+        with open(entry.path, "rb") as f:
+            data = _compress(f.read(), encoding)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            # An empty marker records "not worth compressing" for this hash.
+            f.write(data if len(data) < entry.size * 0.9 else b"")
+        os.replace(tmp, path)
+        entry.variants[encoding] = path if os.path.getsize(path) > 0 else None
+        return entry.variants[encoding]
+
+    def _negotiate(self):
+        return request.accept_encodings.best_match(self.encodings)
+
+    # --- responses ---
+
+    def _cache_control(self, entry) -> str:
+        fingerprint = request.args.get("v")
+        return IMMUTABLE_CACHE if fingerprint and fingerprint == entry.hash else REVALIDATE_CACHE
+
+    def _body(self, entry, path: str, encoding):
+        """
+        Bytes of `path` from the hot cache, or None if the file is too big
+        to keep in memory.
+        """
+        key = (entry.hash, encoding)
+        body = self.hot.get(key)
+        if body is None and entry.size <= HOT_FILE_MAX_BYTES:
+            with open(path, "rb") as f:
+                body = f.read()
+            self.hot.put(key, body)
+        return body
+
+    def serve(self, rel: str):
+        """
+        Response for a file under root, or None if it does not exist.
+        """
+        if rel == self.index_name:
+            return self.serve_index()
+        entry = self.entry(rel)
+        if entry is None:
+            return None
+
+        path, etag, encoding = entry.path, entry.hash, None
+        if self.compressible(entry):
+            encoding = self._negotiate()
+            variant = self.variant(entry, encoding) if encoding else None
+            if variant:
+                path, etag = variant, f"{entry.hash}-{encoding}"
+            else:
+                encoding = None
+
+        body = self._body(entry, path, encoding)
+        if body is not None:
+            resp = Response(body, mimetype=entry.mime)
+            resp.set_etag(etag)
+            resp.last_modified = entry.mtime
+            resp.make_conditional(request, accept_ranges=True, complete_length=len(body))
+        else:
+            resp = send_file(path, mimetype=entry.mime, etag=etag, conditional=True,
+                             last_modified=entry.mtime, max_age=None)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        if self.compressible(entry):
+            resp.headers["Vary"] = "Accept-Encoding"
+        resp.headers["Cache-Control"] = self._cache_control(entry)
+        return resp
+
+    def fingerprint_html(self, html: str, refs=None) -> str:
+        """
+        Append ?v=<content hash> to every local asset URL in the page so
+        those requests can be cached as immutable. Fingerprinted paths are
+        appended to `refs` if given.
+        """
+        def repl(match):
+            entry = self.entry(match.group(3))
+            if entry is None:
+                return match.group(0)
+            if refs is not None:
+                refs.append(match.group(3))
+            return f"{match.group(1)}{match.group(2) or ''}{match.group(3)}?v={entry.hash}{match.group(4)}"
+        return ASSET_URL_RE.sub(repl, html)
+
+    def serve_index(self):
+        entry = self.entry(self.index_name)
+        if entry is None:
+            return None
+        with self._lock:
+            cached = self._index
+        if cached is not None:
+            # Re-validate the fingerprinted assets too (a manifest lookup each
+            # unless due for a re-stat); any change bumps the generation.
+            for ref in cached[1]:
+                self.entry(ref)
+        with self._lock:
+            version = (entry.hash, self._generation)
+        if cached is None or cached[0] != version:
+            refs = []
+            with open(entry.path, encoding="utf-8") as f:
+                body = self.fingerprint_html(f.read(), refs).encode("utf-8")
+            variants = {None: body}
+            for enc in self.encodings:
+                variants[enc] = _compress(body, enc)
+            with self._lock:
+                version = (entry.hash, self._generation)
+            cached = (version, refs, variants, hashlib.sha256(body).hexdigest()[:20])
+            with self._lock:
+                self._index = cached
+
+        _, _, variants, digest = cached
+        encoding = self._negotiate()
+        etag = f"{digest}-{encoding}" if encoding else digest
+        resp = Response(variants[encoding], mimetype="text/html")
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = REVALIDATE_CACHE
+        resp.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        return resp.make_conditional(request)
+
+    # --- ahead-of-time build ---
+
+    def build_all(self) -> dict:
+        """
+        Pre-build every compressed variant under root.
+        """
+        self.build_manifest()
+        with self._lock:
+            entries = list(self._entries.values())
+        totals = {"files": len(entries), "compressed": 0, "bytes_in": 0, "bytes_out": 0}
+        for entry in entries:
+            if not self.compressible(entry):
+                continue
+            for enc in self.encodings:
+                variant = self.variant(entry, enc)
+                if variant and enc == self.encodings[0]:
+                    totals["compressed"] += 1
+                    totals["bytes_in"] += entry.size
+                    totals["bytes_out"] += os.path.getsize(variant)
+        return totals
+
+
+if __name__ == "__main__":
+    base = os.path.dirname(os.path.abspath(__file__))
+    assets = StaticAssets(os.path.join(base, "data"),
+                          os.environ.get("ASSET_CACHE_DIR", os.path.join(base, ".asset_cache")))
+    totals = assets.build_all()
+    print(f"{totals['files']} files, {totals['compressed']} compressed "
+          f"({assets.encodings[0]}): {totals['bytes_in']} -> {totals['bytes_out']} bytes")
@@ -0,0 +1,68 @@
+"""
+Robots driven through the real gateway, queue and runner against
+mock_robot.py's firmware model.
+
+Run with: python -m pytest osu-v4/tests
+"""
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fleet import RobotRegistry  # noqa: E402
+from mock_robot import MockFleet  # noqa: E402
+from robot_link import RobotGateway  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def robot():
+    mocks = MockFleet(1, base_port=free_port(), http_base_port=0).start()
+    gateway = RobotGateway()
+    robots = RobotRegistry(gateway)
+    mock = mocks.robots[0]
+    yield robots.add("mock0", mock.host, mock.port), mock
+    gateway.close_all()
+    mocks.stop()
+
+
+def wait_finished(run, timeout=10.0):
+    give_up = time.monotonic() + timeout
+    while run.active and time.monotonic() < give_up:
+        time.sleep(0.01)
+    return run.status
+
+
+def test_stop_motor_in_program_does_not_cancel_the_run(robot):
+    robot, mock = robot
+    code = ("void loop() {\n"
+            "moveForward(300);\nstopMotor();\nsetRed();\nmoveBackward(300);\nsetBlue();\n"
+            "}\n")
+
+    run = robot.runner.start(code, default_ms=50)
+
+    assert wait_finished(run) == "done"
+    assert run.steps == 5 and run.failures == 0
+    assert [entry["command"] for entry in run.log] == [
+        "moveForward(300)", "stopMotor", "setRed", "moveBackward(300)", "setBlue"]
+    assert mock.stats["motions"] == 2 and mock.stats["ignored"] == 0
+
+
+def test_stop_from_outside_cancels_the_run(robot):
+    robot, _ = robot
+    run = robot.runner.start("void loop() {\nmoveForward(2000);\nsetRed();\n}\n", default_ms=50)
+    while run.steps == 0 and run.active:
+        time.sleep(0.01)
+
+    robot.queue.stop()
+
+    assert wait_finished(run) == "cancelled"
@@ -0,0 +1,152 @@
+"""
+Raw .565 frames must hold exactly the bytes the firmware's PNGDrawCallback
+leaves in rawImage for the same picture:
+
+    png.getLineAsRGB565(pDraw, dest, PNG_RGB565_BIG_ENDIAN, 0xFFFFFFFF);
+
+The reference below decodes PNGs without Pillow (zlib + the PNG filters)
+and packs pixels the way PNGdec does, so a frame is checked against the
+PNG bytes rather than against image_prep's own conversion.
+
+Run with: python -m pytest osu-v4/tests
+"""
+import io
+import os
+import struct
+import sys
+import zlib
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+import image_prep  # noqa: E402
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(raw: bytes, height: int, stride: int, bpp: int) -> list:
+    rows, prev, pos = [], bytearray(stride), 0
+    for _ in range(height):
+        kind, line = raw[pos], bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        for i in range(stride):
+            left = line[i - bpp] if i >= bpp else 0
+            up_left = prev[i - bpp] if i >= bpp else 0
+            if kind == 1:
+                line[i] = (line[i] + left) & 0xFF
+            elif kind == 2:
+                line[i] = (line[i] + prev[i]) & 0xFF
+            elif kind == 3:
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+            elif kind == 4:
+                line[i] = (line[i] + _paeth(left, prev[i], up_left)) & 0xFF
+        rows.append(line)
+        prev = line
+    return rows
+
+
+def pngdec_rgb565_big_endian(png: bytes):
+    """
+    (width, height, pixel bytes) as getLineAsRGB565(..., PNG_RGB565_BIG_ENDIAN)
+    writes them, for the non-interlaced 8-bit truecolor and 1/2/4/8-bit
+    palette PNGs server.py produces.
+    """
+    assert png[:8] == PNG_SIGNATURE
+    pos, idat, palette = 8, b"", None
+    while True:
+        length, kind = struct.unpack(">I4s", png[pos:pos + 8])
+        body = png[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b"IHDR":
+            width, height, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = [tuple(body[i:i + 3]) for i in range(0, len(body), 3)]
+        elif kind == b"IDAT":
+            idat += body
+        elif kind == b"IEND":
+            break
+    assert interlace == 0
+    assert (color, depth) == (2, 8) or (color == 3 and depth in (1, 2, 4, 8))
+
+    channels = 3 if color == 2 else 1
+    stride = (width * channels * depth + 7) // 8
+    rows = _unfilter(zlib.decompress(idat), height, stride, max(1, channels * depth // 8))
+
+    out = bytearray()
+    for line in rows:
+        for x in range(width):
+            if color == 2:
+                r, g, b = line[3 * x:3 * x + 3]
+            else:
+                per_byte = 8 // depth
+                shift = 8 - depth * (x % per_byte + 1)
+                r, g, b = palette[(line[x // per_byte] >> shift) & ((1 << depth) - 1)]
+            pixel = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+            out += bytes((pixel >> 8, pixel & 0xFF))   # PNG_RGB565_BIG_ENDIAN
+    return width, height, bytes(out)
+
+
+def expected_frame(png: bytes) -> bytes:
+    width, height, pixels = pngdec_rgb565_big_endian(png)
+    # "R565", then width and height as little-endian uint16 (osu-v4.ino).
+    return b"R565" + width.to_bytes(2, "little") + height.to_bytes(2, "little") + pixels
+
+
+def gradient(size=image_prep.DISPLAY_SIZE) -> Image.Image:
+    # Every 8-bit value in each channel, so every truncation boundary is hit.
+    w, h = size
+    img = Image.new("RGB", (w, h))
+    img.putdata([((x + y) & 0xFF, (x * 7 + y * 3) & 0xFF, (255 - x + 2 * y) & 0xFF)
+                 for y in range(h) for x in range(w)])
+    return img
+
+
+def png_bytes(img: Image.Image) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_frame_matches_pngdec_for_truecolor_png():
+    png = png_bytes(gradient())
+
+    assert image_prep.rgb565_frame(Image.open(io.BytesIO(png))) == expected_frame(png)
+
+
+def test_frame_matches_pngdec_for_quantized_png():
+    # What /upload sends to the robot by default: a re-encoded palette PNG.
+    png, info = image_prep.prepare_png(png_bytes(gradient((320, 240))), colors=16)
+    assert not info["kept_original"]
+    assert png[25] == 3   # IHDR colour type: indexed
+
+    assert image_prep.rgb565_frame(Image.open(io.BytesIO(png))) == expected_frame(png)
+
+
+def test_prepare_raw_matches_pngdec_for_display_sized_upload():
+    png = png_bytes(gradient())
+
+    frame, info = image_prep.prepare_raw(png)
+
+    assert frame == expected_frame(png)
+    assert info["bytes"] == len(frame) == image_prep.RAW_FRAME_HEADER.size + 240 * 240 * 2
+
+
+def test_frame_header():
+    frame = image_prep.rgb565_frame(Image.new("RGB", (3, 2), (255, 255, 255)))
+
+    assert frame[:8] == b"R565\x03\x00\x02\x00"
+    assert frame[8:] == b"\xff\xff" * 6
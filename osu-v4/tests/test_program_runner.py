@@ -0,0 +1,269 @@
+"""
+The server-side interpreter for generated loop() code: parsing, condition
+evaluation and the monotonic step schedule.
+
+Run with: python -m pytest osu-v4/tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from program_runner import (  # noqa: E402
+    MAX_WHILE_ITERATIONS, ProgramError, ProgramRun, evaluate, extract_loop_lines, parse_program,
+)
+from robot_link import motion_ms  # noqa: E402
+
+
+def parse(code: str) -> list:
+    return parse_program(extract_loop_lines(code))
+
+
+class FakeRobot:
+    """
+    send() for a ProgramRun: records (seconds since start, command) and
+    answers GET_LED_COLOR with `led`.
+    """
+
+    def __init__(self, led="#FF0000", send_delay=0.0):
+        self.led = led
+        self.send_delay = send_delay
+        self.sent = []
+        self.t0 = None
+
+    def send(self, command):
+        if self.t0 is None:
+            self.t0 = time.monotonic()
+        self.sent.append((time.monotonic() - self.t0, command))
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        if command == "GET_LED_COLOR":
+            return self.led
+        if command.startswith("set"):
+            self.led = {"setRed": "#FF0000", "setGreen": "#00FF00", "setBlue": "#0000FF"}[command]
+        return "OK"
+
+    @property
+    def commands(self):
+        return [c for _, c in self.sent]
+
+
+def run(code: str, robot=None, default_ms=0, timeout=10.0) -> ProgramRun:
+    robot = robot or FakeRobot()
+    program = ProgramRun(parse(code), robot.send, default_ms=default_ms)
+    program.start()
+    program._thread.join(timeout)
+    return program
+
+
+# --- parsing ---
+
+def test_extract_loop_lines_takes_only_the_loop_body():
+    code = ("void setup() {\n  pinMode(2, OUTPUT);\n}\n\n"
+            "void loop() {\n  setRed(); // color\n\n  moveForward(100);\n}\n")
+
+    assert extract_loop_lines(code) == ["setRed();", "moveForward(100);"]
+
+
+def test_commands_durations_and_delays():
+    assert parse("setRed();\nmoveForward(300);\nstopMotor();\ndelay(250);") == [
+        ("cmd", "setRed", None),
+        ("cmd", "moveForward(300)", 300),
+        ("cmd", "stopMotor", None),
+        ("wait", 250),
+    ]
+
+
+def test_fractional_durations_are_rounded():
+    assert parse("moveForward(333.3);\nmoveBackward(0.6);\ndelay(12.5);") == [
+        ("cmd", "moveForward(333)", 333),
+        ("cmd", "moveBackward(1)", 1),
+        ("wait", 12),
+    ]
+    # Rewritten so the motion queue and the firmware see the same duration.
+    assert motion_ms(parse("moveForward(333.3);")[0][1]) == 333
+
+
+def test_if_else_for_while_and_assignment():
+    code = """
+    int my_count = 0;
+    if (getCurrentLEDColor() == "#FF0000") {
+      setGreen();
+    } else {
+      setRed();
+    }
+    for (int count = 0; count < 3; count++) {
+      moveForward(100);
+    }
+    while (my_count < 2)
+    {
+      my_count = my_count + 1;
+    }
+    """
+
+    assert parse(code) == [
+        ("set", "my_count", "0"),
+        ("if", 'getCurrentLEDColor() == "#FF0000"', [("cmd", "setGreen", None)], [("cmd", "setRed", None)]),
+        ("for", 3, [("cmd", "moveForward(100)", 100)]),
+        ("while", "my_count < 2", [("set", "my_count", "my_count + 1")]),
+    ]
+
+
+def test_for_loop_bounds():
+    assert parse("for (int i = 1; i <= 4; i++) {\nsetRed();\n}")[0][1] == 4
+    assert parse("for (int i = 5; i < 2; i++) {\nsetRed();\n}")[0][1] == 0
+
+
+@pytest.mark.parametrize("code", [
+    "if (x) {\nsetRed();\n} else if (y) {\nsetBlue();\n}",
+    "}\nsetRed();",
+    "if (x) {\nsetRed();",
+    "while (x)\nsetRed();",
+    "setRed();\n} else {",
+])
+def test_unsupported_or_unbalanced_syntax_is_rejected(code):
+    with pytest.raises(ProgramError):
+        parse(code)
+
+
+# --- conditions ---
+
+def test_evaluate_c_operators_and_literals():
+    variables = {"my_x": 3}
+
+    assert evaluate("my_x > 2 && !(my_x == 4)", variables, {}) is True
+    assert evaluate("my_x < 2 || false", variables, {}) is False
+    assert evaluate("(my_x + 1) * 2 % 5", variables, {}) == 3
+    assert evaluate("1 < my_x <= 3", variables, {}) is True
+    assert evaluate("HIGH != LOW", variables, {}) is True
+
+
+def test_evaluate_unknown_my_tokens_read_as_numbers():
+    assert evaluate("my_1_5", {}, {}) == 1.5
+    assert evaluate("my_2", {}, {}) == 2.0
+    assert evaluate("other", {}, {}) == 0
+
+
+def test_evaluate_led_condition_calls_the_query():
+    calls = []
+
+    def led():
+        calls.append(1)
+        return "#00FF00"
+
+    functions = {"getCurrentLEDColor": led}
+    assert evaluate('getCurrentLEDColor() == "#00FF00"', {}, functions) is True
+    assert evaluate('getCurrentLEDColor() != "#00FF00"', {}, functions) is False
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("expr", [
+    "__import__('os').system('true')",
+    "my_x.real",
+    "[1, 2]",
+    "lambda: 1",
+    "open()",
+    "getCurrentLEDColor(1)",
+    "1 +",
+])
+def test_evaluate_rejects_unsupported_syntax(expr):
+    with pytest.raises(ProgramError):
+        evaluate(expr, {"my_x": 1}, {"getCurrentLEDColor": lambda: ""})
+
+
+# --- execution ---
+
+def test_run_takes_the_branch_the_led_query_selects():
+    robot = FakeRobot(led="#0000FF")
+    code = ('if (getCurrentLEDColor() == "#FF0000") {\nsetGreen();\n} else {\nsetRed();\n}\n'
+            'if (getCurrentLEDColor() == "#FF0000") {\nmoveForward(10);\n}')
+
+    program = run(code, robot)
+
+    assert program.status == "done"
+    assert robot.commands == ["GET_LED_COLOR", "setRed", "GET_LED_COLOR", "moveForward(10)"]
+
+
+def test_run_loops_and_variables():
+    robot = FakeRobot()
+    code = """
+    int my_n = 0;
+    for (int count = 0; count < 2; count++) {
+      setBlue();
+    }
+    while (my_n < 3) {
+      my_n = my_n + 1;
+      moveForward(5);
+    }
+    """
+
+    program = run(code, robot)
+
+    assert program.status == "done"
+    assert robot.commands == ["setBlue", "setBlue"] + ["moveForward(5)"] * 3
+    assert program.variables == {"my_n": 3}
+
+
+def test_while_loops_are_capped():
+    robot = FakeRobot()
+
+    program = run("while (true) {\nsetRed();\n}", robot)
+
+    assert program.status == "done"
+    assert len(robot.commands) == MAX_WHILE_ITERATIONS
+
+
+def test_bad_condition_fails_the_run():
+    program = run("if (my_x.real) {\nsetRed();\n}")
+
+    assert program.status == "failed"
+    assert "Unsupported" in program.error
+
+
+def test_steps_follow_a_monotonic_schedule():
+    # Each send takes 30 ms, but steps stay on start + sum of durations
+    # instead of drifting by the send time.
+    robot = FakeRobot(send_delay=0.03)
+    code = "moveForward(100);\nsetRed();\ndelay(50);\nmoveBackward(100);\nsetBlue();"
+
+    program = run(code, robot, default_ms=100)
+
+    assert program.status == "done"
+    times = [t for t, _ in robot.sent]
+    for actual, due in zip(times, [0.0, 0.1, 0.25, 0.35]):
+        assert actual == pytest.approx(due, abs=0.025)
+    assert program.max_lateness_ms < 25
+
+
+def test_cancel_stops_the_run_and_the_motors():
+    robot = FakeRobot()
+    program = ProgramRun(parse("moveForward(5000);\nsetRed();"), robot.send)
+    program.start()
+    while not robot.sent:
+        time.sleep(0.005)
+
+    program.cancel()
+    program._thread.join(5)
+
+    assert program.status == "cancelled"
+    assert robot.commands == ["moveForward(5000)", "stopMotor"]
+
+
+def test_start_at_delays_the_first_step():
+    robot = FakeRobot()
+    sent_at = []
+
+    def send(command):
+        sent_at.append(time.monotonic())
+        return robot.send(command)
+
+    start_at = time.monotonic() + 0.1
+    program = ProgramRun(parse("setRed();"), send, default_ms=0, start_at=start_at)
+    program.start()
+    program._thread.join(5)
+
+    assert program.status == "done"
+    assert sent_at[0] >= start_at
@@ -0,0 +1,186 @@
+"""
+Reply matching on the persistent robot connection: replies split across
+TCP segments, several replies in one segment, non-query commands in
+between, concurrent callers, and the reply-timeout path.
+
+The scripted robot below answers every GET_ line with "re:<line>", so each
+caller can check it got the reply to its own query.
+
+Run with: python -m pytest osu-v4/tests
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import robot_link  # noqa: E402
+from robot_link import RobotGateway  # noqa: E402
+
+
+class ScriptedRobot:
+    """
+    A line server on its own loop. `split` writes replies a few bytes at a
+    time, `coalesce` holds replies until that many queries arrived and
+    writes them at once, `delay` answers late and `silent` never answers.
+    """
+
+    def __init__(self, split=0, coalesce=1, delay=0.0, silent=False):
+        self.split = split
+        self.coalesce = coalesce
+        self.delay = delay
+        self.silent = silent
+        self.received = []
+        self.connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._client, "127.0.0.1", 0), self._loop).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _client(self, reader, writer):
+        self.connections += 1
+        sock = writer.get_extra_info("socket")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        held = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                self.received.append(command)
+                if not command.startswith("GET_") or self.silent:
+                    continue
+                held.append(f"re:{command}\r\n".encode())
+                if len(held) < self.coalesce:
+                    continue
+                payload, held = b"".join(held), []
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if self.split:
+                    for i in range(0, len(payload), self.split):
+                        writer.write(payload[i:i + self.split])
+                        await writer.drain()
+                        await asyncio.sleep(0.002)
+                else:
+                    writer.write(payload)
+                    await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        async def shutdown():
+            self._server.close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+@pytest.fixture
+def link():
+    robots, gateways = [], []
+
+    def connect(**script):
+        robot = ScriptedRobot(**script)
+        gateway = RobotGateway()
+        robots.append(robot)
+        gateways.append(gateway)
+        return robot, gateway, gateway.get("127.0.0.1", robot.port)
+
+    yield connect
+    for gateway in gateways:
+        gateway.close_all()
+    for robot in robots:
+        robot.close()
+
+
+def send_concurrently(conn, commands):
+    with ThreadPoolExecutor(len(commands)) as pool:
+        return list(pool.map(conn.send, commands))
+
+
+def test_reply_split_across_segments(link):
+    robot, _, conn = link(split=3)
+
+    assert conn.send("GET_LED_COLOR") == "re:GET_LED_COLOR"
+    assert conn.send("GET_IP") == "re:GET_IP"
+
+
+def test_replies_coalesced_into_one_segment(link):
+    # All three replies arrive in a single write after the third query.
+    robot, _, conn = link(coalesce=3)
+    queries = ["GET_A", "GET_B", "GET_C"]
+
+    assert conn.send_batch(queries) == ["re:GET_A", "re:GET_B", "re:GET_C"]
+
+
+def test_concurrent_callers_each_get_their_own_reply(link):
+    robot, _, conn = link(split=2, coalesce=4)
+    queries = [f"GET_Q{i}" for i in range(8)]
+
+    replies = send_concurrently(conn, queries)
+
+    assert replies == [f"re:{q}" for q in queries]
+    assert conn.stats()["max_in_flight"] >= 2
+    assert robot.connections == 1
+
+
+def test_non_query_commands_in_between(link):
+    robot, _, conn = link(split=5, coalesce=2)
+    batch = ["setRed", "GET_A", "stopMotor", "setBlue", "GET_B", "setGreen"]
+
+    assert conn.send_batch(batch) == ["OK", "re:GET_A", "OK", "OK", "re:GET_B", "OK"]
+    give_up = time.monotonic() + 2.0
+    while len(robot.received) < len(batch) and time.monotonic() < give_up:
+        time.sleep(0.01)
+    assert robot.received == batch
+
+
+def test_interleaved_senders_and_queries(link):
+    robot, _, conn = link(split=4, coalesce=3)
+    commands = ["GET_1", "setRed", "GET_2", "setBlue", "GET_3", "stopMotor"]
+
+    results = send_concurrently(conn, commands)
+
+    for command, result in zip(commands, results):
+        assert result == (f"re:{command}" if command.startswith("GET_") else "OK")
+
+
+def test_reply_timeout_fails_every_pending_query(link, monkeypatch):
+    monkeypatch.setattr(robot_link, "RECV_TIMEOUT", 0.2)
+    robot, _, conn = link(silent=True)
+
+    assert send_concurrently(conn, ["GET_A", "GET_B", "GET_C"]) == [None, None, None]
+    stats = conn.stats()
+    assert stats["failures"] == 3
+    assert stats["in_flight"] == 0
+    assert not stats["connected"]
+
+
+def test_late_reply_is_not_given_to_the_next_query(link, monkeypatch):
+    # The late reply belongs to the dropped stream; the next query
+    # reconnects and must get its own answer.
+    monkeypatch.setattr(robot_link, "RECV_TIMEOUT", 0.2)
+    robot, _, conn = link(delay=0.4)
+
+    assert conn.send("GET_OLD") is None
+    robot.delay = 0.0
+
+    assert conn.send("GET_NEW") == "re:GET_NEW"
+    assert robot.connections == 2
@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from metrics import REGISTRY
+from pic_store import stream_digest
+
+CHUNK_SIZE = 64 * 1024
+FORWARD_TIMEOUT = (3.0, 10.0)   # (connect, read) seconds for the robot's /upload_image
+UPLOAD_WORKERS = 4
+KEEP_FINISHED_JOBS = 50
+
+HASH_SECONDS = REGISTRY.histogram(
+    "upload_hash_seconds", "Time to SHA-256 an upload before storing it.")
+SAVE_SECONDS = REGISTRY.histogram(
+    "upload_save_seconds", "Time spent writing an upload to the picture store.")
+FORWARD_SECONDS = REGISTRY.histogram(
+    "upload_forward_seconds", "Time to POST an upload to a robot (includes the interleaved save).",
+    ("robot_id",))
+UPLOADS_TOTAL = REGISTRY.counter(
+    "uploads_total", "Uploads by outcome (ok, skipped, error).", ("robot_id", "result"))
+UPLOAD_BYTES_TOTAL = REGISTRY.counter(
+    "upload_bytes_total", "Picture bytes sent to robots.", ("robot_id",))
+
+
+def stream_size(stream) -> int:
+    """
+    Bytes left in a seekable stream, without reading it.
+    """
+    pos = stream.tell()
+    end = stream.seek(0, os.SEEK_END)
+    stream.seek(pos)
+    return end - pos
+
+
+class _TeeBody:
+    """
+    multipart/form-data body for requests.post that reads the upload in
+    chunks and writes every chunk to the local copy on its way to the robot,
+    so the picture is stored and forwarded in a single pass.
+    """
+
+    def __init__(self, source, size: int, sink, filename: str, mimetype: str):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (f"--{boundary}\r\n"
+                      f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                      f"Content-Type: {mimetype}\r\n\r\n").encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+        self._length = len(self._head) + size + len(self._tail)
+        self.source = source
+        self.sink = sink
+        self.copied = 0
+        self.save_seconds = 0.0
+        self._pieces = self._generate()
+        self._pending = memoryview(b"")
+
+    def __len__(self):
+        # Lets requests send a Content-Length instead of a chunked body,
+        # which the ESP32 web server expects.
+        return self._length
+
+    def _chunk(self) -> bytes:
+        chunk = self.source.read(CHUNK_SIZE)
+        if chunk:
+            started = time.perf_counter()
+            self.sink.write(chunk)
+            self.save_seconds += time.perf_counter() - started
+            self.copied += len(chunk)
+        return chunk
+
+    def _generate(self):
+        yield self._head
+        for chunk in iter(self._chunk, b""):
+            yield chunk
+        yield self._tail
+
+    def read(self, size=-1):
+        if not self._pending:
+            self._pending = memoryview(next(self._pieces, b""))
+        if size is None or size < 0:
+            size = len(self._pending)
+        out, self._pending = self._pending[:size], self._pending[size:]
+        return out
+
+    def drain(self):
+        """
+        Finish the local copy when the robot stopped reading early.
+        """
+        for _ in iter(self._chunk, b""):
+            pass
+
+
+class UploadJob:
+    """
+    One picture being stored and forwarded to a robot.
+    """
+
+    def __init__(self, robot_id: str, filename: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.robot_id = robot_id
+        self.filename = filename
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "robot": self.robot_id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class UploadPipeline:
+    """
+    Stores uploads in the picture store (see pic_store) and forwards them to
+    the robot's /upload_image in the same pass. A picture the robot already
+    holds is not sent again. Uploads to one robot are serialized (its web
+    server handles one at a time); different robots proceed in parallel.
+    """
+
+    def __init__(self, store, workers: int = UPLOAD_WORKERS):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._jobs = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def _host_lock(self, host: str) -> threading.Lock:
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    def forward(self, robot, source, filename: str, mimetype="image/png", force=False) -> dict:
+        """
+        Tee `source` (a seekable binary stream) into the store as `filename`
+        and to the robot. The local copy is always completed, even if the
+        robot is unreachable. Unless `force` is set, nothing is sent when
+        the robot already holds the same bytes. Returns a summary; "error"
+        is set if forwarding failed.
+        """
+        size = stream_size(source)
+        with HASH_SECONDS.time():
+            digest = stream_digest(source)
+        result = {
+            "filename": filename,
+            "robot": robot.id,
+            "esp32_ip": robot.host,
+            "bytes": size,
+            "sha256": digest,
+            "skipped": False,
+            "esp32_response_status": None,
+            "esp32_response_text": None,
+            "error": None,
+        }
+        started = time.monotonic()
+        held = None if force else self.store.held_as(robot.id, digest)
+        if held is not None:
+            self.store.add(filename, digest, size)
+            result["skipped"] = True
+            result["held_as"] = held
+            result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+            UPLOADS_TOTAL.inc(robot.id, "skipped")
+            print(f"[upload] {filename} ({size} bytes): {robot.id} already holds it as {held}")
+            return result
+
+        with self.store.writer(digest) as sink:
+            body = _TeeBody(source, size, sink, filename, mimetype)
+            try:
+                with self._host_lock(robot.host), FORWARD_SECONDS.time(robot.id):
+                    resp = requests.post(robot.upload_url, data=body,
+                                         headers={"Content-Type": body.content_type},
+                                         timeout=FORWARD_TIMEOUT)
+                result["esp32_response_status"] = resp.status_code
+                result["esp32_response_text"] = resp.text
+                if resp.status_code >= 400:
+                    result["error"] = f"Robot answered HTTP {resp.status_code}"
+            except requests.RequestException as e:
+                result["error"] = str(e)
+            body.drain()
+        SAVE_SECONDS.observe(body.save_seconds)
+        self.store.add(filename, digest, size)
+        if result["error"] is None:
+            self.store.mark_sent(robot.id, filename, digest)
+            UPLOAD_BYTES_TOTAL.inc(robot.id, amount=size)
+        UPLOADS_TOTAL.inc(robot.id, "error" if result["error"] else "ok")
+        result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+        print(f"[upload] {filename} ({size} bytes) -> {robot.id}: "
+              f"{result['error'] or result['esp32_response_status']} in {result['elapsed_ms']} ms")
+        return result
+
+    # --- background jobs ---
+
+    def _run(self, job: UploadJob, robot, source, mimetype, force):
+        job.status = "running"
+        try:
+            job.result = self.forward(robot, source, job.filename, mimetype, force)
+            job.error = job.result["error"]
+            job.status = "failed" if job.error else "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def submit(self, robot, source, filename: str, mimetype="image/png", force=False) -> UploadJob:
+        """
+        Run `forward` on a worker thread. `source` must outlive the request
+        (e.g. an io.BytesIO of the upload).
+        """
+        job = UploadJob(robot.id, filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if not j.active]
+            for old in sorted(finished, key=lambda j: j.created_at)[:-KEEP_FINISHED_JOBS]:
+                del self._jobs[old.id]
+        self._executor.submit(self._run, job, robot, source, mimetype, force)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def close(self, wait=True):
+        """
+        Stop taking jobs; with `wait`, let queued and running uploads finish.
+        """
+        self._executor.shutdown(wait=wait)